@@ -0,0 +1,138 @@
+"""
+Cold-start time of each app profile.
+
+Every run is a fresh interpreter that builds the app with
+``create_app(profile)``, starts its lifespan (server profile only, as
+Mangum runs the serverless one without) and serves its first requests
+in-process. Reported per profile, as medians over ``--runs``: interpreter
+wall time until ready, app import/build, lifespan startup, the first
+``/health`` and the first ``/api/products/1`` (against a stub upstream).
+
+    python -m benchmarks.coldstart --runs 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROFILES = ("server", "serverless")
+HEADERS = [(b"authorization", b"Bearer benchmark")]
+
+
+async def asgi_get(app, path: str) -> int:
+    """Minimal in-process GET; returns the status code"""
+    status = 0
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "", "headers": HEADERS,
+        "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+def child(profile: str):
+    """One cold start, timed from inside the fresh interpreter"""
+    started = time.perf_counter()
+    from factory import create_app
+    app = create_app(profile)
+    built = time.perf_counter()
+
+    async def serve() -> dict:
+        timings = {"build_ms": (built - started) * 1000}
+        lifespan = app.router.lifespan_context(app) if profile == "server" else None
+        mark = time.perf_counter()
+        if lifespan is not None:
+            await lifespan.__aenter__()
+        timings["lifespan_ms"] = (time.perf_counter() - mark) * 1000
+        for name, path in (("first_health_ms", "/health"), ("first_api_ms", "/api/products/1")):
+            mark = time.perf_counter()
+            status = await asgi_get(app, path)
+            timings[name] = (time.perf_counter() - mark) * 1000
+            if status != 200:
+                raise RuntimeError(f"{path} returned {status}")
+        if lifespan is not None:
+            await lifespan.__aexit__(None, None, None)
+        timings["modules"] = len(sys.modules)
+        return timings
+
+    print(json.dumps(asyncio.run(serve())))
+
+
+def cold_start(profile: str, upstream_url: str) -> dict:
+    env = dict(
+        os.environ,
+        UPSTREAM_BASE_URL=upstream_url,
+        CHAT_HISTORY_BACKEND="memory",
+        CATALOG_MIRROR="0",
+        PYTHONPATH=ROOT,
+    )
+    started = time.perf_counter()
+    output = subprocess.check_output(
+        [sys.executable, "-m", "benchmarks.coldstart", "--child", profile], cwd=ROOT, env=env, text=True
+    )
+    timings = json.loads(output.strip().splitlines()[-1])
+    timings["process_ms"] = (time.perf_counter() - started) * 1000
+    return timings
+
+
+async def run(args: argparse.Namespace) -> dict:
+    from benchmarks.run import git_commit
+    from benchmarks.stub_upstream import start_stub
+
+    stub = await start_stub()
+    upstream_url = "http://%s:%s" % stub.addresses[0][:2]
+    loop = asyncio.get_running_loop()
+    try:
+        results = {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "runs": args.runs,
+            "profiles": {},
+        }
+        for profile in args.profiles:
+            runs = [await loop.run_in_executor(None, cold_start, profile, upstream_url) for _ in range(args.runs)]
+            results["profiles"][profile] = {
+                name: round(statistics.median(run[name] for run in runs), 1) for name in runs[0]
+            }
+            print(f"{profile:>10}: {results['profiles'][profile]}")
+        return results
+    finally:
+        await stub.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Cold starts per profile")
+    parser.add_argument("--profiles", nargs="*", choices=PROFILES, default=list(PROFILES))
+    parser.add_argument("--child", choices=PROFILES, help=argparse.SUPPRESS)
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/<commit>-coldstart.json)")
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args.child)
+
+    results = asyncio.run(run(args))
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", f"{results['commit'] or 'results'}-coldstart.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as handle:
+        json.dump(results, handle, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
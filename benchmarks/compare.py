@@ -0,0 +1,58 @@
+"""
+Compare two benchmark result files, e.g. from two commits.
+
+    python -m benchmarks.compare benchmarks/results/abc123.json benchmarks/results/def456.json
+"""
+import argparse
+import json
+from typing import Iterator, Optional, Tuple
+
+# Lower is better for latencies and memory, higher for throughput
+HIGHER_IS_BETTER = ("throughput_rps", "deliveries_per_second")
+
+
+def flatten(results: dict, prefix: str = "") -> Iterator[Tuple[str, float]]:
+    for key, value in results.items():
+        if key == "config":
+            continue
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            yield from flatten(value, name)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+def change(name: str, before: float, after: float) -> Optional[float]:
+    """Relative change in percent, positive meaning better"""
+    if not before:
+        return None
+    delta = (after - before) / before * 100
+    return delta if name.endswith(HIGHER_IS_BETTER) else -delta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Flag changes worse than this many percent")
+    args = parser.parse_args()
+
+    with open(args.baseline) as handle:
+        baseline = dict(flatten(json.load(handle)))
+    with open(args.candidate) as handle:
+        candidate = dict(flatten(json.load(handle)))
+
+    regressions = 0
+    for name in sorted(set(baseline) & set(candidate)):
+        delta = change(name, baseline[name], candidate[name])
+        flag = ""
+        if delta is not None and delta < -args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        shown = f"{delta:+.1f}%" if delta is not None else "n/a"
+        print(f"{name:<60} {baseline[name]:>12} {candidate[name]:>12} {shown:>9}{flag}")
+    raise SystemExit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
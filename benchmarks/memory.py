@@ -0,0 +1,109 @@
+"""
+Memory footprint of chat connection and message records.
+
+Measures, with ``tracemalloc``, the bytes allocated per ``ClientConnection``
+(10k by default, all in one room) and per stored history message (100k by
+default, as ``ChatFrame`` records and as the dicts they replaced). No
+server is started: only the in-process data structures are measured.
+
+    python -m benchmarks.memory --connections 10000 --messages 100000
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import time
+import tracemalloc
+from typing import Callable
+
+from benchmarks.run import RESULTS_DIR, git_commit
+from chat.broadcast import ClientConnection
+from chat.frames import ChatFrame
+from chat.history import RingBuffer
+
+USERNAMES = [f"user{index}" for index in range(200)]
+
+
+class _IdleWebSocket:
+    """Stands in for an accepted socket; nothing is sent during the measurement"""
+
+    async def send_text(self, data: str):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def measure(build: Callable[[], object], count: int) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    total = after - before
+    return {"count": count, "total_bytes": total, "bytes_each": round(total / count, 1)}
+
+
+def build_connections(count: int):
+    websocket = _IdleWebSocket()
+    room = set()
+    for index in range(count):
+        room.add(ClientConnection(websocket, f"client-{index}", "general"))
+    return room
+
+
+def build_frames(count: int):
+    ring = RingBuffer(count)
+    now = time.time()
+    for index in range(count):
+        # Names arrive from request paths, so build new strings as a socket would
+        username = "".join(USERNAMES[index % len(USERNAMES)])
+        ring.append(ChatFrame(username, f"message number {index}", ts=now + index, id=index + 1))
+    return ring
+
+
+def build_dicts(count: int):
+    # The previous representation: one dict per message with a formatted time
+    ring = RingBuffer(count)
+    now = time.time()
+    for index in range(count):
+        ring.append({
+            "username": "".join(USERNAMES[index % len(USERNAMES)]),
+            "message": f"message number {index}",
+            "timestamp": time.strftime("%H:%M:%S", time.localtime(now + index)),
+            "type": "user",
+            "id": index + 1,
+        })
+    return ring
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/<commit>-memory.json)")
+    args = parser.parse_args()
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "connections": measure(lambda: build_connections(args.connections), args.connections),
+        "messages": measure(lambda: build_frames(args.messages), args.messages),
+        "messages_as_dicts": measure(lambda: build_dicts(args.messages), args.messages),
+    }
+    for name in ("connections", "messages", "messages_as_dicts"):
+        print(f"{name:>18}: {results[name]['bytes_each']} bytes each, {results[name]['total_bytes'] / 2 ** 20:.1f} MiB total")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{results['commit'] or 'results'}-memory.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as handle:
+        json.dump(results, handle, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
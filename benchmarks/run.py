@@ -0,0 +1,295 @@
+"""
+Load and latency benchmark for the chat and proxy endpoints.
+
+Starts a stub upstream and ``main:app`` under uvicorn on free local ports,
+then drives HTTP load against ``/api/*``, ``/chat`` and
+``/api/online-users`` and WebSocket load against ``/ws/{client_id}``.
+Results (throughput, p50/p95/p99 latency, broadcast fan-out latency and
+memory per connection) are written as JSON so two commits can be compared
+with ``benchmarks/compare.py``.
+
+    python -m benchmarks.run --requests 2000 --concurrency 50 --ws-clients 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from benchmarks.stub_upstream import start_stub
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+# Any bearer token passes when no AUTH_SECRET is configured
+HEADERS = {"Authorization": "Bearer benchmark"}
+
+HTTP_TARGETS = {
+    "products_list": "/api/products?limit=30",
+    "product_by_id": "/api/products/1",
+    "users_list": "/api/users?limit=30",
+    "posts_list": "/api/posts?limit=30",
+    "products_batch": "/api/products/batch?ids=1,2,3,4,5",
+    "chat_page": "/chat",
+    "online_users": "/api/online-users",
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    """p50/p95/p99 and max in milliseconds (nearest rank)"""
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    ordered = sorted(samples)
+
+    def rank(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 3)
+
+    return {"p50": rank(0.50), "p95": rank(0.95), "p99": rank(0.99), "max": round(ordered[-1] * 1000, 3)}
+
+
+def rss_bytes(pid: int) -> Optional[int]:
+    """Resident set size of a process; Linux only"""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def wait_until_ready(base_url: str, timeout: float = 20.0):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(base_url + "/api/online-users") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError("Server did not become ready in time")
+
+
+async def http_load(session: aiohttp.ClientSession, url: str, total: int, concurrency: int) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            try:
+                async with session.get(url, headers=HEADERS) as response:
+                    await response.read()
+                    if response.status >= 400:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": total,
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "latency_ms": percentiles(latencies),
+    }
+
+
+def decode_chat(raw: str, compact: bool) -> List[dict]:
+    """Chat messages from one frame, in either protocol version"""
+    data = json.loads(raw)
+    if not compact:
+        return [data] if data.get("type") == "user" else []
+    return [{"username": item[3], "message": item[4]} for item in data if item[0] == "u"]
+
+
+async def websocket_load(base_url: str, server_pid: int, clients: int, messages: int, interval: float, compact: bool) -> dict:
+    ws_url = base_url.replace("http", "ws", 1)
+    protocols = ("chat.v2",) if compact else ()
+    sent_at: Dict[str, float] = {}
+    fan_out: List[float] = []
+    frames = 0
+    expected = clients * messages
+    done = asyncio.Event()
+
+    async with aiohttp.ClientSession() as session:
+        rss_before = rss_bytes(server_pid)
+        connect_started = time.perf_counter()
+        sockets = await asyncio.gather(*(
+            session.ws_connect(f"{ws_url}/ws/bench{i}", protocols=protocols, headers=HEADERS, max_msg_size=0)
+            for i in range(clients)
+        ))
+        connect_elapsed = time.perf_counter() - connect_started
+        # Let join announcements and presence settle before measuring
+        await asyncio.sleep(1.0)
+        rss_after = rss_bytes(server_pid)
+
+        async def reader(ws: aiohttp.ClientWebSocketResponse):
+            nonlocal frames
+            async for frame in ws:
+                frames += 1
+                if frame.type != aiohttp.WSMsgType.TEXT:
+                    break
+                for message in decode_chat(frame.data, compact):
+                    started = sent_at.get(message["message"])
+                    if started is not None:
+                        fan_out.append(time.perf_counter() - started)
+                        if len(fan_out) >= expected:
+                            done.set()
+
+        readers = [asyncio.create_task(reader(ws)) for ws in sockets]
+        send_started = time.perf_counter()
+        for n in range(messages):
+            text = f"bench:{n}"
+            sent_at[text] = time.perf_counter()
+            await sockets[n % clients].send_str(json.dumps(["m", text] if compact else {"message": text}))
+            if interval:
+                await asyncio.sleep(interval)
+        try:
+            await asyncio.wait_for(done.wait(), timeout=30)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - send_started
+
+        for ws in sockets:
+            await ws.close()
+        for task in readers:
+            task.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+
+    memory = None
+    if rss_before is not None and rss_after is not None:
+        memory = {
+            "rss_before_bytes": rss_before,
+            "rss_after_bytes": rss_after,
+            "per_connection_bytes": round((rss_after - rss_before) / clients) if clients else None,
+        }
+    return {
+        "clients": clients,
+        "messages": messages,
+        "protocol": "chat.v2" if compact else "v1",
+        "connect_seconds": round(connect_elapsed, 3),
+        "deliveries": len(fan_out),
+        "frames_received": frames,
+        "expected_deliveries": expected,
+        "deliveries_per_second": round(len(fan_out) / elapsed, 1) if elapsed else None,
+        "fan_out_latency_ms": percentiles(fan_out),
+        "memory": memory,
+    }
+
+
+def start_server(port: int, upstream_url: str) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        UPSTREAM_BASE_URL=upstream_url,
+        CHAT_HISTORY_BACKEND=os.environ.get("CHAT_HISTORY_BACKEND", "memory"),
+        # Load comes from one client; measure the app, not its rate limits
+        RATE_LIMIT_API=os.environ.get("RATE_LIMIT_API", "off"),
+        RATE_LIMIT_HISTORY=os.environ.get("RATE_LIMIT_HISTORY", "off"),
+        RATE_LIMIT_WS=os.environ.get("RATE_LIMIT_WS", "off"),
+        PYTHONPATH=ROOT,
+    )
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT,
+        env=env,
+    )
+
+
+async def run(args: argparse.Namespace) -> dict:
+    stub = await start_stub(
+        delay=args.upstream_delay,
+        error_rate=args.upstream_error_rate,
+        slow_rate=args.upstream_slow_rate,
+    )
+    upstream_url = "http://%s:%s" % stub.addresses[0][:2]
+    port = free_port()
+    server = start_server(port, upstream_url)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        await wait_until_ready(base_url)
+        results = {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "config": vars(args),
+            "http": {},
+        }
+        targets = args.targets or list(HTTP_TARGETS)
+        connector = aiohttp.TCPConnector(limit=args.concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            for name in targets:
+                url = base_url + HTTP_TARGETS[name]
+                # Warm caches and connection pools before measuring
+                await http_load(session, url, args.concurrency, args.concurrency)
+                results["http"][name] = await http_load(session, url, args.requests, args.concurrency)
+                print(f"{name:>16}: {results['http'][name]['throughput_rps']} req/s {results['http'][name]['latency_ms']}")
+        if args.ws_clients:
+            results["websocket"] = await websocket_load(
+                base_url, server.pid, args.ws_clients, args.ws_messages, args.ws_interval / 1000, args.protocol == "v2"
+            )
+            print(f"       websocket: {results['websocket']['fan_out_latency_ms']} {results['websocket']['memory']}")
+        return results
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        await stub.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per HTTP target")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--targets", nargs="*", choices=sorted(HTTP_TARGETS), help="HTTP targets to run (default: all)")
+    parser.add_argument("--upstream-delay", type=float, default=0.0, help="Seconds the stub upstream waits per request")
+    parser.add_argument("--upstream-error-rate", type=float, default=0.0, help="Fraction of stub requests that fail with 503")
+    parser.add_argument("--upstream-slow-rate", type=float, default=0.0, help="Fraction of stub requests delayed by 3s")
+    parser.add_argument("--ws-clients", type=int, default=100, help="WebSocket clients in one room; 0 to skip")
+    parser.add_argument("--ws-messages", type=int, default=100, help="Chat messages broadcast during the run")
+    parser.add_argument("--ws-interval", type=float, default=5.0, help="Milliseconds between sent messages")
+    parser.add_argument("--protocol", choices=("v1", "v2"), default="v1")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/<commit>.json)")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    output = args.output or os.path.join(RESULTS_DIR, f"{results['commit'] or 'results'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as handle:
+        json.dump(results, handle, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import argparse
+import asyncio
+import random
+from typing import Dict, List
+
+from aiohttp import web
+
+# Shaped like the dummyjson resources the controllers proxy
+RESOURCE_SIZES = {"posts": 150, "products": 100, "users": 100, "comments": 300, "todos": 200}
+
+
+def make_items(resource: str, count: int) -> List[dict]:
+    if resource == "products":
+        return [
+            {
+                "id": i,
+                "title": f"Product {i}",
+                "price": round(i * 1.5, 2),
+                "category": ("smartphones", "laptops", "groceries")[i % 3],
+                "description": "A product used for benchmarking. " * 3,
+            }
+            for i in range(1, count + 1)
+        ]
+    if resource == "users":
+        return [
+            {
+                "id": i,
+                "firstName": f"First{i}",
+                "lastName": f"Last{i}",
+                "age": 20 + i % 40,
+                "gender": "male" if i % 2 else "female",
+                "email": f"user{i}@example.com",
+            }
+            for i in range(1, count + 1)
+        ]
+    if resource == "comments":
+        return [
+            {"id": i, "body": f"Comment {i}", "postId": i % 150 + 1, "likes": i % 7, "user": {"id": i % 100 + 1}}
+            for i in range(1, count + 1)
+        ]
+    if resource == "todos":
+        return [{"id": i, "todo": f"Todo {i}", "completed": bool(i % 2), "userId": i % 100 + 1} for i in range(1, count + 1)]
+    return [
+        {"id": i, "title": f"Post {i}", "body": "Lorem ipsum dolor sit amet. " * 5, "userId": i % 10 + 1}
+        for i in range(1, count + 1)
+    ]
+
+
+FAULT_FIELDS = {"error_rate": float, "error_status": int, "slow_rate": float, "slow_delay": float, "down": int}
+
+
+def create_stub_app(delay: float = 0.0, sizes: Dict[str, int] = RESOURCE_SIZES, **faults) -> web.Application:
+    """
+    A local stand-in for dummyjson.
+
+    Serves ``/{resource}?limit=&skip=`` and ``/{resource}/{id}`` with an
+    optional fixed ``delay`` per request, and counts requests on ``/_hits``
+    so a run can report how many calls reached the upstream.
+
+    Faults can be injected to exercise the client's retries, hedging and
+    circuit breaker: ``error_rate`` of requests fail with ``error_status``,
+    ``slow_rate`` of requests wait an extra ``slow_delay`` seconds, and
+    ``down`` fails every request. ``/_faults?error_rate=0.5&down=0``
+    changes them at runtime and returns the current settings.
+    """
+    data = {resource: make_items(resource, count) for resource, count in sizes.items()}
+    hits = {"total": 0, "faults": 0}
+    settings = {"error_rate": 0.0, "error_status": 503, "slow_rate": 0.0, "slow_delay": 3.0, "down": 0}
+    settings.update(faults)
+
+    @web.middleware
+    async def inject_faults(request: web.Request, handler):
+        if request.path.startswith("/_"):
+            return await handler(request)
+        if settings["down"] or random.random() < settings["error_rate"]:
+            hits["total"] += 1
+            hits["faults"] += 1
+            return web.json_response({"message": "Injected fault"}, status=settings["error_status"])
+        if random.random() < settings["slow_rate"]:
+            await asyncio.sleep(settings["slow_delay"])
+        return await handler(request)
+
+    async def pause():
+        hits["total"] += 1
+        if delay:
+            await asyncio.sleep(delay)
+
+    async def list_items(request: web.Request) -> web.Response:
+        resource = request.match_info["resource"]
+        if resource not in data:
+            raise web.HTTPNotFound()
+        await pause()
+        limit = int(request.query.get("limit", 30))
+        skip = int(request.query.get("skip", 0))
+        items = data[resource][skip:] if limit == 0 else data[resource][skip:skip + limit]
+        return web.json_response({resource: items, "total": len(data[resource]), "skip": skip, "limit": len(items)})
+
+    async def get_item(request: web.Request) -> web.Response:
+        resource = request.match_info["resource"]
+        await pause()
+        try:
+            item_id = int(request.match_info["item_id"])
+        except ValueError:
+            return web.json_response({"message": "Invalid id"}, status=400)
+        items = data.get(resource, [])
+        if 1 <= item_id <= len(items):
+            return web.json_response(items[item_id - 1])
+        return web.json_response({"message": f"{resource} with id '{item_id}' not found"}, status=404)
+
+    async def get_hits(request: web.Request) -> web.Response:
+        return web.json_response(hits)
+
+    async def set_faults(request: web.Request) -> web.Response:
+        for name, value in request.query.items():
+            if name in FAULT_FIELDS:
+                settings[name] = FAULT_FIELDS[name](value)
+        return web.json_response(settings)
+
+    app = web.Application(middlewares=[inject_faults])
+    app.router.add_get("/_hits", get_hits)
+    app.router.add_get("/_faults", set_faults)
+    app.router.add_get("/{resource}", list_items)
+    app.router.add_get("/{resource}/{item_id}", get_item)
+    return app
+
+
+async def start_stub(port: int = 0, delay: float = 0.0, **faults) -> web.AppRunner:
+    """Start the stub on localhost; the bound port is in ``runner.addresses``"""
+    runner = web.AppRunner(create_stub_app(delay, **faults))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the stub upstream on its own")
+    parser.add_argument("--port", type=int, default=9911)
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds to wait per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Fraction of requests that are slow")
+    parser.add_argument("--slow-delay", type=float, default=3.0, help="Extra seconds a slow request waits")
+    args = parser.parse_args()
+    app = create_stub_app(
+        args.delay,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        slow_rate=args.slow_rate,
+        slow_delay=args.slow_delay,
+    )
+    web.run_app(app, host="127.0.0.1", port=args.port)
@@ -0,0 +1,193 @@
+import asyncio
+import fcntl
+import hashlib
+import os
+import struct
+import tempfile
+from typing import Callable, List, Optional, Set
+
+# Subscribers receive (topic, payload) for every published message,
+# including the ones this process published itself.
+Handler = Callable[[str, bytes], None]
+
+_HEADER = struct.Struct("!I")
+
+# The app's directory: workers of one checkout share a broker, others never meet
+_APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Backplane:
+    """
+    Pub/sub channel shared by every worker serving the chat.
+
+    ``publish`` sends a message once; each worker's subscribers are called
+    with it so they can deliver to their own local sockets.
+    """
+
+    def __init__(self):
+        self._handlers: List[Handler] = []
+
+    def subscribe(self, handler: Handler):
+        self._handlers.append(handler)
+
+    def _dispatch(self, topic: str, data: bytes):
+        for handler in self._handlers:
+            handler(topic, data)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, topic: str, data: bytes):
+        raise NotImplementedError
+
+
+class InProcessBackplane(Backplane):
+    """Single-process backplane: publishing is a direct local dispatch"""
+
+    async def publish(self, topic: str, data: bytes):
+        self._dispatch(topic, data)
+
+
+class UnixSocketBackplane(Backplane):
+    """
+    Multi-process backplane over a Unix domain socket.
+
+    Every worker connects to one broker socket. Whichever worker holds the
+    ``<path>.lock`` flock runs the broker, which relays each length-prefixed
+    frame to all connected workers. If the broker worker dies its lock is
+    released and the survivors elect a new one on reconnect.
+    """
+
+    RETRY_DELAY = 0.2
+    # Drop a peer that stops reading rather than buffering without bound
+    MAX_PEER_BUFFER = 8 * 1024 * 1024
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._lock_fd: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._peers: Set[asyncio.StreamWriter] = set()
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._connected = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout=2.0)
+        except asyncio.TimeoutError:
+            # Keep retrying in the background; publishes fall back to local
+            pass
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._writer is not None:
+            self._writer.close()
+        if self._server is not None:
+            self._server.close()
+            for peer in tuple(self._peers):
+                peer.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    async def publish(self, topic: str, data: bytes):
+        payload = topic.encode() + b"\n" + data
+        writer = self._writer
+        if writer is None:
+            # Broker unreachable: at least serve this worker's own sockets
+            self._dispatch(topic, data)
+            return
+        writer.write(_HEADER.pack(len(payload)) + payload)
+        await writer.drain()
+
+    async def _run(self):
+        while True:
+            await self._maybe_become_broker()
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                await asyncio.sleep(self.RETRY_DELAY)
+                continue
+
+            self._writer = writer
+            self._connected.set()
+            try:
+                while True:
+                    header = await reader.readexactly(_HEADER.size)
+                    payload = await reader.readexactly(_HEADER.unpack(header)[0])
+                    topic, _, data = payload.partition(b"\n")
+                    self._dispatch(topic.decode(), data)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                pass
+            finally:
+                self._writer = None
+                self._connected.clear()
+                writer.close()
+            await asyncio.sleep(self.RETRY_DELAY)
+
+    async def _maybe_become_broker(self):
+        if self._server is not None:
+            return
+        if self._lock_fd is None:
+            self._lock_fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        # We own the lock, so any existing socket file is stale
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self._server = await asyncio.start_unix_server(self._serve_peer, path=self.path)
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._peers.add(writer)
+        try:
+            while True:
+                header = await reader.readexactly(_HEADER.size)
+                frame = header + await reader.readexactly(_HEADER.unpack(header)[0])
+                for peer in tuple(self._peers):
+                    if peer.transport.get_write_buffer_size() > self.MAX_PEER_BUFFER:
+                        self._peers.discard(peer)
+                        peer.close()
+                        continue
+                    peer.write(frame)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+
+def default_socket_path() -> str:
+    """
+    Broker socket for this app directory and user, in the temp directory.
+    Hashed, as socket paths are limited to about 100 bytes.
+    """
+    digest = hashlib.blake2b(f"{_APP_DIR}:{os.getuid()}".encode(), digest_size=8).hexdigest()
+    return os.path.join(tempfile.gettempdir(), f"fastapi-chat-{digest}.sock")
+
+
+def create_backplane() -> Backplane:
+    """Build the backplane selected by CHAT_BACKPLANE (memory | unix)"""
+    kind = os.environ.get("CHAT_BACKPLANE", "memory")
+    if kind == "unix":
+        return UnixSocketBackplane(os.environ.get("CHAT_BACKPLANE_PATH") or default_socket_path())
+    if kind == "memory":
+        return InProcessBackplane()
+    raise ValueError(f"Unknown CHAT_BACKPLANE: {kind}")
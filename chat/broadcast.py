@@ -0,0 +1,202 @@
+import asyncio
+import itertools
+import os
+import sys
+from collections import deque
+from enum import Enum
+from typing import Callable, Deque, Optional, Tuple
+
+from fastapi import WebSocket
+
+from services.metrics import WS_FRAMES_SENT
+
+
+class SlowConsumerPolicy(str, Enum):
+    """What to do when a client's outbound queue is full"""
+    DROP_OLDEST = "drop_oldest"
+    COALESCE = "coalesce"
+    DISCONNECT = "disconnect"
+
+
+DEFAULT_QUEUE_SIZE = int(os.environ.get("CHAT_SEND_QUEUE_SIZE", 256))
+DEFAULT_POLICY = SlowConsumerPolicy(os.environ.get("CHAT_SLOW_CONSUMER_POLICY", "drop_oldest"))
+# How long a batching writer waits for more frames before sending
+DEFAULT_BATCH_WINDOW = float(os.environ.get("CHAT_BATCH_WINDOW_MS", 5)) / 1000
+
+_connection_ids = itertools.count(1)
+
+
+class ClientConnection:
+    """
+    One accepted WebSocket with its own bounded outbound queue and writer task.
+
+    Producers call ``enqueue`` which never awaits, so a slow socket can only
+    ever delay itself. The writer task drains the queue in order and reports
+    send failures through ``on_close``.
+
+    Connections speaking the compact protocol (``compact=True``) batch: once
+    woken, the writer waits ``batch_window`` seconds and sends everything
+    queued by then as one JSON array, so a busy room costs one frame (and
+    one compressed write) per window instead of one per message.
+
+    Instances use ``__slots__`` and intern their client and room names, as a
+    busy worker holds tens of thousands of them. ``id`` is a per-process
+    monotonic connection number.
+    """
+
+    __slots__ = (
+        "id", "websocket", "client_id", "room", "max_queue", "policy", "on_close", "compact",
+        "batch_window", "queue", "dropped", "closed", "sending", "_waiter", "_writer", "_closer",
+    )
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        client_id: str,
+        room: str = "",
+        max_queue: int = DEFAULT_QUEUE_SIZE,
+        policy: SlowConsumerPolicy = DEFAULT_POLICY,
+        on_close: Optional[Callable[["ClientConnection"], None]] = None,
+        compact: bool = False,
+        batch_window: float = DEFAULT_BATCH_WINDOW,
+    ):
+        self.id = next(_connection_ids)
+        self.websocket = websocket
+        self.client_id = sys.intern(client_id)
+        self.room = sys.intern(room)
+        self.max_queue = max_queue
+        self.policy = policy
+        self.on_close = on_close
+        self.compact = compact
+        self.batch_window = batch_window
+        # Pending frames as (coalesce_key, payload) pairs
+        self.queue: Deque[Tuple[Optional[str], str]] = deque()
+        self.dropped = 0
+        self.closed = False
+        # True while a frame taken off the queue is being written
+        self.sending = False
+        # Created only while the writer is idle, instead of an Event per connection
+        self._waiter: Optional[asyncio.Future] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._closer: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, frame: str, key: Optional[str] = None, merge: Optional[Callable[[str], str]] = None) -> bool:
+        """
+        Queue a frame for delivery, applying the slow-consumer policy when full.
+
+        Under ``COALESCE`` a full queue gives up the pending frame with the
+        same ``key``; ``merge``, if given, folds that frame into this one
+        (``merge(pending) -> frame``) for frames that carry changes rather
+        than state.
+        """
+        if self.closed:
+            return False
+
+        if len(self.queue) >= self.max_queue:
+            if self.policy is SlowConsumerPolicy.DISCONNECT:
+                # 1013: try again later
+                self.close(code=1013)
+                return False
+            pending = self._coalesce(key) if self.policy is SlowConsumerPolicy.COALESCE else None
+            if pending is None:
+                self.queue.popleft()
+            elif merge is not None:
+                frame = merge(pending)
+            self.dropped += 1
+
+        self.queue.append((key, frame))
+        self._wake()
+        return True
+
+    @property
+    def idle(self) -> bool:
+        """Nothing queued and nothing being written"""
+        return not self.queue and not self.sending
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _coalesce(self, key: Optional[str]) -> Optional[str]:
+        """
+        Remove and return the newest pending frame with the same key, if
+        any; the newest, so merged frames keep their order among themselves
+        """
+        if key is None:
+            return None
+        for index in range(len(self.queue) - 1, -1, -1):
+            pending_key, pending = self.queue[index]
+            if pending_key == key:
+                del self.queue[index]
+                return pending
+        return None
+
+    async def _write_loop(self):
+        try:
+            while not self.closed:
+                if not self.queue:
+                    self._waiter = asyncio.get_running_loop().create_future()
+                    try:
+                        await self._waiter
+                    finally:
+                        self._waiter = None
+                    continue
+                if self.compact:
+                    if self.batch_window > 0:
+                        await asyncio.sleep(self.batch_window)
+                    batch = ",".join(frame for _, frame in self.queue)
+                    self.queue.clear()
+                    if batch:
+                        await self._send("[" + batch + "]")
+                    continue
+                _, frame = self.queue.popleft()
+                await self._send(frame)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # Broken socket: stop writing and let the manager forget us
+            pass
+        finally:
+            self.close()
+
+    async def _send(self, frame: str):
+        self.sending = True
+        try:
+            await self.websocket.send_text(frame)
+        finally:
+            self.sending = False
+        WS_FRAMES_SENT.inc()
+
+    def close(self, code: Optional[int] = None):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        self._wake()
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        if code is not None:
+            self._closer = asyncio.create_task(self._close_socket(code))
+        if self.on_close is not None:
+            self.on_close(self)
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def wait_closed(self):
+        """Wait for the close frame sent by ``close(code)``, if any"""
+        if self._closer is not None:
+            await self._closer
+
+    async def flush(self, timeout: float = 1.0):
+        """Wait (bounded) for the queue to drain and the last frame to be written"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not self.idle and not self.closed and loop.time() < deadline:
+            await asyncio.sleep(0.01)
@@ -0,0 +1,117 @@
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Union
+
+from services.serializer import loads
+
+# WebSocket subprotocol for the compact wire format. Clients that do not
+# offer it keep getting one JSON object per frame.
+PROTOCOL_V2 = "chat.v2"
+
+# v2 tags for the ``type`` field
+COMPACT_TYPES = {"user": "u", "system": "s", "presence": "p", "reconnect": "r", "gap": "g"}
+TYPES_BY_TAG = {tag: kind for kind, tag in COMPACT_TYPES.items()}
+
+# Largest client frame accepted, in characters
+MAX_FRAME_SIZE = int(os.environ.get("CHAT_MAX_FRAME_SIZE", 4096))
+
+
+class FrameTooLarge(ValueError):
+    """Raised for a client frame over ``MAX_FRAME_SIZE``, before it is parsed"""
+
+
+def format_time(ts: float) -> str:
+    """Local wall-clock time of an epoch timestamp, as shown in the chat"""
+    return time.strftime("%H:%M:%S", time.localtime(ts))
+
+
+@dataclass(slots=True)
+class ChatFrame:
+    """
+    A chat or system message, as kept in history and broadcast to a room.
+
+    ``ts`` is the epoch time the message was created and ``id`` the
+    monotonic id assigned by the history store (0 until stored). Usernames
+    are interned, so a busy user's name is held once however many of their
+    messages are in memory. Display times are formatted only on output.
+    """
+    username: str
+    message: str
+    type: str = "user"
+    ts: float = field(default_factory=time.time)
+    id: int = 0
+
+    def __post_init__(self):
+        self.username = sys.intern(self.username)
+
+    @property
+    def timestamp(self) -> str:
+        return format_time(self.ts)
+
+    def to_dict(self) -> dict:
+        """v1 wire format: keyed object, with the display time for older clients"""
+        frame = {"username": self.username, "message": self.message, "timestamp": self.timestamp, "type": self.type, "ts": self.ts}
+        if self.id:
+            frame["id"] = self.id
+        return frame
+
+    def to_compact(self) -> list:
+        """v2 wire format (also used on the backplane): ``[tag, id, ts, username, message]``"""
+        return [COMPACT_TYPES.get(self.type, "u"), self.id, self.ts, self.username, self.message]
+
+    @classmethod
+    def from_compact(cls, item: list) -> "ChatFrame":
+        tag, message_id, ts, username, message = item
+        return cls(username, message, TYPES_BY_TAG.get(tag, "user"), ts, message_id)
+
+    @classmethod
+    def from_stored(cls, message_id: int, username: str, ts: float, payload: dict) -> "ChatFrame":
+        """Rebuild a stored message; older payloads also carry username and timestamp"""
+        return cls(username, payload.get("message", ""), payload.get("type", "user"), ts, message_id)
+
+
+def presence_compact(frame: dict) -> list:
+    """v2 encoding of a presence frame: ``["p", room, online, users, joined, left]``; users is null in deltas"""
+    return ["p", frame["room"], frame["online"], frame.get("users"), frame["joined"], frame["left"]]
+
+
+def presence_from_compact(item: list) -> dict:
+    """Inverse of ``presence_compact``"""
+    _, room, online, users, joined, left = item
+    frame = {"type": "presence", "room": room, "joined": joined, "left": left, "online": online}
+    if users is not None:
+        frame["users"] = users
+    return frame
+
+
+def reconnect_frame(after_ms: int, compact: bool = False):
+    """Control frame asking the client to reconnect in ``after_ms`` milliseconds; v2 ``["r", after_ms]``"""
+    return ["r", after_ms] if compact else {"type": "reconnect", "after_ms": after_ms}
+
+
+def gap_frame(compact: bool = False):
+    """Control frame telling a resuming client it missed too much to replay; v2 ``["g"]``"""
+    return ["g"] if compact else {"type": "gap"}
+
+
+@dataclass(slots=True)
+class IncomingMessage:
+    """A frame sent by a client: ``{"message": "..."}`` or v2 ``["m", "..."]``"""
+    message: str
+
+    @classmethod
+    def decode(cls, data: Union[str, bytes], max_size: int = MAX_FRAME_SIZE) -> "IncomingMessage":
+        if len(data) > max_size:
+            raise FrameTooLarge(f"Chat frames are limited to {max_size} characters")
+        payload = loads(data)
+        if isinstance(payload, list):
+            if len(payload) != 2 or payload[0] != "m":
+                raise ValueError("Compact chat frames must be [\"m\", text]")
+            message = payload[1]
+        elif isinstance(payload, dict):
+            message = payload.get("message", "")
+        else:
+            raise ValueError("Chat frames must be JSON objects or arrays")
+        return cls(message if isinstance(message, str) else str(message))
@@ -0,0 +1,314 @@
+import asyncio
+import os
+import sqlite3
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
+
+from chat.frames import ChatFrame
+from services.serializer import dumps_str, loads
+
+
+class RingBuffer:
+    """
+    Fixed-capacity buffer of the newest messages in a room.
+
+    Slots are preallocated, so appends are O(1) with no reallocation and
+    memory stays constant once full. Messages are kept in id order, which
+    lets ``before`` and ``after`` bisect instead of scanning. They usually
+    arrive in order; one that does not (workers publish independently of
+    the order the store assigned ids in) is inserted where it belongs.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._slots: List[Optional[ChatFrame]] = [None] * capacity
+        self._start = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, index: int) -> ChatFrame:
+        if not 0 <= index < self._size:
+            raise IndexError(index)
+        return self._slots[(self._start + index) % self.capacity]
+
+    def __iter__(self) -> Iterator[ChatFrame]:
+        for index in range(self._size):
+            yield self[index]
+
+    def append(self, message: ChatFrame):
+        if self._size and message.id < self[self._size - 1].id:
+            return self._insert(message)
+        if self._size < self.capacity:
+            self._slots[(self._start + self._size) % self.capacity] = message
+            self._size += 1
+        else:
+            self._slots[self._start] = message
+            self._start = (self._start + 1) % self.capacity
+
+    def _insert(self, message: ChatFrame):
+        # Rare, and at most ``capacity`` long: rebuild the slots in order
+        messages = list(self)
+        messages.insert(bisect_right(_IdView(self), message.id), message)
+        if len(messages) > self.capacity:
+            # Older than everything kept (when inserted first) or the oldest
+            del messages[0]
+        self._slots = messages + [None] * (self.capacity - len(messages))
+        self._start = 0
+        self._size = len(messages)
+
+    @property
+    def full(self) -> bool:
+        return 0 < self._size == self.capacity
+
+    def oldest_id(self) -> Optional[int]:
+        return self[0].id if self._size else None
+
+    def before(self, before_id: Optional[int], limit: int) -> List[ChatFrame]:
+        """Up to ``limit`` messages older than ``before_id``, oldest first"""
+        if before_id is None:
+            end = self._size
+        else:
+            end = bisect_left(_IdView(self), before_id)
+        return [self[index] for index in range(max(0, end - limit), end)]
+
+    def after(self, after_id: int) -> List[ChatFrame]:
+        """Every message newer than ``after_id``, oldest first"""
+        start = bisect_right(_IdView(self), after_id)
+        return [self[index] for index in range(start, self._size)]
+
+
+class _IdView:
+    """Sequence of message ids over a RingBuffer, for bisect"""
+
+    def __init__(self, ring: RingBuffer):
+        self._ring = ring
+
+    def __len__(self) -> int:
+        return len(self._ring)
+
+    def __getitem__(self, index: int) -> int:
+        return self._ring[index].id
+
+
+class HistoryStore:
+    """
+    Durable chat history.
+
+    Messages get a monotonic integer id from the store; pages are returned
+    oldest first so they can be rendered directly.
+    """
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def append(self, room: str, message: ChatFrame) -> int:
+        raise NotImplementedError
+
+    async def page(
+        self,
+        room: str,
+        before: Optional[int] = None,
+        limit: int = 50,
+        username: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+    ) -> List[ChatFrame]:
+        raise NotImplementedError
+
+
+class MemoryHistoryStore(HistoryStore):
+    """Non-durable store for development; keeps ``capacity`` messages per room"""
+
+    def __init__(self, capacity: int = 10000):
+        self.capacity = capacity
+        self._rooms: Dict[str, RingBuffer] = {}
+        self._next_id = 1
+
+    async def append(self, room: str, message: ChatFrame) -> int:
+        message.id = self._next_id
+        self._next_id += 1
+        ring = self._rooms.get(room)
+        if ring is None:
+            ring = self._rooms[room] = RingBuffer(self.capacity)
+        ring.append(message)
+        return message.id
+
+    async def page(self, room, before=None, limit=50, username=None, since=None, until=None):
+        ring = self._rooms.get(room)
+        if ring is None:
+            return []
+        matches = [
+            message for message in ring
+            if (before is None or message.id < before)
+            and (username is None or message.username == username)
+            and (since is None or message.ts >= since)
+            and (until is None or message.ts < until)
+        ]
+        return matches[-limit:]
+
+
+class SQLiteHistoryStore(HistoryStore):
+    """
+    Append-only history in SQLite (WAL mode), shared by every local worker.
+
+    All database work runs on one dedicated thread so the event loop never
+    blocks on disk. Indexes cover the room cursor, room time-range and
+    per-user lookups.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS chat_messages ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " room TEXT NOT NULL,"
+        " username TEXT NOT NULL,"
+        " created_at REAL NOT NULL,"
+        " payload TEXT NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS chat_messages_room_id ON chat_messages (room, id)",
+        "CREATE INDEX IF NOT EXISTS chat_messages_room_time ON chat_messages (room, created_at)",
+        "CREATE INDEX IF NOT EXISTS chat_messages_user_time ON chat_messages (username, created_at)",
+    )
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._db: Optional[sqlite3.Connection] = None
+
+    async def _run(self, fn, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-history")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def start(self):
+        await self._run(self._open)
+
+    async def stop(self):
+        await self._run(self._close)
+        self._executor.shutdown(wait=False)
+        self._executor = None
+
+    def _open(self):
+        self._db = sqlite3.connect(self.path, timeout=5.0)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        for statement in self.SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+
+    def _close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    async def append(self, room: str, message: ChatFrame) -> int:
+        return await self._run(self._insert, room, message)
+
+    def _insert(self, room: str, message: ChatFrame) -> int:
+        if self._db is None:
+            self._open()
+        cursor = self._db.execute(
+            "INSERT INTO chat_messages (room, username, created_at, payload) VALUES (?, ?, ?, ?)",
+            (room, message.username, message.ts, _payload(message)),
+        )
+        self._db.commit()
+        return cursor.lastrowid
+
+    async def page(self, room, before=None, limit=50, username=None, since=None, until=None):
+        return await self._run(self._select, room, before, limit, username, since, until)
+
+    def _select(self, room, before, limit, username, since, until) -> List[ChatFrame]:
+        if self._db is None:
+            self._open()
+        clauses, args = ["room = ?"], [room]
+        if before is not None:
+            clauses.append("id < ?")
+            args.append(before)
+        if username is not None:
+            clauses.append("username = ?")
+            args.append(username)
+        if since is not None:
+            clauses.append("created_at >= ?")
+            args.append(since)
+        if until is not None:
+            clauses.append("created_at < ?")
+            args.append(until)
+        args.append(limit)
+        rows = self._db.execute(
+            f"SELECT id, username, created_at, payload FROM chat_messages WHERE {' AND '.join(clauses)} "
+            "ORDER BY id DESC LIMIT ?",
+            args,
+        ).fetchall()
+        return [ChatFrame.from_stored(message_id, user, ts, loads(payload)) for message_id, user, ts, payload in reversed(rows)]
+
+
+class PostgresHistoryStore(HistoryStore):
+    """
+    History in Postgres (the ``ChatMessage`` model in prisma/schema.prisma).
+
+    Requires the optional ``asyncpg`` dependency.
+    """
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self._pool = None
+
+    async def start(self):
+        import asyncpg
+
+        self._pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=4)
+
+    async def stop(self):
+        if self._pool is not None:
+            await self._pool.close()
+
+    async def append(self, room: str, message: ChatFrame) -> int:
+        return await self._pool.fetchval(
+            'INSERT INTO "ChatMessage" (room, username, "createdAt", payload) '
+            "VALUES ($1, $2, to_timestamp($3), $4) RETURNING id",
+            room, message.username, message.ts, _payload(message),
+        )
+
+    async def page(self, room, before=None, limit=50, username=None, since=None, until=None):
+        clauses, args = ["room = $1"], [room]
+        for clause, value in (
+            ("id < ${}", before),
+            ("username = ${}", username),
+            ('"createdAt" >= to_timestamp(${})', since),
+            ('"createdAt" < to_timestamp(${})', until),
+        ):
+            if value is not None:
+                args.append(value)
+                clauses.append(clause.format(len(args)))
+        args.append(limit)
+        rows = await self._pool.fetch(
+            'SELECT id, username, extract(epoch FROM "createdAt")::float8 AS ts, payload '
+            f'FROM "ChatMessage" WHERE {" AND ".join(clauses)} '
+            f"ORDER BY id DESC LIMIT ${len(args)}",
+            *args,
+        )
+        return [
+            ChatFrame.from_stored(row["id"], row["username"], row["ts"], loads(row["payload"]))
+            for row in reversed(rows)
+        ]
+
+
+def _payload(message: ChatFrame) -> str:
+    # Id, username and time have their own columns
+    return dumps_str({"type": message.type, "message": message.message})
+
+
+def create_history_store() -> HistoryStore:
+    """Build the store selected by CHAT_HISTORY_BACKEND (sqlite | postgres | memory)"""
+    kind = os.environ.get("CHAT_HISTORY_BACKEND", "sqlite")
+    if kind == "sqlite":
+        return SQLiteHistoryStore(os.environ.get("CHAT_HISTORY_PATH", "chat_history.db"))
+    if kind == "postgres":
+        return PostgresHistoryStore(os.environ["DATABASE_URL"])
+    if kind == "memory":
+        return MemoryHistoryStore()
+    raise ValueError(f"Unknown CHAT_HISTORY_BACKEND: {kind}")
@@ -0,0 +1,406 @@
+import asyncio
+import os
+import random
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from fastapi import WebSocket
+
+from chat.backplane import Backplane, create_backplane
+from chat.broadcast import ClientConnection
+from chat.frames import PROTOCOL_V2, ChatFrame, gap_frame, presence_compact, presence_from_compact, reconnect_frame
+from chat.history import HistoryStore, RingBuffer, create_history_store
+from chat.presence import PresenceTracker
+from services.metrics import BROADCAST_FANOUT_DURATION, metrics
+from services.serializer import dumps, dumps_str, loads
+
+DEFAULT_ROOM = "general"
+HISTORY_SIZE = 100
+# Read-only stand-in for rooms nothing was ever said in
+EMPTY_RING = RingBuffer(0)
+
+# Sockets one worker admits; more are turned away with 1013 (try again later)
+MAX_CONNECTIONS = int(os.environ.get("CHAT_MAX_CONNECTIONS", 10000))
+# On shutdown clients are told to reconnect at a random point in this window
+DRAIN_JITTER = float(os.environ.get("CHAT_DRAIN_JITTER", 10))
+# How long shutdown waits for the reconnect frames to go out
+DRAIN_TIMEOUT = float(os.environ.get("CHAT_DRAIN_TIMEOUT", 5))
+# A client back in its room within this many seconds resumes quietly:
+# the room hears neither that it left nor that it joined
+RESUME_GRACE = float(os.environ.get("CHAT_RESUME_GRACE", 10))
+# Most messages replayed to a resuming client; further behind, it is told to
+# reload instead. Keep it under the send queue size (CHAT_SEND_QUEUE_SIZE).
+REPLAY_LIMIT = int(os.environ.get("CHAT_REPLAY_LIMIT", 200))
+
+
+# WebSocket connection manager
+class ConnectionManager:
+    """
+    Tracks connections per room.
+
+    ``rooms`` maps room -> set of connections and ``clients`` maps
+    client_id -> its most recent connection, so join, leave and lookup are
+    O(1) and a broadcast only touches the members of one room.
+
+    Broadcasts go through a backplane: the message is published once and
+    every worker delivers it to its own local members in ``_deliver``.
+    The publishing worker first persists the message to the history store,
+    which assigns its id; every worker keeps the newest messages of each
+    room in a ring buffer for rendering and cheap pagination.
+
+    Messages are ``ChatFrame`` records and cross the backplane in their
+    compact form, so v2 members are sent the published bytes as they are.
+
+    At most ``max_connections`` sockets are admitted. ``drain`` (run on
+    shutdown) stops admitting and spreads the clients' reconnects over
+    ``DRAIN_JITTER`` seconds instead of letting them all retry at once.
+
+    Message ids double as sequence numbers. A client reconnecting with the
+    last id it saw (``last_seq``) is sent only the newer messages from the
+    room's ring, and from the store when it has fallen behind the ring; past
+    ``REPLAY_LIMIT`` it gets a gap frame instead. Its "left" announcement waits ``resume_grace`` seconds in
+    ``depart`` and is dropped if it comes back in time (see ``resume``).
+    """
+
+    def __init__(
+        self,
+        backplane: Optional[Backplane] = None,
+        history: Optional[HistoryStore] = None,
+        max_connections: int = MAX_CONNECTIONS,
+        resume_grace: float = RESUME_GRACE,
+    ):
+        self.backplane = backplane or create_backplane()
+        self.backplane.subscribe(self._deliver)
+        self.history = history or create_history_store()
+        self.presence = PresenceTracker(self.backplane)
+        self.presence.listeners.append(self._push_presence)
+        self.active_connections: Set[ClientConnection] = set()
+        self.rooms: Dict[str, Set[ClientConnection]] = {}
+        self.clients: Dict[str, ClientConnection] = {}
+        self.chat_history: Dict[str, RingBuffer] = {}
+        self._warmed: Set[str] = set()
+        # Backfills in progress, shared by every reader of the room
+        self._warming: Dict[str, asyncio.Task] = {}
+        self.max_connections = max_connections
+        self.draining = False
+        self.resume_grace = resume_grace
+        # (room, client_id) -> the pending "left" timer and its frame
+        self._departures: Dict[Tuple[str, str], Tuple[asyncio.TimerHandle, ChatFrame]] = {}
+        self._announcements: Set[asyncio.Task] = set()
+        # Called with the room whenever its recent history changes
+        self.history_listeners: List[Callable[[str], None]] = []
+        self._connections_gauge = metrics.gauge("chat_websocket_connections", "Open WebSocket connections")
+        self._rooms_gauge = metrics.gauge("chat_rooms_active", "Rooms with at least one local member")
+        self._queue_max_gauge = metrics.gauge(
+            "chat_send_queue_depth_max", "Deepest per-connection send queue", merge="max"
+        )
+        self._queue_total_gauge = metrics.gauge("chat_send_queue_depth_total", "Frames waiting in all send queues")
+        self._dropped_gauge = metrics.gauge("chat_send_queue_dropped", "Frames dropped from open connections' queues")
+        self._rejected = metrics.counter(
+            "chat_connections_rejected_total", "WebSocket handshakes turned away", ("reason",)
+        )
+        metrics.collectors.append(self._collect_metrics)
+
+    async def start(self):
+        await self.history.start()
+        await self.backplane.start()
+        await self.presence.start()
+
+    async def stop(self):
+        await self.presence.stop()
+        await self.backplane.stop()
+        await self.history.stop()
+
+    async def connect(
+        self, websocket: WebSocket, client_id: str = "", room: str = DEFAULT_ROOM, last_seq: Optional[int] = None
+    ) -> Optional[ClientConnection]:
+        """
+        Admit a socket; returns None if it was turned away (and closed).
+        With ``last_seq`` the messages after that id are replayed first.
+        """
+        compact = PROTOCOL_V2 in websocket.scope.get("subprotocols", ())
+        await websocket.accept(subprotocol=PROTOCOL_V2 if compact else None)
+        refusal = self._refusal()
+        missed = None
+        if refusal is None and last_seq is not None:
+            # Read up front: from here to the replay nothing awaits, so every
+            # message is either in the ring now or delivered live afterwards
+            missed = await self._missed(room, last_seq)
+            # A drain may have started while the store was read
+            refusal = self._refusal()
+        if refusal is not None:
+            # Rejected before joining anything. Accepting first lets the client
+            # see 1013 and back off, where a refused handshake looks like an outage.
+            self._rejected.inc(refusal)
+            await websocket.close(code=1013)
+            return None
+        connection = ClientConnection(websocket, client_id, room, on_close=self._forget, compact=compact)
+        self.active_connections.add(connection)
+        self.rooms.setdefault(room, set()).add(connection)
+        self.clients[client_id] = connection
+        self.presence.join(room, client_id)
+        connection.start()
+        # Current members right away; deltas follow as presence changes. Not
+        # keyed, so a queued delta cannot replace the only full member list.
+        frame = self.presence.room_frame(room)
+        connection.enqueue(dumps_str(presence_compact(frame) if compact else frame))
+        if last_seq is not None:
+            self._replay(connection, last_seq, missed)
+        return connection
+
+    def _refusal(self) -> Optional[str]:
+        """Why a new socket would be turned away now, or None"""
+        if self.draining:
+            return "draining"
+        if len(self.active_connections) >= self.max_connections:
+            return "capacity"
+        return None
+
+    async def _missed(self, room: str, last_seq: int) -> Optional[List[ChatFrame]]:
+        """
+        The room's messages after ``last_seq``, oldest first, or None if
+        there are more than ``REPLAY_LIMIT``. The store is only read when
+        the ring is full and starts after ``last_seq``.
+        """
+        ring = await self._warm(room)
+        held = ring.after(last_seq)
+        if not ring.full or not held or held[0].id != ring.oldest_id():
+            return held if len(held) <= REPLAY_LIMIT else None
+        # One more than fits, to tell "exactly the limit" from "too many"
+        limit = max(1, REPLAY_LIMIT - len(held) + 1)
+        older = [message for message in await self.history.page(room, held[0].id, limit) if message.id > last_seq]
+        missed = older + held
+        return missed if len(missed) <= REPLAY_LIMIT else None
+
+    def _replay(self, connection: ClientConnection, last_seq: int, missed: Optional[List[ChatFrame]]):
+        ring = self.chat_history.get(connection.room, EMPTY_RING)
+        newest = missed[-1].id if missed else last_seq
+        # Messages may have landed while the store was read; if the ring
+        # rotated past what we hold, the gap cannot be filled from here
+        if missed is None or (missed and ring.full and ring.oldest_id() > newest):
+            connection.enqueue(dumps_str(gap_frame(connection.compact)))
+            return
+        for message in missed + ring.after(newest):
+            self.send_frame(connection, message)
+
+    def disconnect(self, connection: ClientConnection):
+        connection.close()
+
+    def sockets_here(self, room: str, client_id: str) -> int:
+        """How many sockets this worker holds for the client in ``room``"""
+        return self.presence.local.get(room, {}).get(client_id, 0)
+
+    def resume(self, connection: ClientConnection) -> bool:
+        """
+        True if the room already knows this client is here: it left within
+        the grace window (its "left" is never sent) or another of its sockets
+        is still open, as when a phone reconnects before the old socket dies.
+        """
+        departure = self._departures.pop((connection.room, connection.client_id), None)
+        if departure is not None:
+            departure[0].cancel()
+            return True
+        return self.sockets_here(connection.room, connection.client_id) > 1
+
+    async def depart(self, room: str, client_id: str, farewell: ChatFrame):
+        """
+        Broadcast ``farewell`` unless the client resumes within the grace
+        window or still has another socket in the room
+        """
+        if self.sockets_here(room, client_id):
+            return
+        if self.resume_grace <= 0:
+            return await self.broadcast(farewell, room)
+        key = (room, client_id)
+        previous = self._departures.get(key)
+        if previous is not None:
+            # Another of its sockets left earlier; one announcement is enough
+            previous[0].cancel()
+        handle = asyncio.get_running_loop().call_later(self.resume_grace, self._announce_departure, key)
+        self._departures[key] = (handle, farewell)
+
+    def _announce_departure(self, key: Tuple[str, str]):
+        _, farewell = self._departures.pop(key)
+        if self.sockets_here(*key):
+            return
+        task = asyncio.create_task(self.broadcast(farewell, key[0]))
+        self._announcements.add(task)
+        task.add_done_callback(self._announcements.discard)
+
+    async def _flush_departures(self):
+        # Nobody can resume on a worker that is going away
+        departures = list(self._departures.items())
+        self._departures.clear()
+        for (room, client_id), (handle, farewell) in departures:
+            handle.cancel()
+            if not self.sockets_here(room, client_id):
+                await self.broadcast(farewell, room)
+        if self._announcements:
+            await asyncio.gather(*self._announcements, return_exceptions=True)
+
+    async def drain(self, jitter: float = DRAIN_JITTER, timeout: float = DRAIN_TIMEOUT):
+        """
+        Stop admitting sockets, ask every client to reconnect after its own
+        random delay, wait (bounded) for those frames to be written, then
+        close every socket with 1012 (service restart) and wait (bounded)
+        for the close frames.
+        """
+        if self.draining:
+            return
+        self.draining = True
+        # Server-sent event streams would otherwise hold the server open
+        self.presence.end_streams()
+        await self._flush_departures()
+        connections = list(self.active_connections)
+        for connection in connections:
+            after_ms = int(random.uniform(0, jitter) * 1000)
+            connection.enqueue(dumps_str(reconnect_frame(after_ms, connection.compact)))
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        # Idle, not just an empty queue: the writer may still be sending the last frame
+        while loop.time() < deadline and any(not connection.idle for connection in connections if not connection.closed):
+            await asyncio.sleep(0.05)
+        for connection in connections:
+            connection.close(code=1012)
+        closing = [asyncio.ensure_future(connection.wait_closed()) for connection in connections]
+        if closing:
+            await asyncio.wait(closing, timeout=max(deadline - loop.time(), 1.0))
+
+    def _forget(self, connection: ClientConnection):
+        self.active_connections.discard(connection)
+        members = self.rooms.get(connection.room)
+        if members is not None:
+            members.discard(connection)
+            if not members:
+                del self.rooms[connection.room]
+        # Another tab may have reconnected under the same id; keep that one
+        if self.clients.get(connection.client_id) is connection:
+            del self.clients[connection.client_id]
+        self.presence.leave(connection.room, connection.client_id)
+
+    def get_client(self, client_id: str) -> Optional[ClientConnection]:
+        return self.clients.get(client_id)
+
+    def room_size(self, room: str) -> int:
+        return len(self.rooms.get(room, ()))
+
+    async def send_personal_message(self, message: str, connection: ClientConnection):
+        connection.enqueue(message)
+
+    def send_frame(self, connection: ClientConnection, frame: ChatFrame):
+        """Queue a message for one connection only, in its protocol's format"""
+        connection.enqueue(dumps_str(frame.to_compact() if connection.compact else frame.to_dict()))
+
+    async def broadcast(self, message: ChatFrame, room: str = DEFAULT_ROOM):
+        message.id = await self.history.append(room, message)
+        await self.backplane.publish("room:" + room, dumps(message.to_compact()))
+
+    def _deliver(self, topic: str, data: bytes):
+        if not topic.startswith("room:"):
+            return
+        room = topic[5:]
+        message = ChatFrame.from_compact(loads(data))
+        self._ring(room).append(message)
+        self._history_changed(room)
+        self._fan_out(room, lambda: dumps_str(message.to_dict()), data.decode)
+
+    def _push_presence(self, room: str, frame: dict):
+        # A delta only lists one flush's joins and leaves, so a backed-up
+        # client folds it into its pending delta instead of replacing it
+        merge = PresenceTracker.merge_deltas
+        merges = {
+            False: lambda pending: dumps_str(merge(loads(pending), frame)),
+            True: lambda pending: dumps_str(presence_compact(merge(presence_from_compact(loads(pending)), frame))),
+        }
+        self._fan_out(room, lambda: dumps_str(frame), lambda: dumps_str(presence_compact(frame)), "presence", merges)
+
+    def _fan_out(
+        self,
+        room: str,
+        legacy: Callable[[], str],
+        compact: Callable[[], str],
+        key: Optional[str] = None,
+        merges: Optional[Dict[bool, Callable[[str], str]]] = None,
+    ):
+        # Encode lazily and once per format, then hand the frame to every local
+        # member's writer. Iterate over a snapshot: slow consumers may be
+        # dropped mid-loop.
+        started = time.perf_counter()
+        encoded: Dict[bool, str] = {}
+        for connection in tuple(self.rooms.get(room, ())):
+            frame = encoded.get(connection.compact)
+            if frame is None:
+                frame = encoded[connection.compact] = (compact if connection.compact else legacy)()
+            connection.enqueue(frame, key, merges and merges[connection.compact])
+        BROADCAST_FANOUT_DURATION.observe(time.perf_counter() - started)
+
+    def _collect_metrics(self):
+        depths = [len(connection.queue) for connection in self.active_connections]
+        self._connections_gauge.set(len(self.active_connections))
+        self._rooms_gauge.set(len(self.rooms))
+        self._queue_max_gauge.set(max(depths, default=0))
+        self._queue_total_gauge.set(sum(depths))
+        self._dropped_gauge.set(sum(connection.dropped for connection in self.active_connections))
+
+    def _ring(self, room: str) -> RingBuffer:
+        """The room's ring, created if needed; only for writes (reads go through ``_warm``)"""
+        ring = self.chat_history.get(room)
+        if ring is None:
+            ring = self.chat_history[room] = RingBuffer(HISTORY_SIZE)
+        return ring
+
+    async def _warm(self, room: str) -> RingBuffer:
+        """
+        Backfill a room's ring from the store the first time it is read.
+        Rooms without any message get nothing kept for them, as anyone can
+        ask for the history of any room name.
+        """
+        if room in self._warmed:
+            return self.chat_history[room]
+        task = self._warming.get(room)
+        if task is None:
+            task = self._warming[room] = asyncio.create_task(self._backfill(room))
+            task.add_done_callback(lambda _: self._warming.pop(room, None))
+        # Shielded: one reader giving up must not cancel the others' backfill
+        return await asyncio.shield(task)
+
+    async def _backfill(self, room: str) -> RingBuffer:
+        stored = await self.history.page(room, limit=HISTORY_SIZE)
+        if not stored and room not in self.chat_history:
+            return EMPTY_RING
+        ring = RingBuffer(HISTORY_SIZE)
+        last_id = stored[-1].id if stored else 0
+        for message in stored:
+            ring.append(message)
+        # Keep anything delivered while we were reading
+        for message in self.chat_history.get(room, ()):
+            if message.id > last_id:
+                ring.append(message)
+        self.chat_history[room] = ring
+        self._warmed.add(room)
+        self._history_changed(room)
+        return ring
+
+    def _history_changed(self, room: str):
+        for listener in self.history_listeners:
+            listener(room)
+
+    async def get_chat_history(self, room: str = DEFAULT_ROOM) -> List[ChatFrame]:
+        return list(await self._warm(room))
+
+    async def get_history_page(
+        self,
+        room: str = DEFAULT_ROOM,
+        before: Optional[int] = None,
+        limit: int = 50,
+        username: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+    ) -> List[ChatFrame]:
+        """Cursor pagination: serve from the hot ring when it covers the page"""
+        if username is None and since is None and until is None:
+            page = (await self._warm(room)).before(before, limit)
+            if len(page) == limit:
+                return page
+        return await self.history.page(room, before, limit, username, since, until)
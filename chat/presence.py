@@ -0,0 +1,197 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Set
+
+from chat.backplane import Backplane
+from services.serializer import dumps, loads
+
+# Called with (room, frame) whenever a room's membership changed
+ChangeHandler = Callable[[str, dict], None]
+
+
+class PresenceTracker:
+    """
+    Who is online, per room, across every worker.
+
+    Each worker counts its own sockets per (room, user). Changes are not
+    sent one by one: every ``flush_interval`` a worker whose counts changed
+    publishes its full local view on the backplane ``presence`` topic (and
+    re-publishes it every ``heartbeat_interval`` so late joiners catch up).
+    Every worker merges the views it has heard from, drops workers that went
+    silent, and reports the joined/left users per room in one coalesced
+    delta per interval.
+    """
+
+    def __init__(
+        self,
+        backplane: Backplane,
+        flush_interval: float = float(os.environ.get("PRESENCE_FLUSH_INTERVAL", 0.5)),
+        heartbeat_interval: float = 10.0,
+    ):
+        self.backplane = backplane
+        self.flush_interval = flush_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.local: Dict[str, Counter] = {}
+        self.workers: Dict[str, tuple] = {}
+        self.merged: Dict[str, Counter] = {}
+        self.listeners: List[ChangeHandler] = []
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.streams_ended = False
+        self._snapshot = self._build_snapshot()
+        self._dirty = False
+        self._last_publish = 0.0
+        self._task: Optional[asyncio.Task] = None
+        backplane.subscribe(self._on_message)
+
+    async def start(self):
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        # Tell the other workers our sockets are gone
+        self.local.clear()
+        await self._publish()
+
+    def join(self, room: str, user: str):
+        self.local.setdefault(room, Counter())[user] += 1
+        self._dirty = True
+
+    def leave(self, room: str, user: str):
+        members = self.local.get(room)
+        if members is None or members[user] <= 0:
+            return
+        members[user] -= 1
+        if members[user] == 0:
+            del members[user]
+            if not members:
+                del self.local[room]
+        self._dirty = True
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            now = time.monotonic()
+            if self._dirty or now - self._last_publish >= self.heartbeat_interval:
+                await self._publish()
+            self._expire(now)
+
+    async def _publish(self):
+        self._dirty = False
+        self._last_publish = time.monotonic()
+        payload = {"worker": self.worker_id, "rooms": {room: dict(users) for room, users in self.local.items()}}
+        await self.backplane.publish("presence", dumps(payload))
+
+    def _on_message(self, topic: str, data: bytes):
+        if topic != "presence":
+            return
+        payload = loads(data)
+        rooms = {room: Counter(users) for room, users in payload["rooms"].items()}
+        if rooms:
+            self.workers[payload["worker"]] = (time.monotonic(), rooms)
+        else:
+            self.workers.pop(payload["worker"], None)
+        self._merge()
+
+    def _expire(self, now: float):
+        deadline = now - 3 * self.heartbeat_interval
+        stale = [worker for worker, (seen, _) in self.workers.items() if seen < deadline and worker != self.worker_id]
+        for worker in stale:
+            del self.workers[worker]
+        if stale:
+            self._merge()
+
+    def _merge(self):
+        merged: Dict[str, Counter] = {}
+        for _, rooms in self.workers.values():
+            for room, users in rooms.items():
+                merged.setdefault(room, Counter()).update(users)
+
+        previous = self.merged
+        self.merged = merged
+        self._snapshot = self._build_snapshot()
+        for room in set(previous) | set(merged):
+            before = previous.get(room, Counter())
+            after = merged.get(room, Counter())
+            joined = sorted(set(after) - set(before))
+            left = sorted(set(before) - set(after))
+            if joined or left or sum(before.values()) != sum(after.values()):
+                frame = self.delta_frame(room, joined, left, sum(after.values()))
+                for listener in self.listeners:
+                    listener(room, frame)
+
+        # Landing-page streams only ever need the newest snapshot
+        for queue in tuple(self.subscribers):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(self._snapshot)
+
+    def room_frame(self, room: str) -> dict:
+        """Full membership of a room, sent once to each socket that joins it"""
+        members = self.merged.get(room, Counter())
+        return {
+            "type": "presence",
+            "room": room,
+            "joined": [],
+            "left": [],
+            "online": sum(members.values()),
+            "users": sorted(members),
+        }
+
+    @staticmethod
+    def delta_frame(room: str, joined: List[str], left: List[str], online: int) -> dict:
+        """
+        A change in a room: who joined and left, and the new total. No member
+        list, so a flush costs the size of the change rather than of the room.
+        """
+        return {"type": "presence", "room": room, "joined": joined, "left": left, "online": online}
+
+    @staticmethod
+    def merge_deltas(older: dict, newer: dict) -> dict:
+        """One delta with the net effect of ``older`` followed by ``newer``"""
+        joined = [user for user in older["joined"] if user not in newer["left"]]
+        joined += [user for user in newer["joined"] if user not in joined]
+        left = [user for user in older["left"] if user not in newer["joined"]]
+        left += [user for user in newer["left"] if user not in left]
+        return PresenceTracker.delta_frame(newer["room"], joined, left, newer["online"])
+
+    def _build_snapshot(self) -> dict:
+        return {
+            "online_users": sum(sum(users.values()) for users in self.merged.values()),
+            "rooms": {room: sum(users.values()) for room, users in self.merged.items()},
+        }
+
+    def snapshot(self) -> dict:
+        """Precomputed totals; rebuilt only when presence changes"""
+        return self._snapshot
+
+    def subscribe(self) -> asyncio.Queue:
+        """Queue of snapshots; yields None once the streams are ended"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        if self.streams_ended:
+            queue.put_nowait(None)
+            return queue
+        queue.put_nowait(self._snapshot)
+        self.subscribers.add(queue)
+        return queue
+
+    def end_streams(self):
+        """Tell every subscriber to stop, so open streams let shutdown proceed"""
+        self.streams_ended = True
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(None)
+        self.subscribers.clear()
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
@@ -0,0 +1,207 @@
+import asyncio
+import os
+import time
+from typing import Optional
+
+from fastapi import APIRouter, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.templating import Jinja2Templates
+
+from chat.index import ConnectionManager, DEFAULT_ROOM
+from chat.frames import ChatFrame, FrameTooLarge, IncomingMessage
+from middleware.ratelimit import client_key
+from services.metrics import RATE_LIMITED, WS_MESSAGES_RECEIVED
+from services.pages import FragmentCache, PrerenderedPage
+from services.ratelimit import RateLimit, rate_limits
+from services.serializer import dumps_str
+
+# Chat pages, the chat WebSocket and its HTTP APIs; only the server profile
+# mounts these, so serverless cold starts never import Jinja or the chat stack
+router = APIRouter()
+
+# Chat names of sockets without a verified identity, when tokens are verified
+GUEST_PREFIX = "guest:"
+
+# Per-sender message rate on the chat socket, keyed like the HTTP limits
+# (verified subject, else peer address) so renaming the socket is no escape
+WS_MESSAGE_LIMIT = RateLimit.parse(os.environ.get("RATE_LIMIT_WS", "5/s:10"))
+
+# Templates setup: compile every template now and never re-check the files
+templates = Jinja2Templates(directory="templates")
+templates.env.auto_reload = False
+for template_name in templates.env.list_templates():
+    templates.get_template(template_name)
+
+# The landing page is static: render and compress it once
+index_page = PrerenderedPage(templates.get_template("index.html").render())
+history_template = templates.get_template("_history.html")
+
+manager = ConnectionManager()
+
+# Rendered history per room, dropped whenever a message lands in that room
+history_fragments = FragmentCache()
+manager.history_listeners.append(history_fragments.invalidate)
+
+# Chat routes
+@router.get("/", response_class=HTMLResponse)
+async def get_chat_page(request: Request):
+    return index_page.respond(request)
+
+@router.get("/chat", response_class=HTMLResponse)
+async def get_chat_room(request: Request, room: str = DEFAULT_ROOM):
+    async def render_history() -> str:
+        return history_template.render(chat_history=await manager.get_chat_history(room))
+
+    history_html = await history_fragments.get_or_render(room, render_history)
+    return templates.TemplateResponse("chat.html", {
+        "request": request, 
+        "room": room,
+        "history_html": history_html
+    })
+
+@router.get("/chat/{room}", response_class=HTMLResponse)
+async def get_named_chat_room(request: Request, room: str):
+    return await get_chat_room(request, room)
+
+# Reconnecting clients pass ?last_seq=<newest message id they have> to get
+# only what they missed
+@router.websocket("/ws/{client_id}")
+async def websocket_endpoint(websocket: WebSocket, client_id: str, last_seq: Optional[int] = None):
+    await room_websocket_endpoint(websocket, DEFAULT_ROOM, client_id, last_seq)
+
+@router.websocket("/ws/{room}/{client_id}")
+async def room_websocket_endpoint(websocket: WebSocket, room: str, client_id: str, last_seq: Optional[int] = None):
+    # With a verifier configured, a verified token decides who this is and
+    # anyone else is a guest, so the path id cannot pass for a verified user
+    verified = getattr(websocket.state, "verified", None)
+    if verified is not None:
+        claims = websocket.state.claims if verified else {}
+        client_id = str(claims["sub"]) if claims.get("sub") else GUEST_PREFIX + client_id
+
+    connection = await manager.connect(websocket, client_id, room, last_seq)
+    if connection is None:
+        return
+
+    try:
+        # Send welcome message, unless this is a quick reconnect the room never heard about
+        if not manager.resume(connection):
+            welcome_msg = ChatFrame(
+                username="System",
+                message=f"{client_id} joined the chat!",
+                type="system"
+            )
+            await manager.broadcast(welcome_msg, room)
+
+        limited = False
+        while True:
+            # Receive message from client
+            data = await websocket.receive_text()
+            WS_MESSAGES_RECEIVED.inc()
+            try:
+                incoming = IncomingMessage.decode(data)
+            except FrameTooLarge:
+                # 1009: message too big
+                await websocket.close(code=1009)
+                raise WebSocketDisconnect(1009)
+            except ValueError:
+                # Ignore frames that are not valid chat JSON
+                continue
+
+            # Over the limit: drop the message, telling the sender once per streak
+            if WS_MESSAGE_LIMIT is not None:
+                wait = await rate_limits.take("ws|" + client_key(websocket.scope), WS_MESSAGE_LIMIT)
+                if wait:
+                    RATE_LIMITED.inc("ws")
+                    if not limited:
+                        manager.send_frame(connection, ChatFrame(
+                            username="System",
+                            message=f"You are sending messages too fast; wait {wait:.1f}s",
+                            type="system"
+                        ))
+                    limited = True
+                    continue
+                limited = False
+            
+            # Create message object
+            chat_message = ChatFrame(
+                username=client_id,
+                message=incoming.message,
+                type="user"
+            )
+            
+            # Broadcast message to everyone in the room
+            await manager.broadcast(chat_message, room)
+            
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # Whatever ended the loop (a close, an error, cancellation), the
+        # socket leaves the room; only a drain skips the "left" message, as
+        # everyone is leaving this worker and will be back shortly
+        manager.disconnect(connection)
+        if not manager.draining:
+            # Send disconnect message once the resume grace window has passed
+            disconnect_msg = ChatFrame(
+                username="System",
+                message=f"{client_id} left the chat!",
+                type="system"
+            )
+            await manager.depart(room, client_id, disconnect_msg)
+
+# API to get online users count (snapshot across all workers, rebuilt on presence changes)
+@router.get("/api/online-users")
+async def get_online_users(room: Optional[str] = None):
+    snapshot = manager.presence.snapshot()
+    response = {
+        "success": True,
+        "online_users": snapshot["online_users"],
+        "timestamp": time.asctime()
+    }
+    if room is not None:
+        response["room"] = room
+        response["room_users"] = snapshot["rooms"].get(room, 0)
+    return response
+
+# Server-Sent Events stream of the online snapshot, pushed when presence changes
+@router.get("/api/online-users/stream")
+async def stream_online_users():
+    async def events():
+        queue = manager.presence.subscribe()
+        try:
+            while True:
+                try:
+                    snapshot = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if snapshot is None:
+                    # The server is shutting down
+                    return
+                yield f"data: {dumps_str(snapshot)}\n\n"
+        finally:
+            manager.presence.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+# Cursor-paginated chat history, oldest first; pass next_before to page back
+@router.get("/api/chat/history")
+async def get_chat_history(
+    room: str = DEFAULT_ROOM,
+    before: Optional[int] = None,
+    limit: int = 50,
+    user: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+):
+    limit = max(1, min(limit, 200))
+    messages = await manager.get_history_page(room, before, limit, user, since, until)
+    return {
+        "status_code": 200,
+        "success": True,
+        "message": "Chat history fetched successfully",
+        "data": [message.to_dict() for message in messages],
+        "next_before": messages[0].id if len(messages) == limit else None
+    }
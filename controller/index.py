@@ -1,321 +1,540 @@
-from fastapi import Response, APIRouter, HTTPException
-from fastapi.responses import JSONResponse, HTMLResponse
-import requests
+from fastapi import Response, APIRouter, Request
+from fastapi.responses import StreamingResponse
 import asyncio
 import aiohttp
-from typing import Optional
+from typing import AsyncIterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from services.cache import Payload, response_cache
+from services.catalog import CATALOG_SPECS, CatalogError, catalog
+from services.resilience import CircuitOpenError
+from services.serializer import FastJSONResponse, dumps, envelope, loads
+from services.singleflight import SingleFlight
+from services.streaming import ArrayItemScanner, parse_fields, project, project_raw
+from services.upstream import upstream
 
 routes = APIRouter(prefix="/api", tags=["data"])
 
+# Identical concurrent upstream fetches share one request
+flight = SingleFlight()
+
+MAX_BATCH_SIZE = 100
+# Upstream requests in flight per batch call
+BATCH_CONCURRENCY = 8
+# Bytes read from the upstream per step when streaming a collection
+STREAM_CHUNK_SIZE = 64 * 1024
+MAX_SEARCH_LIMIT = 100
+
+
+class UpstreamResource(NamedTuple):
+    """
+    A DummyJSON collection proxied under ``/api/<name>``.
+
+    ``upstream`` is its path on the upstream (``/<name>`` by default) and
+    ``list_key`` the array holding its records in list responses (``name``
+    by default). ``item`` names one record in messages.
+    """
+    name: str
+    upstream: Optional[str] = None
+    list_key: Optional[str] = None
+    item: Optional[str] = None
+
+    @property
+    def path(self) -> str:
+        return self.upstream or f"/{self.name}"
+
+    @property
+    def key(self) -> str:
+        return self.list_key or self.name
+
+    @property
+    def title(self) -> str:
+        return self.name.capitalize()
+
+    @property
+    def item_name(self) -> str:
+        return self.item or self.name[:-1]
+
+
+# Every resource gets list, batch and by-ID routes from add_resource
+RESOURCES = [
+    UpstreamResource("posts"),
+    UpstreamResource("products"),
+    UpstreamResource("users"),
+    UpstreamResource("comments"),
+    UpstreamResource("todos"),
+]
+
+
+async def fetch_list(
+    resource: UpstreamResource, params: dict, fields: Optional[Sequence[str]] = None
+) -> Tuple[dict, bool]:
+    """Fetch a DummyJSON collection; returns the response envelope and whether it may be cached"""
+    key = (resource.path, tuple(sorted(params.items())), fields)
+    return await flight.do(key, lambda: _fetch_list(resource, params, fields))
 
-@routes.get("/posts")
-async def get_posts():
-    """Fetch all posts from DummyJSON API"""
+
+async def fetch_item(resource: UpstreamResource, item_id: int) -> Tuple[Payload, bool]:
+    """Fetch a single DummyJSON record by ID; returns the envelope and whether it may be cached"""
+    return await flight.do((f"{resource.path}/{item_id}", ()), lambda: _fetch_item(resource, item_id))
+
+
+async def list_response(
+    request: Request, resource: UpstreamResource, limit: Optional[int], skip: Optional[int], fields: Optional[str]
+) -> Response:
+    """Paginated, optionally projected collection; ``limit=0`` (everything) is streamed"""
+    params = {}
+
+    if limit is not None:
+        params["limit"] = limit
+    # skip=0 is the upstream default, so leave it out of the cache key
+    if skip:
+        params["skip"] = skip
+    projection = parse_fields(fields)
+
+    if limit == 0:
+        return await stream_list(resource, params, projection)
+    return await response_cache.respond(
+        request,
+        response_cache.key(resource.name, fields=",".join(projection) if projection else None, **params),
+        lambda: fetch_list(resource, params, fields=projection)
+    )
+
+
+async def stream_list(resource: UpstreamResource, params: dict, fields: Optional[Sequence[str]]) -> Response:
+    """
+    Relay a whole collection item by item.
+
+    The envelope is written as the upstream body arrives, so memory stays
+    flat however large the collection and the first bytes go out as soon as
+    the upstream starts answering. Streamed responses are not cached.
+    """
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                "https://dummyjson.com/posts",
-                headers={"Content-Type": "application/json"}
-            ) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return JSONResponse({
-                        "status_code": 200,
-                        "success": True,
-                        "message": "Posts fetched successfully",
-                        "data": data.get("posts", []),
-                        "total": data.get("total", 0)
-                    })
-                else:
-                    return JSONResponse({
-                        "status_code": response.status,
-                        "success": False,
-                        "message": f"Failed to fetch posts: {response.status}",
-                        "data": []
-                    })
-                    
+        response = await upstream.open(
+            resource.path,
+            params=params,
+            headers={"Content-Type": "application/json"}
+        )
+    except CircuitOpenError:
+        return FastJSONResponse(unavailable(resource.name, []))
+    except asyncio.TimeoutError:
+        return FastJSONResponse(timed_out(resource.name, []))
     except aiohttp.ClientError as e:
-        return JSONResponse({
+        return FastJSONResponse({
             "status_code": 500,
             "success": False,
             "message": f"Network error: {str(e)}",
             "data": []
         })
-    except Exception as e:
-        return JSONResponse({
-            "status_code": 500,
+
+    if response.status != 200:
+        response.release()
+        return FastJSONResponse({
+            "status_code": response.status,
             "success": False,
-            "message": f"Internal server error: {str(e)}",
+            "message": f"Failed to fetch {resource.name}: {response.status}",
             "data": []
         })
+    return StreamingResponse(
+        _stream_envelope(resource, response, fields),
+        media_type="application/json",
+        headers={"Cache-Control": "no-store", "X-Cache": "BYPASS"}
+    )
 
 
-@routes.get("/posts/{post_id}")
-async def get_post_by_id(post_id: int):
-    """Fetch a specific post by ID"""
+async def _stream_envelope(
+    resource: UpstreamResource, response: aiohttp.ClientResponse, fields: Optional[Sequence[str]]
+) -> AsyncIterator[bytes]:
+    scanner = ArrayItemScanner(resource.key)
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"https://dummyjson.com/posts/{post_id}",
-                headers={"Content-Type": "application/json"}
-            ) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return JSONResponse({
-                        "status_code": 200,
-                        "success": True,
-                        "message": "Post fetched successfully",
-                        "data": data
-                    })
-                elif response.status == 404:
-                    return JSONResponse({
-                        "status_code": 404,
-                        "success": False,
-                        "message": "Post not found",
-                        "data": None
-                    })
-                else:
-                    return JSONResponse({
-                        "status_code": response.status,
-                        "success": False,
-                        "message": f"Failed to fetch post: {response.status}",
-                        "data": None
-                    })
-                    
-    except aiohttp.ClientError as e:
-        return JSONResponse({
-            "status_code": 500,
-            "success": False,
-            "message": f"Network error: {str(e)}",
-            "data": None
+        head = dumps({
+            "status_code": 200,
+            "success": True,
+            "message": f"{resource.title} fetched successfully"
         })
-    except ValueError:
-        return JSONResponse({
+        yield head[:-1] + b',"data":['
+        separator = b""
+        async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+            items = scanner.feed(chunk)
+            if items:
+                yield separator + b",".join(project_raw(item, fields) for item in items)
+                separator = b","
+        outer = scanner.finish()
+        yield b"]," + dumps({
+            "total": outer.get("total", 0),
+            "skip": outer.get("skip", 0),
+            "limit": outer.get("limit", 0)
+        })[1:]
+    finally:
+        response.release()
+
+
+def parse_values(values: Optional[str]) -> List[str]:
+    """Comma-separated filter values, e.g. ``category=laptops,tablets``"""
+    return [value.strip() for value in values.split(",") if value.strip()] if values else []
+
+
+async def search_response(
+    resource: str,
+    q: Optional[str],
+    where: dict,
+    ranges: dict,
+    sort: Optional[str],
+    skip: int,
+    limit: int,
+    fields: Optional[str]
+) -> FastJSONResponse:
+    """Answer a search from the mirrored catalog; no upstream round trip once it is loaded"""
+    numeric = CATALOG_SPECS[resource].numeric
+    sort_field = sort.lstrip("-") if sort else None
+    if sort_field is not None and sort_field not in numeric:
+        return FastJSONResponse({
             "status_code": 400,
             "success": False,
-            "message": "Invalid post ID",
-            "data": None
+            "message": f"sort must be one of {', '.join(numeric)} (prefix with - to sort descending)",
+            "data": []
         })
-    except Exception as e:
-        return JSONResponse({
-            "status_code": 500,
+    if skip < 0 or not 1 <= limit <= MAX_SEARCH_LIMIT:
+        return FastJSONResponse({
+            "status_code": 400,
             "success": False,
-            "message": f"Internal server error: {str(e)}",
-            "data": None
+            "message": f"skip must be >= 0 and limit between 1 and {MAX_SEARCH_LIMIT}",
+            "data": []
         })
 
-
-@routes.get("/products")
-async def get_products(limit: Optional[int] = None, skip: Optional[int] = None):
-    """Fetch all products from DummyJSON API with optional pagination"""
     try:
-        url = "https://dummyjson.com/products"
-        params = {}
-        
-        if limit is not None:
-            params["limit"] = limit
-        if skip is not None:
-            params["skip"] = skip
-            
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                url,
-                params=params,
-                headers={"Content-Type": "application/json"}
-            ) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return JSONResponse({
-                        "status_code": 200,
-                        "success": True,
-                        "message": "Products fetched successfully",
-                        "data": data.get("products", []),
-                        "total": data.get("total", 0),
-                        "skip": data.get("skip", 0),
-                        "limit": data.get("limit", 30)
-                    })
-                else:
-                    return JSONResponse({
-                        "status_code": response.status,
-                        "success": False,
-                        "message": f"Failed to fetch products: {response.status}",
-                        "data": []
-                    })
-                    
-    except aiohttp.ClientError as e:
-        return JSONResponse({
-            "status_code": 500,
+        snapshot = await catalog[resource].get_snapshot()
+    except CircuitOpenError:
+        return FastJSONResponse(unavailable(resource, []))
+    except (CatalogError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+        return FastJSONResponse({
+            "status_code": 503,
             "success": False,
-            "message": f"Network error: {str(e)}",
-            "data": []
-        })
-    except Exception as e:
-        return JSONResponse({
-            "status_code": 500,
-            "success": False,
-            "message": f"Internal server error: {str(e)}",
+            "message": f"{resource.capitalize()} catalog not available: {str(e) or type(e).__name__}",
             "data": []
         })
 
+    total, page = snapshot.search(
+        q=q,
+        where={name: values for name, values in where.items() if values},
+        ranges=ranges,
+        sort=sort_field,
+        descending=bool(sort) and sort.startswith("-"),
+        skip=skip,
+        limit=limit
+    )
+    projection = parse_fields(fields)
+    return FastJSONResponse(envelope({
+        "status_code": 200,
+        "success": True,
+        "message": f"{resource.capitalize()} searched successfully",
+        "total": total,
+        "skip": skip,
+        "limit": limit,
+        "as_of": snapshot.built_at
+    }, b"[" + b",".join(project_raw(item, projection) for item in page) + b"]"))
+
+
+def parse_ids(ids: str) -> List[int]:
+    """Parse a comma-separated ID list, dropping duplicates but keeping order"""
+    return list(dict.fromkeys(int(part) for part in ids.split(",") if part.strip()))
+
+
+async def fetch_batch(resource: UpstreamResource, ids: List[int]) -> dict:
+    """
+    Fetch several records by ID: cached ones are decoded from the response
+    cache, the rest are fetched concurrently (at most BATCH_CONCURRENCY at a
+    time). Failures are reported per ID alongside the records that succeeded.
+    """
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def fetch_one(item_id: int) -> dict:
+        key = response_cache.key(resource.name, id=item_id)
+        payload = await response_cache.get_payload(key)
+        if payload is None:
+            async with semaphore:
+                payload, cacheable = await fetch_item(resource, item_id)
+            if cacheable:
+                await response_cache.put(key, payload)
+        return loads(payload) if isinstance(payload, bytes) else payload
 
-@routes.get("/products/{product_id}")
-async def get_product_by_id(product_id: int):
-    """Fetch a specific product by ID"""
+    payloads = await asyncio.gather(*(fetch_one(item_id) for item_id in ids))
+
+    data = []
+    errors = {}
+    for item_id, payload in zip(ids, payloads):
+        if payload["success"]:
+            data.append(payload["data"])
+        else:
+            errors[str(item_id)] = {"status_code": payload["status_code"], "message": payload["message"]}
+
+    if not errors:
+        status_code, message = 200, f"{resource.title} fetched successfully"
+    elif data:
+        status_code, message = 207, f"Fetched {len(data)} of {len(ids)} {resource.name}"
+    else:
+        status_code, message = next(iter(errors.values()))["status_code"], f"Failed to fetch {resource.name}"
+    return {
+        "status_code": status_code,
+        "success": not errors,
+        "message": message,
+        "data": data,
+        "errors": errors
+    }
+
+
+async def batch_response(resource: UpstreamResource, ids: str) -> FastJSONResponse:
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"https://dummyjson.com/products/{product_id}",
-                headers={"Content-Type": "application/json"}
-            ) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return JSONResponse({
-                        "status_code": 200,
-                        "success": True,
-                        "message": "Product fetched successfully",
-                        "data": data
-                    })
-                elif response.status == 404:
-                    return JSONResponse({
-                        "status_code": 404,
-                        "success": False,
-                        "message": "Product not found",
-                        "data": None
-                    })
-                else:
-                    return JSONResponse({
-                        "status_code": response.status,
-                        "success": False,
-                        "message": f"Failed to fetch product: {response.status}",
-                        "data": None
-                    })
-                    
-    except aiohttp.ClientError as e:
-        return JSONResponse({
-            "status_code": 500,
-            "success": False,
-            "message": f"Network error: {str(e)}",
-            "data": None
-        })
+        item_ids = parse_ids(ids)
     except ValueError:
-        return JSONResponse({
+        return FastJSONResponse({
             "status_code": 400,
             "success": False,
-            "message": "Invalid product ID",
-            "data": None
+            "message": "ids must be a comma-separated list of integers",
+            "data": []
         })
-    except Exception as e:
-        return JSONResponse({
-            "status_code": 500,
+    if not item_ids or len(item_ids) > MAX_BATCH_SIZE:
+        return FastJSONResponse({
+            "status_code": 400,
             "success": False,
-            "message": f"Internal server error: {str(e)}",
-            "data": None
+            "message": f"ids must contain between 1 and {MAX_BATCH_SIZE} IDs",
+            "data": []
         })
+    return FastJSONResponse(await fetch_batch(resource, item_ids))
 
 
-@routes.get("/users")
-async def get_users(limit: Optional[int] = None, skip: Optional[int] = None):
-    """Fetch all users from DummyJSON API with optional pagination"""
+def unavailable(resource: str, empty) -> dict:
+    """Envelope for a resource whose circuit breaker is open"""
+    return {
+        "status_code": 503,
+        "success": False,
+        "message": f"Upstream {resource} temporarily unavailable",
+        "data": empty
+    }
+
+
+def timed_out(resource: str, empty) -> dict:
+    """Envelope for a fetch that ran past its route deadline"""
+    return {
+        "status_code": 504,
+        "success": False,
+        "message": f"Upstream {resource} timed out",
+        "data": empty
+    }
+
+
+async def _fetch_list(
+    resource: UpstreamResource, params: dict, fields: Optional[Sequence[str]] = None
+) -> Tuple[dict, bool]:
     try:
-        url = "https://dummyjson.com/users"
-        params = {}
-        
-        if limit is not None:
-            params["limit"] = limit
-        if skip is not None:
-            params["skip"] = skip
-            
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                url,
-                params=params,
-                headers={"Content-Type": "application/json"}
-            ) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return JSONResponse({
-                        "status_code": 200,
-                        "success": True,
-                        "message": "Users fetched successfully",
-                        "data": data.get("users", []),
-                        "total": data.get("total", 0),
-                        "skip": data.get("skip", 0),
-                        "limit": data.get("limit", 30)
-                    })
-                else:
-                    return JSONResponse({
-                        "status_code": response.status,
-                        "success": False,
-                        "message": f"Failed to fetch users: {response.status}",
-                        "data": []
-                    })
-                    
+        response = await upstream.fetch(
+            resource.path,
+            route="list",
+            params=params,
+            headers={"Content-Type": "application/json"}
+        )
+        if response.status == 200:
+            data = loads(response.body)
+            items = data.get(resource.key, [])
+            return {
+                "status_code": 200,
+                "success": True,
+                "message": f"{resource.title} fetched successfully",
+                "data": [project(item, fields) for item in items] if fields else items,
+                "total": data.get("total", 0),
+                "skip": data.get("skip", 0),
+                "limit": data.get("limit", 30)
+            }, True
+        else:
+            return {
+                "status_code": response.status,
+                "success": False,
+                "message": f"Failed to fetch {resource.name}: {response.status}",
+                "data": []
+            }, False
+
+    except CircuitOpenError:
+        return unavailable(resource.name, []), False
+    except asyncio.TimeoutError:
+        return timed_out(resource.name, []), False
     except aiohttp.ClientError as e:
-        return JSONResponse({
+        return {
             "status_code": 500,
             "success": False,
             "message": f"Network error: {str(e)}",
             "data": []
-        })
+        }, False
     except Exception as e:
-        return JSONResponse({
+        return {
             "status_code": 500,
             "success": False,
             "message": f"Internal server error: {str(e)}",
             "data": []
-        })
+        }, False
 
 
-@routes.get("/users/{user_id}")
-async def get_user_by_id(user_id: int):
-    """Fetch a specific user by ID"""
+async def _fetch_item(resource: UpstreamResource, item_id: int) -> Tuple[Payload, bool]:
+    name = resource.item_name
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"https://dummyjson.com/users/{user_id}",
-                headers={"Content-Type": "application/json"}
-            ) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return JSONResponse({
-                        "status_code": 200,
-                        "success": True,
-                        "message": "User fetched successfully",
-                        "data": data
-                    })
-                elif response.status == 404:
-                    return JSONResponse({
-                        "status_code": 404,
-                        "success": False,
-                        "message": "User not found",
-                        "data": None
-                    })
-                else:
-                    return JSONResponse({
-                        "status_code": response.status,
-                        "success": False,
-                        "message": f"Failed to fetch user: {response.status}",
-                        "data": None
-                    })
-                    
+        response = await upstream.fetch(
+            f"{resource.path}/{item_id}",
+            headers={"Content-Type": "application/json"}
+        )
+        if response.status == 200 and response.content_type == "application/json":
+            # The record is passed through as raw bytes, never decoded
+            return envelope({
+                "status_code": 200,
+                "success": True,
+                "message": f"{name.capitalize()} fetched successfully"
+            }, response.body), True
+        elif response.status == 404:
+            return {
+                "status_code": 404,
+                "success": False,
+                "message": f"{name.capitalize()} not found",
+                "data": None
+            }, False
+        else:
+            return {
+                "status_code": response.status,
+                "success": False,
+                "message": f"Failed to fetch {name}: {response.status}",
+                "data": None
+            }, False
+
+    except CircuitOpenError:
+        return unavailable(resource.name, None), False
+    except asyncio.TimeoutError:
+        return timed_out(resource.name, None), False
     except aiohttp.ClientError as e:
-        return JSONResponse({
+        return {
             "status_code": 500,
             "success": False,
             "message": f"Network error: {str(e)}",
             "data": None
-        })
+        }, False
     except ValueError:
-        return JSONResponse({
+        return {
             "status_code": 400,
             "success": False,
-            "message": "Invalid user ID",
+            "message": f"Invalid {name} ID",
             "data": None
-        })
+        }, False
     except Exception as e:
-        return JSONResponse({
+        return {
             "status_code": 500,
             "success": False,
             "message": f"Internal server error: {str(e)}",
             "data": None
-        })
\ No newline at end of file
+        }, False
+
+
+def add_resource(router: APIRouter, resource: UpstreamResource):
+    """
+    Register the list, batch and by-ID routes of one resource.
+
+    All three go through the shared fetch, single-flight, cache and
+    envelope pipeline above. The ID route only matches integers, so
+    hand-written routes such as ``/<name>/search`` can be added in any order.
+    """
+    name = resource.name
+
+    async def get_list(
+        request: Request,
+        limit: Optional[int] = None,
+        skip: Optional[int] = None,
+        fields: Optional[str] = None
+    ):
+        return await list_response(request, resource, limit, skip, fields)
+
+    async def get_batch(ids: str):
+        return await batch_response(resource, ids)
+
+    async def get_by_id(request: Request, item_id: int):
+        return await response_cache.respond(
+            request,
+            response_cache.key(name, id=item_id),
+            lambda: fetch_item(resource, item_id)
+        )
+
+    router.add_api_route(
+        f"/{name}", get_list, methods=["GET"], name=f"get_{name}",
+        description=f"Fetch {name} with optional limit/skip pagination and ``fields=id,...`` projection; ``limit=0`` streams all of them"
+    )
+    router.add_api_route(
+        f"/{name}/batch", get_batch, methods=["GET"], name=f"get_{name}_batch",
+        description=f"Fetch several {name} at once, e.g. /api/{name}/batch?ids=1,2,3"
+    )
+    router.add_api_route(
+        f"/{name}/{{item_id:int}}", get_by_id, methods=["GET"], name=f"get_{resource.item_name}_by_id",
+        description=f"Fetch a specific {resource.item_name} by ID"
+    )
+
+
+for resource in RESOURCES:
+    add_resource(routes, resource)
+
+
+@routes.get("/products/search")
+async def search_products(
+    q: Optional[str] = None,
+    category: Optional[str] = None,
+    brand: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    min_rating: Optional[float] = None,
+    sort: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 30,
+    fields: Optional[str] = None
+):
+    """Search the mirrored products, e.g. /api/products/search?q=phone&category=smartphones&max_price=500&sort=-rating"""
+    return await search_response(
+        "products",
+        q,
+        {"category": parse_values(category), "brand": parse_values(brand)},
+        {"price": (min_price, max_price), "rating": (min_rating, None)},
+        sort,
+        skip,
+        limit,
+        fields
+    )
+
+
+@routes.get("/users/search")
+async def search_users(
+    q: Optional[str] = None,
+    gender: Optional[str] = None,
+    min_age: Optional[int] = None,
+    max_age: Optional[int] = None,
+    sort: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 30,
+    fields: Optional[str] = None
+):
+    """Search the mirrored users, e.g. /api/users/search?q=john&gender=male&min_age=30&sort=age"""
+    return await search_response(
+        "users",
+        q,
+        {"gender": parse_values(gender)},
+        {"age": (min_age, max_age)},
+        sort,
+        skip,
+        limit,
+        fields
+    )
+
+
+@routes.get("/upstream/stats")
+async def get_upstream_stats():
+    """Connection pool and response cache statistics for the upstream-proxy routes"""
+    return FastJSONResponse({
+        "status_code": 200,
+        "success": True,
+        "message": "Upstream stats fetched successfully",
+        "data": {
+            **upstream.stats(),
+            "cache": response_cache.stats(),
+            "single_flight": flight.stats(),
+            "catalog": catalog.stats()
+        }
+    })
\ No newline at end of file
@@ -0,0 +1,166 @@
+import hmac
+import os
+import sys
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+
+from middleware.index import SimpleAuthMiddleware
+from middleware.ratelimit import RateLimitMiddleware
+from middleware.tokens import create_verifier
+from services.ratelimit import RateLimit, rate_limits
+from services.serializer import FastJSONResponse
+
+PROFILES = ("server", "serverless")
+
+# Reachable without a token in every profile (/metrics checks its own).
+# "/" only matches the landing page; the other entries cover their subpaths.
+PUBLIC_PATHS = [
+    "/", "/chat", "/ws", "/health", "/docs", "/redoc", "/openapi.json", "/static",
+    "/api/online-users", "/api/chat/history", "/metrics"
+]
+
+# Routers the serverless profile imports on first use, by path prefix
+LAZY_ROUTERS = {"/api": "controller.index:routes"}
+
+# Hosts that may scrape /metrics when no METRICS_TOKEN is set
+LOOPBACK_HOSTS = ("127.0.0.1", "::1")
+
+
+def default_profile() -> str:
+    """APP_PROFILE if set; otherwise serverless on Vercel and server everywhere else"""
+    return os.environ.get("APP_PROFILE") or ("serverless" if os.environ.get("VERCEL") else "server")
+
+
+def create_app(profile: str = "server") -> FastAPI:
+    """
+    Build the app for one deployment profile.
+
+    ``server`` is the long-running process: chat pages and WebSockets,
+    background services started in the lifespan, and every router imported
+    up front. ``serverless`` serves the data API only: no templates or
+    WebSocket stack, nothing started in a lifespan, and the data router
+    (with aiohttp) is imported on the first request under ``/api``. Both
+    share the middleware, the public paths and the module-level upstream
+    pool, which warm serverless invocations keep reusing.
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown profile: {profile}")
+    server = profile == "server"
+
+    app = FastAPI(
+        title="Chat App with WebSocket",
+        lifespan=_server_lifespan if server else _serverless_lifespan,
+        default_response_class=FastJSONResponse
+    )
+
+    if server:
+        from chat.routes import router as chat_router
+        from controller.index import routes
+        from services.metrics import metrics
+
+        app.include_router(chat_router)
+        app.include_router(routes)
+
+        metrics_token = os.environ.get("METRICS_TOKEN")
+
+        # Prometheus scrape endpoint, merged across every worker of this server.
+        # Scrapers send METRICS_TOKEN as a bearer token; without one configured
+        # only this host may scrape.
+        @app.get("/metrics", response_class=PlainTextResponse)
+        async def get_metrics(request: Request):
+            if not _may_scrape(request, metrics_token):
+                return FastJSONResponse(
+                    status_code=403,
+                    content={"status_code": 403, "success": False, "message": "Forbidden", "data": None}
+                )
+            return PlainTextResponse(await metrics.exposition(), media_type="text/plain; version=0.0.4")
+    else:
+        from middleware.lazy import LazyRouterMiddleware
+
+        @app.get("/")
+        async def root():
+            return {"message": "FastAPI app running on Vercel!"}
+
+        # Innermost, so only authenticated requests trigger imports
+        app.add_middleware(LazyRouterMiddleware, target=app, routers=LAZY_ROUTERS)
+
+    @app.get("/health")
+    async def health_check():
+        return {"status": "healthy", "profile": profile, "timestamp": datetime.now().isoformat()}
+
+    # Runs after auth, so buckets are keyed by the verified subject
+    app.add_middleware(
+        RateLimitMiddleware,
+        store=rate_limits,
+        limits={
+            "/api": RateLimit.parse(os.environ.get("RATE_LIMIT_API", "50/s:100")),
+            "/api/chat/history": RateLimit.parse(os.environ.get("RATE_LIMIT_HISTORY", "10/s:20")),
+        }
+    )
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    app.add_middleware(
+        SimpleAuthMiddleware,
+        excluded_paths=PUBLIC_PATHS,
+        verifier=create_verifier(),
+        cache_size=int(os.environ.get("AUTH_CACHE_SIZE", 10000)),
+        cache_ttl=float(os.environ.get("AUTH_CACHE_TTL", 300))
+    )
+
+    if server:
+        from middleware.metrics import MetricsMiddleware
+
+        # Outermost, so latency includes auth and CORS
+        app.add_middleware(MetricsMiddleware)
+
+    return app
+
+
+def _may_scrape(request: Request, token: str | None) -> bool:
+    if token:
+        sent = request.headers.get("authorization", "")
+        return hmac.compare_digest(sent.encode(), b"Bearer " + token.encode())
+    return request.client is not None and request.client.host in LOOPBACK_HOSTS
+
+
+@asynccontextmanager
+async def _server_lifespan(app: FastAPI):
+    from chat.routes import manager
+    from services.catalog import catalog
+    from services.metrics import metrics
+    from services.upstream import upstream
+
+    # Join the cross-worker backplane before serving sockets
+    await metrics.start()
+    await rate_limits.start()
+    await manager.start()
+    await upstream.start()
+    await catalog.start()
+    yield
+    # Usually done already by DrainingServer, before uvicorn closed the sockets
+    await manager.drain()
+    await catalog.stop()
+    await upstream.close()
+    await manager.stop()
+    await rate_limits.stop()
+    await metrics.stop()
+
+
+@asynccontextmanager
+async def _serverless_lifespan(app: FastAPI):
+    # Handlers open the pool lazily; only close it if a request did
+    yield
+    upstream_module = sys.modules.get("services.upstream")
+    if upstream_module is not None:
+        await upstream_module.upstream.close()
@@ -1,41 +1,13 @@
-from fastapi import FastAPI, Request, Depends, APIRouter, WebSocket, WebSocketDisconnect
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.templating import Jinja2Templates
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
-import time
+from fastapi import Depends
 import os
-from typing import Annotated, List
-import json
-from datetime import datetime
+from typing import Annotated
 from pydantic import BaseModel
 
-# Import your existing routes and middleware
-from controller.index import routes
-from middleware.index import SimpleAuthMiddleware
+from factory import create_app, default_profile
 
-app = FastAPI(title="Chat App with WebSocket")
-
-# Templates setup
-templates = Jinja2Templates(directory="templates")
-
-# Static files (for CSS, JS, images)
-# app.mount("/static", StaticFiles(directory="static"), name="static")
-
-# CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Auth middleware (exclude chat routes from token requirement)
-app.add_middleware(
-    SimpleAuthMiddleware,
-    excluded_paths=["/", "/chat", "/docs", "/redoc", "/openapi.json", "/static"]
-)
+# The app, its routers and middleware are built by the factory; the
+# serverless entry point (api/main.py) builds the same app with fewer parts
+app = create_app(default_profile())
 
 # Pydantic models
 class Message(BaseModel):
@@ -43,110 +15,6 @@ class Message(BaseModel):
     message: str
     timestamp: str
 
-# WebSocket connection manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-        self.chat_history: List[dict] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
-
-    async def broadcast(self, message: dict):
-        # Add to chat history
-        self.chat_history.append(message)
-        # Keep only last 100 messages
-        if len(self.chat_history) > 100:
-            self.chat_history.pop(0)
-        
-        # Broadcast to all connected clients
-        message_json = json.dumps(message)
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message_json)
-            except:
-                # Remove broken connections
-                self.active_connections.remove(connection)
-
-    def get_chat_history(self):
-        return self.chat_history
-
-manager = ConnectionManager()
-
-# Chat routes
-@app.get("/", response_class=HTMLResponse)
-async def get_chat_page(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
-
-@app.get("/chat", response_class=HTMLResponse)
-async def get_chat_room(request: Request):
-    chat_history = manager.get_chat_history()
-    return templates.TemplateResponse("chat.html", {
-        "request": request, 
-        "chat_history": chat_history
-    })
-
-@app.websocket("/ws/{client_id}")
-async def websocket_endpoint(websocket: WebSocket, client_id: str):
-    await manager.connect(websocket)
-    
-    # Send welcome message
-    welcome_msg = {
-        "username": "System",
-        "message": f"{client_id} joined the chat!",
-        "timestamp": datetime.now().strftime("%H:%M:%S"),
-        "type": "system"
-    }
-    await manager.broadcast(welcome_msg)
-    
-    try:
-        while True:
-            # Receive message from client
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
-            
-            # Create message object
-            chat_message = {
-                "username": client_id,
-                "message": message_data.get("message", ""),
-                "timestamp": datetime.now().strftime("%H:%M:%S"),
-                "type": "user"
-            }
-            
-            # Broadcast message to all clients
-            await manager.broadcast(chat_message)
-            
-    except WebSocketDisconnect:
-        manager.disconnect(websocket)
-        
-        # Send disconnect message
-        disconnect_msg = {
-            "username": "System",
-            "message": f"{client_id} left the chat!",
-            "timestamp": datetime.now().strftime("%H:%M:%S"),
-            "type": "system"
-        }
-        await manager.broadcast(disconnect_msg)
-
-# API to get online users count
-@app.get("/api/online-users")
-async def get_online_users():
-    return {
-        "success": True,
-        "online_users": len(manager.active_connections),
-        "timestamp": time.asctime()
-    }
-
-# Include your existing API routes
-app.include_router(routes)
-
 # Your existing routes
 async def common_parameters(q: str | None = None, skip: int = 0, limit: int = 100):
     return {"q": q, "skip": skip, "limit": limit}
@@ -159,10 +27,22 @@ async def read_items(commons: Annotated[dict, Depends(common_parameters)]):
 # For Render deployment - this will run when the module is imported
 if __name__ == "__main__":
     import uvicorn
+    from chat.frames import MAX_FRAME_SIZE
+    from chat.routes import manager
+    from server import DrainingServer
     # Get port from environment variable (Render sets this)
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=False)
-else:
-    # This ensures the app runs properly when imported by gunicorn/uvicorn
-    import uvicorn
-    port = int(os.environ.get("PORT", 8000))
+    # permessage-deflate compresses frames for clients that offer it
+    # ws_max_size drops oversized frames in the protocol layer, before decoding
+    # X-Forwarded-For is trusted only from FORWARDED_ALLOW_IPS (comma-separated
+    # proxy addresses, "*" for any); rate limits key anonymous clients on the
+    # resulting address, so set it to the load balancer's address, not "*",
+    # unless nothing else can reach the port
+    config = uvicorn.Config(
+        "main:app", host="0.0.0.0", port=port, reload=False,
+        ws_per_message_deflate=True, ws_max_size=4 * MAX_FRAME_SIZE,
+        proxy_headers=True,
+        forwarded_allow_ips=os.environ.get("FORWARDED_ALLOW_IPS", "127.0.0.1")
+    )
+    # On SIGTERM, tell chat clients when to reconnect before sockets close
+    DrainingServer(config, drain=manager.drain).run()
@@ -1,46 +1,164 @@
-from fastapi import Request
 from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
-from typing import List
+from starlette.types import ASGIApp, Receive, Scope, Send
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import parse_qsl
 
-class SimpleAuthMiddleware(BaseHTTPMiddleware):
+from middleware.tokens import TokenError, TokenVerifier, VerifiedTokenCache
+
+
+class PathMatcher:
+    """
+    Precompiled path rules.
+
+    ``"/"`` and rules written as ``"=/path"`` match exactly; every other rule
+    matches that path and anything below it, segment by segment (``/chat``
+    matches ``/chat`` and ``/chat/room`` but not ``/chatter``). Prefix rules
+    are kept in a segment trie so a lookup costs one dict hit per segment.
+    """
+
+    _END = ""
+
+    def __init__(self, rules: Iterable[str]):
+        self.exact = set()
+        self.trie: Dict[str, dict] = {}
+        for rule in rules:
+            if rule.startswith("="):
+                self.exact.add(rule[1:])
+            elif rule == "/":
+                self.exact.add(rule)
+            else:
+                node = self.trie
+                for segment in rule.strip("/").split("/"):
+                    node = node.setdefault(segment, {})
+                node[self._END] = {}
+
+    def matches(self, path: str) -> bool:
+        if path in self.exact:
+            return True
+        node = self.trie
+        for segment in path.strip("/").split("/"):
+            if self._END in node:
+                return True
+            node = node.get(segment)
+            if node is None:
+                return False
+        return self._END in node
+
+
+def _unauthorized(message: str) -> JSONResponse:
+    return JSONResponse(
+        status_code=401,
+        content={
+            "status_code": 401,
+            "success": False,
+            "message": message,
+            "data": None
+        }
+    )
+
+
+# Built once; a Response can be sent any number of times
+UNAUTHORIZED = _unauthorized("Token required")
+INVALID_TOKEN = _unauthorized("Invalid or expired token")
+
+
+def is_preflight(scope: Scope) -> bool:
+    """A browser's CORS preflight request"""
+    if scope["type"] != "http" or scope["method"] != "OPTIONS":
+        return False
+    return any(name == b"access-control-request-method" for name, _ in scope["headers"])
+
+
+class SimpleAuthMiddleware:
     """
     Simple middleware to check if token exists in request
+
+    Implemented as plain ASGI: it reads the token straight from the scope
+    without building a Request, never wraps the response stream, and also
+    guards WebSocket handshakes (rejected with close code 1008).
+
+    With a ``verifier`` the token must also validate; its claims are cached
+    so repeat requests skip signature checks, and are exposed as
+    ``request.state.claims`` / ``websocket.state.claims``. ``state.verified``
+    then tells whether this request carried a valid token (public paths
+    are reached either way). Without a verifier any token is let through
+    and ``verified`` is not set.
+
+    CORS preflights (``OPTIONS`` with ``Access-Control-Request-Method``)
+    never carry a token, so they pass through for the CORS middleware to
+    answer.
     """
-    
-    def __init__(self, app, excluded_paths: List[str] = None):
-        super().__init__(app)
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        excluded_paths: List[str] = None,
+        verifier: Optional[TokenVerifier] = None,
+        cache_size: int = 10000,
+        cache_ttl: float = 300,
+    ):
+        self.app = app
         self.excluded_paths = excluded_paths or ["/docs", "/redoc", "/openapi.json"]
-    
-    async def dispatch(self, request: Request, call_next):
-        # Skip auth for excluded paths
-        if any(request.url.path.startswith(path) for path in self.excluded_paths):
-            return await call_next(request)
-        
-        # Check if token exists
-        token = self.get_token(request)
-        
-        if not token:
-            return JSONResponse(
-                status_code=401,
-                content={
-                    "status_code": 401,
-                    "success": False,
-                    "message": "Token required",
-                    "data": None
-                }
-            )
-        
-        # Token exists, continue
-        return await call_next(request)
-    
-    def get_token(self, request: Request) -> str:
+        self.matcher = PathMatcher(self.excluded_paths)
+        self.verifier = verifier
+        self.cache = VerifiedTokenCache(cache_size, cache_ttl)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        # Skip auth for lifespan events
+        if scope["type"] == "lifespan":
+            return await self.app(scope, receive, send)
+
+        if is_preflight(scope):
+            return await self.app(scope, receive, send)
+
+        excluded = self.matcher.matches(scope["path"])
+
+        # Check if token exists (and is valid)
+        token = self.get_token(scope)
+        claims = self.authenticate(token) if token else None
+        if claims is not None:
+            scope.setdefault("state", {})["claims"] = claims
+        if self.verifier is not None:
+            scope.setdefault("state", {})["verified"] = claims is not None
+
+        if claims is None and not excluded:
+            if scope["type"] == "websocket":
+                # Closing before accept rejects the handshake
+                await send({"type": "websocket.close", "code": 1008})
+            else:
+                await (INVALID_TOKEN if token else UNAUTHORIZED)(scope, receive, send)
+            return
+
+        # Token accepted (or path is public), continue
+        await self.app(scope, receive, send)
+
+    def authenticate(self, token: str) -> Optional[dict]:
+        """Claims for a valid token, None otherwise"""
+        if self.verifier is None:
+            # No key configured: presence of a token is all we check
+            return {}
+        claims = self.cache.get(token)
+        if claims is None:
+            try:
+                claims = self.verifier.verify(token)
+            except TokenError:
+                return None
+            self.cache.put(token, claims)
+        return claims
+
+    def get_token(self, scope: Scope) -> Optional[str]:
         """Get token from header or query parameter"""
         # Check Authorization header
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            return auth_header.replace("Bearer ", "")
-        
-        # Check query parameter
-        return request.query_params.get("token")
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                if value.startswith(b"Bearer "):
+                    return value[7:].decode("latin-1")
+                break
 
+        # Check query parameter (only parse when it can be there)
+        query_string = scope.get("query_string", b"")
+        if b"token=" in query_string:
+            for name, value in parse_qsl(query_string.decode("latin-1")):
+                if name == "token":
+                    return value
+        return None
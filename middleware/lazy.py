@@ -0,0 +1,44 @@
+import importlib
+from typing import Dict
+
+from fastapi import FastAPI
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from middleware.index import PathMatcher
+
+# Paths that describe every route, so they load every router first
+SCHEMA_PATHS = PathMatcher(["/docs", "/redoc", "/openapi.json"])
+
+
+class LazyRouterMiddleware:
+    """
+    Imports routers on the first request that needs them.
+
+    ``routers`` maps a path prefix to a ``"module:attribute"`` router spec.
+    The first HTTP request under a prefix imports the module and includes
+    the router in ``target``; later requests go straight through. Startup
+    then only pays for the middleware and the routes that are always
+    mounted, and each router's imports (aiohttp, for instance) land on the
+    first request that actually uses them.
+    """
+
+    def __init__(self, app: ASGIApp, target: FastAPI, routers: Dict[str, str]):
+        self.app = app
+        self.target = target
+        self.pending = {prefix: (PathMatcher([prefix]), spec) for prefix, spec in routers.items()}
+
+    def load(self, prefix: str):
+        _, spec = self.pending.pop(prefix)
+        module_name, _, attribute = spec.partition(":")
+        self.target.include_router(getattr(importlib.import_module(module_name), attribute))
+        # The cached schema predates these routes
+        self.target.openapi_schema = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if self.pending and scope["type"] in ("http", "websocket"):
+            path = scope["path"]
+            load_all = SCHEMA_PATHS.matches(path)
+            for prefix, (matcher, _) in list(self.pending.items()):
+                if load_all or matcher.matches(path):
+                    self.load(prefix)
+        await self.app(scope, receive, send)
@@ -0,0 +1,88 @@
+import hashlib
+from typing import Dict, Optional
+
+from fastapi.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from services.metrics import RATE_LIMITED
+from services.ratelimit import BucketStore, RateLimit, retry_after_header
+
+
+def client_key(scope: Scope) -> str:
+    """
+    Who a request counts against: the verified subject, else the verified
+    bearer token, else the client address. Unverified tokens (no verifier
+    configured) are ignored: a fresh random token per request would
+    otherwise get a fresh bucket. The address is the peer's, or the
+    forwarded one when the peer is a trusted proxy (see main.py).
+    """
+    state = scope.get("state", {})
+    if state.get("verified"):
+        claims = state["claims"]
+        if claims.get("sub"):
+            return "sub:" + str(claims["sub"])
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                if value.startswith(b"Bearer "):
+                    # Hashed so long tokens cost a fixed 16 bytes per bucket
+                    return "tok:" + hashlib.blake2b(value[7:], digest_size=8).hexdigest()
+                break
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+def _too_many_requests(wait: float) -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        headers={"Retry-After": retry_after_header(wait)},
+        content={
+            "status_code": 429,
+            "success": False,
+            "message": "Too many requests",
+            "data": None
+        }
+    )
+
+
+class RateLimitMiddleware:
+    """
+    Token-bucket rate limiting per client and route prefix, as plain ASGI.
+
+    ``limits`` maps path prefixes to a ``RateLimit``; the longest prefix
+    matching a request (segment by segment, like the auth exclusions)
+    decides its limit and each prefix has its own buckets. Requests outside
+    every prefix are not limited. A refused request gets a 429 with
+    ``Retry-After`` without reaching the app.
+
+    Install it inside the auth middleware so buckets are keyed by the
+    verified subject rather than by whatever token was sent.
+    """
+
+    def __init__(self, app: ASGIApp, store: BucketStore, limits: Dict[str, Optional[RateLimit]]):
+        self.app = app
+        self.store = store
+        # Longest first, so the most specific prefix wins
+        self.limits = sorted(
+            ((prefix.rstrip("/"), limit) for prefix, limit in limits.items() if limit is not None),
+            key=lambda rule: len(rule[0]),
+            reverse=True,
+        )
+
+    def match(self, path: str):
+        for prefix, limit in self.limits:
+            if path == prefix or path.startswith(prefix + "/"):
+                return prefix, limit
+        return None, None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        prefix, limit = self.match(scope["path"])
+        if limit is not None:
+            wait = await self.store.take(prefix + "|" + client_key(scope), limit)
+            if wait:
+                RATE_LIMITED.inc("http")
+                return await _too_many_requests(wait)(scope, receive, send)
+
+        await self.app(scope, receive, send)
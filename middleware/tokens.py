@@ -0,0 +1,137 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+
+class TokenError(Exception):
+    """Raised when a token is malformed, badly signed or expired"""
+
+
+def _b64decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+class TokenVerifier:
+    def verify(self, token: str) -> dict:
+        """Return the token's claims or raise TokenError"""
+        raise NotImplementedError
+
+
+class HMACTokenVerifier(TokenVerifier):
+    """
+    Verifies HS256 JWTs signed with a shared secret.
+
+    ``exp`` and ``nbf`` are enforced (with ``leeway`` seconds of clock skew)
+    when present.
+    """
+
+    HEADER = _b64encode(json.dumps({"alg": "HS256", "typ": "JWT"}, separators=(",", ":")).encode())
+
+    def __init__(self, secret: bytes, leeway: float = 30):
+        self.secret = secret
+        self.leeway = leeway
+
+    def _sign(self, signing_input: bytes) -> bytes:
+        return hmac.new(self.secret, signing_input, hashlib.sha256).digest()
+
+    def issue(self, claims: dict, ttl: Optional[float] = None) -> str:
+        """Mint a token, e.g. for development or tests"""
+        if ttl is not None:
+            claims = dict(claims, exp=int(time.time() + ttl))
+        payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+        signing_input = f"{self.HEADER}.{payload}"
+        return f"{signing_input}.{_b64encode(self._sign(signing_input.encode()))}"
+
+    def verify(self, token: str) -> dict:
+        try:
+            header_segment, payload_segment, signature_segment = token.split(".")
+            header = json.loads(_b64decode(header_segment))
+            signature = _b64decode(signature_segment)
+        except ValueError:
+            raise TokenError("Malformed token")
+        if not isinstance(header, dict) or header.get("alg") != "HS256":
+            raise TokenError("Unsupported token algorithm")
+        expected = self._sign(f"{header_segment}.{payload_segment}".encode())
+        if not hmac.compare_digest(signature, expected):
+            raise TokenError("Invalid token signature")
+        try:
+            claims = json.loads(_b64decode(payload_segment))
+        except ValueError:
+            raise TokenError("Malformed token")
+        if not isinstance(claims, dict):
+            raise TokenError("Malformed token")
+
+        for name in ("exp", "nbf"):
+            if name in claims and not isinstance(claims[name], (int, float)):
+                raise TokenError(f"Malformed {name} claim")
+        now = time.time()
+        if "exp" in claims and now > claims["exp"] + self.leeway:
+            raise TokenError("Token expired")
+        if "nbf" in claims and now < claims["nbf"] - self.leeway:
+            raise TokenError("Token not yet valid")
+        return claims
+
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU of tokens that already passed verification.
+
+    Entries live for ``ttl`` seconds but never past the token's own ``exp``,
+    so a cache hit is always as valid as a fresh verification.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[dict, float]]" = OrderedDict()
+
+    def get(self, token: str) -> Optional[dict]:
+        entry = self._entries.get(token)
+        if entry is None or entry[1] <= time.time():
+            if entry is not None:
+                del self._entries[token]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, token: str, claims: dict):
+        expires_at = time.time() + self.ttl
+        if "exp" in claims:
+            expires_at = min(expires_at, claims["exp"])
+        self._entries[token] = (claims, expires_at)
+        self._entries.move_to_end(token)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+def load_key_file(path: str) -> bytes:
+    """Read a static signing key; surrounding whitespace is ignored"""
+    with open(path, "rb") as handle:
+        return handle.read().strip()
+
+
+def create_verifier() -> Optional[TokenVerifier]:
+    """
+    HMAC verifier keyed from AUTH_KEY_FILE or AUTH_SECRET.
+
+    Returns None when neither is set, in which case the middleware only
+    checks that a token is present.
+    """
+    if os.environ.get("AUTH_KEY_FILE"):
+        return HMACTokenVerifier(load_key_file(os.environ["AUTH_KEY_FILE"]))
+    if os.environ.get("AUTH_SECRET"):
+        return HMACTokenVerifier(os.environ["AUTH_SECRET"].encode())
+    return None
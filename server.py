@@ -0,0 +1,26 @@
+import socket
+from typing import Awaitable, Callable, List, Optional
+
+import uvicorn
+
+
+class DrainingServer(uvicorn.Server):
+    """
+    uvicorn server that drains the app before closing its connections.
+
+    Plain uvicorn closes every WebSocket (1012) as soon as shutdown starts
+    and only then runs the lifespan shutdown, too late to say goodbye.
+    This server first stops listening, then awaits ``drain`` (which tells
+    clients when to come back and flushes their queues), then shuts down as
+    usual.
+    """
+
+    def __init__(self, config: uvicorn.Config, drain: Callable[[], Awaitable[None]]):
+        super().__init__(config)
+        self.drain = drain
+
+    async def shutdown(self, sockets: Optional[List[socket.socket]] = None):
+        for server in self.servers:
+            server.close()
+        await self.drain()
+        await super().shutdown(sockets=sockets)
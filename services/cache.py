@@ -0,0 +1,310 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple, Union
+from urllib.parse import urlencode
+
+from fastapi import Request, Response
+
+from services.metrics import metrics
+from services.serializer import FastJSONResponse, dumps, loads
+
+# A fetcher returns the response envelope (a dict, or bytes already encoded
+# as JSON) and whether it may be cached
+Payload = Union[dict, bytes]
+Fetcher = Callable[[], Awaitable[Tuple[Payload, bool]]]
+
+
+class CacheEntry:
+    __slots__ = ("body", "etag", "stored_at")
+
+    def __init__(self, body: bytes, etag: str, stored_at: float):
+        self.body = body
+        self.etag = etag
+        self.stored_at = stored_at
+
+    @property
+    def size(self) -> int:
+        return len(self.body)
+
+
+class MemoryCacheStore:
+    """
+    Per-process LRU store bounded by the total size of cached bodies.
+
+    ``get`` and ``set`` are coroutines only to share the interface of
+    ``DiskCacheStore``; they never wait.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    async def set(self, key: str, entry: CacheEntry):
+        if entry.size > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.bytes -= previous.size
+        self._entries[key] = entry
+        self.bytes += entry.size
+        while self.bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= evicted.size
+            self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskCacheStore:
+    """
+    Store shared by every worker on the host: one file per key.
+
+    Files are written to a temp name and renamed into place so readers never
+    see partial entries; hot entries are served from the OS page cache.
+    Access time is tracked through mtime so the sweep evicts least recently
+    used files once the directory exceeds ``max_bytes``.
+
+    File I/O runs on a dedicated thread, never on the event loop. ``bytes``
+    and ``len()`` are running totals of this worker's writes; other workers
+    write to the same directory, so every sweep (each ``SWEEP_EVERY``
+    writes, or as soon as the total passes ``max_bytes``) recounts them.
+    """
+
+    SWEEP_EVERY = 64
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._writes = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        os.makedirs(directory, exist_ok=True)
+        self.bytes, self.entries, _ = self._sweep()
+
+    async def _run(self, fn, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="disk-cache")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    async def get(self, key: str) -> Optional[CacheEntry]:
+        return await self._run(self._read, self._path(key))
+
+    def _read(self, path: str) -> Optional[CacheEntry]:
+        try:
+            with open(path, "rb") as handle:
+                header, _, body = handle.read().partition(b"\n")
+            os.utime(path)
+        except OSError:
+            return None
+        etag, _, stored_at = header.decode().partition(" ")
+        return CacheEntry(body, etag, float(stored_at))
+
+    async def set(self, key: str, entry: CacheEntry):
+        if entry.size > self.max_bytes:
+            return
+        size, replaced = await self._run(self._write, self._path(key), entry)
+        self.bytes += size - (replaced or 0)
+        self.entries += replaced is None
+        self._writes += 1
+        if self._writes % self.SWEEP_EVERY == 0 or self.bytes > self.max_bytes:
+            self.bytes, self.entries, evicted = await self._run(self._sweep)
+            self.evictions += evicted
+
+    def _write(self, path: str, entry: CacheEntry) -> Tuple[int, Optional[int]]:
+        """Write the entry; its file size and that of the file it replaced, if any"""
+        data = f"{entry.etag} {entry.stored_at}\n".encode() + entry.body
+        try:
+            replaced = os.stat(path).st_size
+        except OSError:
+            replaced = None
+        temp = f"{path}.{os.getpid()}.tmp"
+        with open(temp, "wb") as handle:
+            handle.write(data)
+        os.replace(temp, path)
+        return len(data), replaced
+
+    def _sweep(self) -> Tuple[int, int, int]:
+        """Evict least recently used files down to ``max_bytes``; bytes and files left, and files evicted"""
+        files = []
+        total = 0
+        evicted = 0
+        for item in os.scandir(self.directory):
+            try:
+                stat = item.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, item.path))
+            total += stat.st_size
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+        return total, len(files) - evicted, evicted
+
+    def __len__(self) -> int:
+        return self.entries
+
+
+class ResponseCache:
+    """
+    Caches serialized response envelopes for the upstream-proxy routes.
+
+    Fresh entries (younger than ``ttl``) are served directly. Entries within
+    the ``stale_while_revalidate`` window after that are served immediately
+    while one background task refreshes them. Every cached response carries
+    an ``ETag`` so clients can revalidate with ``If-None-Match`` and get a
+    304 without a body.
+
+    When a refetch fails with a server error (including an open upstream
+    circuit), an entry up to ``stale_if_error`` seconds past that window is
+    served instead of the error.
+    """
+
+    def __init__(self, store, ttl: float, stale_while_revalidate: float, stale_if_error: float = 0):
+        self.store = store
+        self.ttl = ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.stale_if_error = stale_if_error
+        self.counters = {"hits": 0, "misses": 0, "stale": 0, "stale_if_error": 0, "not_modified": 0}
+        self._refreshing: Set[str] = set()
+        # Background refreshes, referenced until done so they are not collected
+        self._tasks: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def key(route: str, **params) -> str:
+        """Route plus its query normalized: unset params dropped, names sorted"""
+        query = urlencode(sorted((name, value) for name, value in params.items() if value is not None))
+        return f"{route}?{query}"
+
+    async def respond(self, request: Request, key: str, fetch: Fetcher) -> Response:
+        now = time.time()
+        entry = await self.store.get(key)
+        if entry is not None and now - entry.stored_at < self.ttl:
+            self.counters["hits"] += 1
+            return self._response(request, entry, "HIT")
+        if entry is not None and now - entry.stored_at < self.ttl + self.stale_while_revalidate:
+            self.counters["stale"] += 1
+            if key not in self._refreshing:
+                self._refreshing.add(key)
+                task = asyncio.create_task(self._refresh(key, fetch))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            return self._response(request, entry, "STALE")
+
+        self.counters["misses"] += 1
+        payload, cacheable = await fetch()
+        if not cacheable:
+            if entry is not None and _server_error(payload) and now - entry.stored_at < (
+                self.ttl + self.stale_while_revalidate + self.stale_if_error
+            ):
+                self.counters["stale_if_error"] += 1
+                return self._response(request, entry, "STALE-IF-ERROR")
+            return FastJSONResponse(payload, headers={"Cache-Control": "no-store", "X-Cache": "MISS"})
+        return self._response(request, await self._store(key, payload), "MISS")
+
+    async def get_payload(self, key: str) -> Optional[dict]:
+        """Decoded envelope for ``key`` if it is still servable, without refreshing"""
+        entry = await self.store.get(key)
+        if entry is None or time.time() - entry.stored_at >= self.ttl + self.stale_while_revalidate:
+            return None
+        self.counters["hits"] += 1
+        return loads(entry.body)
+
+    async def put(self, key: str, payload: Payload):
+        await self._store(key, payload)
+
+    async def _refresh(self, key: str, fetch: Fetcher):
+        try:
+            payload, cacheable = await fetch()
+            if cacheable:
+                await self._store(key, payload)
+        except Exception:
+            # Keep serving the stale copy; the next request past the window refetches
+            pass
+        finally:
+            self._refreshing.discard(key)
+
+    async def _store(self, key: str, payload: Payload) -> CacheEntry:
+        body = payload if isinstance(payload, bytes) else dumps(payload)
+        entry = CacheEntry(body, '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"', time.time())
+        await self.store.set(key, entry)
+        return entry
+
+    def _response(self, request: Request, entry: CacheEntry, status: str) -> Response:
+        age = max(0, int(time.time() - entry.stored_at))
+        # Private: these routes need a token, so shared caches and CDNs must
+        # not hand the copy to anyone else
+        headers = {
+            "ETag": entry.etag,
+            "Cache-Control": f"private, max-age={int(self.ttl)}, stale-while-revalidate={int(self.stale_while_revalidate)}",
+            "Age": str(age),
+            "X-Cache": status,
+        }
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and entry.etag in (tag.strip() for tag in if_none_match.split(",")):
+            self.counters["not_modified"] += 1
+            return Response(status_code=304, headers=headers)
+        return Response(entry.body, media_type="application/json", headers=headers)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            **self.counters,
+            "entries": len(self.store),
+            "bytes": self.store.bytes,
+            "evictions": self.store.evictions,
+        }
+
+
+def _server_error(payload: Payload) -> bool:
+    return isinstance(payload, dict) and payload.get("status_code", 200) >= 500
+
+
+def create_cache_store():
+    """Build the store selected by CACHE_BACKEND (memory | disk)"""
+    kind = os.environ.get("CACHE_BACKEND", "memory")
+    max_bytes = int(os.environ.get("CACHE_MAX_BYTES", 32 * 1024 * 1024))
+    if kind == "memory":
+        return MemoryCacheStore(max_bytes)
+    if kind == "disk":
+        return DiskCacheStore(os.environ.get("CACHE_DIR", "/tmp/fastapi-app-cache"), max_bytes)
+    raise ValueError(f"Unknown CACHE_BACKEND: {kind}")
+
+
+response_cache = ResponseCache(
+    create_cache_store(),
+    ttl=float(os.environ.get("CACHE_TTL", 60)),
+    stale_while_revalidate=float(os.environ.get("CACHE_STALE_WHILE_REVALIDATE", 300)),
+    stale_if_error=float(os.environ.get("CACHE_STALE_IF_ERROR", 86400)),
+)
+
+cache_requests = metrics.counter("cache_requests_total", "Response cache lookups by result", ("result",))
+
+
+def _collect_cache_metrics():
+    for result, total in response_cache.counters.items():
+        cache_requests.set_total(total, result)
+
+
+metrics.collectors.append(_collect_cache_metrics)
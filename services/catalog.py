@@ -0,0 +1,294 @@
+import asyncio
+import hashlib
+import os
+import re
+import sys
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from services.serializer import dumps, loads
+from services.upstream import upstream
+
+_WORD = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return _WORD.findall(text.lower())
+
+
+class CatalogSpec(NamedTuple):
+    """Which fields of a collection get which kind of index"""
+    numeric: Tuple[str, ...] = ("id",)
+    categorical: Tuple[str, ...] = ()
+    text: Tuple[str, ...] = ()
+
+
+CATALOG_SPECS: Dict[str, CatalogSpec] = {
+    "products": CatalogSpec(
+        numeric=("id", "price", "rating", "stock", "discountPercentage"),
+        categorical=("category", "brand"),
+        text=("title",),
+    ),
+    "users": CatalogSpec(
+        numeric=("id", "age"),
+        categorical=("gender",),
+        text=("firstName", "lastName", "username", "email"),
+    ),
+}
+
+
+class CatalogError(Exception):
+    """Raised when a collection cannot be mirrored"""
+
+
+class CatalogSnapshot:
+    """
+    Immutable columnar snapshot of one collection.
+
+    Row ``i`` of every column describes the same record. Records are kept in
+    id order and encoded once, so results are spliced into responses
+    without re-serializing. Indexes:
+
+    - numeric columns: values in an ``array('d')`` plus the rows sorted by
+      value, for bisected range filters and for sorting
+    - categorical columns: lowercased, interned value -> rows
+    - text: token -> rows, plus the sorted vocabulary for prefix matching
+    """
+
+    def __init__(self, records: List[dict], spec: CatalogSpec):
+        records = sorted(records, key=lambda record: record.get("id", 0))
+        self.spec = spec
+        self.built_at = time.time()
+        self.encoded: List[bytes] = [dumps(record) for record in records]
+
+        self.sorted_rows: Dict[str, array] = {}
+        self.sorted_values: Dict[str, array] = {}
+        self.missing: Dict[str, array] = {}
+        for name in spec.numeric:
+            present = []
+            missing = array("l")
+            for row, record in enumerate(records):
+                value = record.get(name)
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    present.append((float(value), row))
+                else:
+                    missing.append(row)
+            present.sort()
+            self.sorted_values[name] = array("d", (value for value, _ in present))
+            self.sorted_rows[name] = array("l", (row for _, row in present))
+            self.missing[name] = missing
+
+        self.categories: Dict[str, Dict[str, array]] = {}
+        for name in spec.categorical:
+            index: Dict[str, array] = {}
+            for row, record in enumerate(records):
+                value = record.get(name)
+                if value is not None:
+                    index.setdefault(sys.intern(str(value).lower()), array("l")).append(row)
+            self.categories[name] = index
+
+        tokens: Dict[str, Set[int]] = {}
+        for row, record in enumerate(records):
+            for name in spec.text:
+                for token in tokenize(str(record.get(name) or "")):
+                    tokens.setdefault(sys.intern(token), set()).add(row)
+        self.tokens: Dict[str, array] = {token: array("l", sorted(rows)) for token, rows in tokens.items()}
+        self.vocabulary: List[str] = sorted(self.tokens)
+
+    def __len__(self) -> int:
+        return len(self.encoded)
+
+    def _prefix_rows(self, prefix: str) -> Set[int]:
+        rows: Set[int] = set()
+        vocabulary = self.vocabulary
+        index = bisect_left(vocabulary, prefix)
+        while index < len(vocabulary) and vocabulary[index].startswith(prefix):
+            rows.update(self.tokens[vocabulary[index]])
+            index += 1
+        return rows
+
+    def search(
+        self,
+        q: Optional[str] = None,
+        where: Optional[Dict[str, Sequence[str]]] = None,
+        ranges: Optional[Dict[str, Tuple[Optional[float], Optional[float]]]] = None,
+        sort: Optional[str] = None,
+        descending: bool = False,
+        skip: int = 0,
+        limit: int = 30,
+    ) -> Tuple[int, List[bytes]]:
+        """
+        Filter, sort and paginate; returns the match count and the encoded page.
+
+        ``where`` matches any of the listed values per categorical field,
+        ``ranges`` are inclusive bounds per numeric field and every word of
+        ``q`` must prefix-match a token of the record's text fields.
+        """
+        candidates: Optional[Set[int]] = None
+
+        def narrow(rows: Iterable[int]):
+            nonlocal candidates
+            rows = rows if isinstance(rows, set) else set(rows)
+            candidates = rows if candidates is None else candidates & rows
+
+        for name, values in (where or {}).items():
+            index = self.categories[name]
+            rows: Set[int] = set()
+            for value in values:
+                rows.update(index.get(value.lower(), ()))
+            narrow(rows)
+        for name, (low, high) in (ranges or {}).items():
+            if low is None and high is None:
+                continue
+            values = self.sorted_values[name]
+            start = 0 if low is None else bisect_left(values, low)
+            end = len(values) if high is None else bisect_right(values, high)
+            narrow(self.sorted_rows[name][start:end])
+        for token in tokenize(q or ""):
+            narrow(self._prefix_rows(token))
+
+        if sort is None:
+            matched = range(len(self.encoded)) if candidates is None else sorted(candidates)
+        else:
+            order = self.sorted_rows[sort]
+            if descending:
+                order = order[::-1]
+            # Records without a value sort last either way
+            order = list(order) + list(self.missing[sort])
+            matched = order if candidates is None else [row for row in order if row in candidates]
+
+        return len(matched), [self.encoded[row] for row in matched[skip:skip + limit]]
+
+
+class CatalogMirror:
+    """
+    Local copy of one upstream collection, refreshed in the background.
+
+    A refresh walks the collection page by page and compares each page's
+    digest with the previous run. Unchanged pages reuse their decoded
+    records, and the snapshot (with its indexes) is only rebuilt when
+    something changed. Searches read whichever snapshot is current; a failed
+    refresh keeps the previous one.
+    """
+
+    def __init__(self, resource: str, spec: CatalogSpec, refresh_interval: float = 300, page_size: int = 100):
+        self.resource = resource
+        self.spec = spec
+        self.refresh_interval = refresh_interval
+        self.page_size = page_size
+        self.snapshot: Optional[CatalogSnapshot] = None
+        self.refreshed_at: Optional[float] = None
+        self.counters = {"refreshes": 0, "rebuilds": 0, "pages_changed": 0, "errors": 0}
+        # (digest, records, total) per page of the last refresh
+        self._pages: List[Tuple[bytes, List[dict], int]] = []
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                # Keep serving the previous snapshot; try again next interval
+                self.counters["errors"] += 1
+            await asyncio.sleep(self.refresh_interval)
+
+    async def refresh(self, if_missing: bool = False) -> bool:
+        """
+        Re-read the collection; returns whether the snapshot was rebuilt.
+        With ``if_missing`` nothing is read if a snapshot exists by the time
+        the lock is free.
+        """
+        async with self._lock:
+            if if_missing and self.snapshot is not None:
+                return False
+            self.counters["refreshes"] += 1
+            pages = []
+            skip = 0
+            changed = False
+            while True:
+                response = await upstream.fetch(
+                    f"/{self.resource}", route="list", params={"limit": self.page_size, "skip": skip}
+                )
+                if response.status != 200:
+                    raise CatalogError(f"Failed to mirror {self.resource}: {response.status}")
+                digest = hashlib.blake2b(response.body, digest_size=16).digest()
+                previous = self._pages[len(pages)] if len(pages) < len(self._pages) else None
+                if previous is not None and previous[0] == digest:
+                    pages.append(previous)
+                else:
+                    data = loads(response.body)
+                    pages.append((digest, data.get(self.resource, []), data.get("total", 0)))
+                    self.counters["pages_changed"] += 1
+                    changed = True
+                _, records, total = pages[-1]
+                skip += len(records)
+                if not records or skip >= total:
+                    break
+
+            changed = changed or len(pages) != len(self._pages)
+            self._pages = pages
+            if changed or self.snapshot is None:
+                self.snapshot = CatalogSnapshot([record for _, records, _ in pages for record in records], self.spec)
+                self.counters["rebuilds"] += 1
+            self.refreshed_at = time.time()
+            return changed
+
+    async def get_snapshot(self) -> CatalogSnapshot:
+        """The current snapshot, loading it first if no refresh has finished yet"""
+        if self.snapshot is None:
+            # Concurrent first searches wait for the one refresh that got the lock
+            await self.refresh(if_missing=True)
+        return self.snapshot
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "records": len(self.snapshot) if self.snapshot is not None else 0,
+            "refreshed_at": self.refreshed_at,
+        }
+
+
+class Catalog:
+    """The mirrored collections, started and stopped with the app"""
+
+    def __init__(self, specs: Dict[str, CatalogSpec], refresh_interval: float, background: bool = True):
+        self.mirrors = {resource: CatalogMirror(resource, spec, refresh_interval) for resource, spec in specs.items()}
+        self.background = background
+
+    async def start(self):
+        if self.background:
+            for mirror in self.mirrors.values():
+                await mirror.start()
+
+    async def stop(self):
+        for mirror in self.mirrors.values():
+            await mirror.stop()
+
+    def __getitem__(self, resource: str) -> CatalogMirror:
+        return self.mirrors[resource]
+
+    def stats(self) -> dict:
+        return {resource: mirror.stats() for resource, mirror in self.mirrors.items()}
+
+
+# With CATALOG_MIRROR=0 snapshots are only loaded on the first search
+catalog = Catalog(
+    CATALOG_SPECS,
+    refresh_interval=float(os.environ.get("CATALOG_REFRESH_INTERVAL", 300)),
+    background=os.environ.get("CATALOG_MIRROR", "1") != "0",
+)
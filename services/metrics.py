@@ -0,0 +1,311 @@
+import asyncio
+import os
+import tempfile
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from services.serializer import dumps, loads
+
+# Latency buckets in seconds, from sub-millisecond cache hits to timeouts
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+
+
+class Metric:
+    """
+    Base for metrics keyed by a tuple of label values.
+
+    Values live in a plain dict touched only from the event loop thread, so
+    updates need no locks. ``merge`` says how samples of the same series
+    from different workers combine.
+    """
+
+    type = "untyped"
+    merge = "sum"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Labels, object] = {}
+
+    def samples(self) -> List[list]:
+        return [[list(labels), value] for labels, value in self.values.items()]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def set_total(self, value: float, *labels: str):
+        """Mirror a total that is already counted elsewhere (collectors only)"""
+        self.values[labels] = value
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), merge: str = "sum"):
+        super().__init__(name, help, labelnames)
+        self.merge = merge
+
+    def set(self, value: float, *labels: str):
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    """Per-series bucket counts (non-cumulative) followed by sum and count"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels: str):
+        series = self.values.get(labels)
+        if series is None:
+            # One slot per bucket, one for +Inf, then sum and count
+            series = self.values[labels] = [0] * (len(self.buckets) + 3)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+
+class MetricsRegistry:
+    """
+    Process-local metrics, aggregated across workers through snapshot files.
+
+    Every worker writes its samples to ``<directory>/<pid>.json`` every
+    ``flush_interval`` seconds and when ``/metrics`` is served. Rendering
+    merges the files of all live workers, so a scrape of any worker reports
+    the whole server. Files of workers that exited are removed; their
+    counters drop out, which Prometheus treats as a counter reset.
+
+    Workers share a directory only when it is configured (``METRICS_DIR``,
+    which gunicorn or ``uvicorn --workers`` pass on to every worker); the
+    default is per process, so servers started side by side never merge
+    each other's samples.
+
+    ``exposition`` serves scrapes: it renders at most once per
+    ``min_interval`` seconds, with the file I/O and merging in a thread.
+
+    ``collectors`` run just before a snapshot and copy state that is
+    already tracked elsewhere (cache counters, connection counts), which
+    keeps that work off the hot path.
+    """
+
+    def __init__(self, directory: Optional[str] = None, flush_interval: float = 5.0, min_interval: float = 1.0):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), f"fastapi-app-metrics-{os.getpid()}")
+        self.flush_interval = flush_interval
+        self.min_interval = min_interval
+        self.metrics: Dict[str, Metric] = {}
+        self.collectors: List[Callable[[], None]] = []
+        self._task: Optional[asyncio.Task] = None
+        # The latest scrape render, shared by scrapes that overlap or follow it closely
+        self._rendering: Optional[asyncio.Task] = None
+        self._rendered_at = 0.0
+
+    def _register(self, metric: Metric) -> Metric:
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Iterable[str] = (), merge: str = "sum") -> Gauge:
+        return self._register(Gauge(name, help, labelnames, merge))
+
+    def histogram(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    async def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            os.remove(self._path(os.getpid()))
+            # Only succeeds once no other worker's file is left
+            os.rmdir(self.directory)
+        except OSError:
+            pass
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await asyncio.to_thread(self._write, self._encode())
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"{pid}.json")
+
+    def snapshot(self) -> dict:
+        for collect in self.collectors:
+            collect()
+        snapshot = {}
+        for metric in self.metrics.values():
+            entry = {"type": metric.type, "help": metric.help, "labelnames": metric.labelnames, "merge": metric.merge, "samples": metric.samples()}
+            if isinstance(metric, Histogram):
+                entry["buckets"] = metric.buckets
+            snapshot[metric.name] = entry
+        return snapshot
+
+    def _encode(self) -> bytes:
+        # On the event loop: collectors read state owned by it
+        return dumps({"written_at": time.time(), "metrics": self.snapshot()})
+
+    def _write(self, data: bytes):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(os.getpid())
+        with open(path + ".tmp", "wb") as handle:
+            handle.write(data)
+        os.replace(path + ".tmp", path)
+
+    def flush(self):
+        """Write this worker's snapshot atomically"""
+        self._write(self._encode())
+
+    def _worker_snapshots(self) -> List[dict]:
+        snapshots = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".json") or not filename[:-5].isdigit():
+                continue
+            pid = int(filename[:-5])
+            if pid != os.getpid() and not _alive(pid):
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(os.path.join(self.directory, filename), "rb") as handle:
+                    snapshots.append(loads(handle.read())["metrics"])
+            except (OSError, ValueError):
+                # Half-written by an old version or vanished mid-read
+                continue
+        return snapshots
+
+    def aggregate(self) -> dict:
+        """Samples of every live worker, merged per series"""
+        self.flush()
+        return self._merge()
+
+    def _merge(self) -> dict:
+        merged: Dict[str, dict] = {}
+        for snapshot in self._worker_snapshots():
+            for name, entry in snapshot.items():
+                target = merged.setdefault(name, dict(entry, series={}))
+                for labels, value in entry["samples"]:
+                    key = tuple(labels)
+                    current = target["series"].get(key)
+                    target["series"][key] = value if current is None else _combine(entry["merge"], current, value)
+        return merged
+
+    async def exposition(self) -> str:
+        """``render`` for scrapes: cached for ``min_interval``, blocking work in a thread"""
+        rendering = self._rendering
+        stale = time.monotonic() - self._rendered_at >= self.min_interval
+        if rendering is None or (rendering.done() and (stale or rendering.cancelled() or rendering.exception())):
+            self._rendered_at = time.monotonic()
+            rendering = self._rendering = asyncio.create_task(self._render_in_thread(self._encode()))
+        # Shielded: one scraper hanging up must not cancel the others' render
+        return await asyncio.shield(rendering)
+
+    async def _render_in_thread(self, data: bytes) -> str:
+        def work():
+            self._write(data)
+            return self._format(self._merge())
+
+        return await asyncio.to_thread(work)
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        return self._format(self.aggregate())
+
+    def _format(self, aggregated: dict) -> str:
+        lines = []
+        for name, entry in sorted(aggregated.items()):
+            lines.append(f"# HELP {name} {entry['help']}")
+            lines.append(f"# TYPE {name} {entry['type']}")
+            labelnames = entry["labelnames"]
+            for labels, value in sorted(entry["series"].items()):
+                pairs = [f'{label}="{_escape(str(v))}"' for label, v in zip(labelnames, labels)]
+                if entry["type"] != "histogram":
+                    lines.append(f"{name}{_braces(pairs)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(entry["buckets"]) + ["+Inf"], value[:-2]):
+                    cumulative += count
+                    le = 'le="%s"' % (bound if bound == "+Inf" else _number(bound))
+                    lines.append(f"{name}_bucket{_braces(pairs + [le])} {cumulative}")
+                lines.append(f"{name}_sum{_braces(pairs)} {_number(value[-2])}")
+                lines.append(f"{name}_count{_braces(pairs)} {value[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _combine(mode: str, current, value):
+    if isinstance(current, list):
+        return [a + b for a, b in zip(current, value)]
+    if mode == "max":
+        return max(current, value)
+    return current + value
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _braces(pairs: List[str]) -> str:
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+metrics = MetricsRegistry(
+    directory=os.environ.get("METRICS_DIR") or None,
+    flush_interval=float(os.environ.get("METRICS_FLUSH_INTERVAL", 5)),
+    min_interval=float(os.environ.get("METRICS_MIN_INTERVAL", 1)),
+)
+
+# Hot-path instruments, shared by the modules that update them
+HTTP_REQUEST_DURATION = metrics.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route", "status")
+)
+UPSTREAM_REQUEST_DURATION = metrics.histogram(
+    "upstream_request_duration_seconds", "Upstream fetch latency by dummyjson resource", ("resource",)
+)
+UPSTREAM_ERRORS = metrics.counter(
+    "upstream_errors_total", "Failed upstream fetches by resource and kind", ("resource", "kind")
+)
+WS_MESSAGES_RECEIVED = metrics.counter("chat_messages_received_total", "Chat frames received from clients")
+WS_FRAMES_SENT = metrics.counter("chat_frames_sent_total", "WebSocket frames written to clients")
+BROADCAST_FANOUT_DURATION = metrics.histogram(
+    "chat_broadcast_fanout_seconds", "Time to hand one broadcast to every local member's queue"
+)
+RATE_LIMITED = metrics.counter("rate_limited_total", "Requests and chat messages refused by rate limits", ("kind",))
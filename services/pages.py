@@ -0,0 +1,106 @@
+import gzip
+import hashlib
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable
+
+from fastapi import Request, Response
+from markupsafe import Markup
+
+# Brotli is optional; without it only gzip variants are built
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def accepted_encodings(header: str) -> Dict[str, float]:
+    """``Accept-Encoding`` as coding -> q-value"""
+    accepted = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = quality
+    return accepted
+
+
+class PrerenderedPage:
+    """
+    A page rendered once and served as bytes.
+
+    The identity, gzip and (if the ``brotli`` package is installed) brotli
+    variants are compressed up front. Each request only negotiates the
+    encoding and compares ``If-None-Match`` with the precomputed ETag.
+    """
+
+    def __init__(self, html: str, media_type: str = "text/html; charset=utf-8", cache_control: str = "no-cache"):
+        body = html.encode()
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self.etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+        self.variants: Dict[str, bytes] = {"identity": body, "gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(body, quality=11)
+
+    def choose(self, accept_encoding: str) -> str:
+        accepted = accepted_encodings(accept_encoding)
+        for coding in ("br", "gzip"):
+            if coding in self.variants and accepted.get(coding, accepted.get("*", 0)) > 0:
+                return coding
+        return "identity"
+
+    def respond(self, request: Request) -> Response:
+        coding = self.choose(request.headers.get("accept-encoding", ""))
+        # Variants share one ETag but differ in bytes, so tag each encoding
+        etag = self.etag if coding == "identity" else self.etag[:-1] + "-" + coding + '"'
+        headers = {"ETag": etag, "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+        if coding != "identity":
+            headers["Content-Encoding"] = coding
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag in (tag.strip() for tag in if_none_match.split(",")):
+            return Response(status_code=304, headers=headers)
+        return Response(self.variants[coding], media_type=self.media_type, headers=headers)
+
+
+class FragmentCache:
+    """
+    Rendered HTML fragments by key, kept until ``invalidate(key)``.
+
+    A render that raced with an invalidation is returned but not stored, so
+    a fragment never outlives the data it was rendered from. At most
+    ``max_entries`` fragments are kept (least recently used go first).
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[Hashable, Markup]" = OrderedDict()
+        self.generation = 0
+        self.counters = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    async def get_or_render(self, key: Hashable, render: Callable[[], Awaitable[str]]) -> Markup:
+        fragment = self.entries.get(key)
+        if fragment is not None:
+            self.entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return fragment
+
+        self.counters["misses"] += 1
+        generation = self.generation
+        fragment = Markup(await render())
+        if generation == self.generation:
+            self.entries[key] = fragment
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return fragment
+
+    def invalidate(self, key: Hashable):
+        self.generation += 1
+        if self.entries.pop(key, None) is not None:
+            self.counters["invalidations"] += 1
@@ -0,0 +1,195 @@
+import asyncio
+import math
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, NamedTuple, Optional
+
+_PERIODS = {"s": 1.0, "m": 60.0, "h": 3600.0}
+_LIMIT = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*/\s*(\d*)\s*([smh])\s*(?::\s*(\d+))?\s*$")
+
+
+class RateLimit(NamedTuple):
+    """``rate`` tokens per second, up to ``burst`` saved up"""
+    rate: float
+    burst: int
+
+    @classmethod
+    def parse(cls, spec: str) -> Optional["RateLimit"]:
+        """
+        ``"20/s"``, ``"600/m:100"`` or ``"5/10s:5"`` (count / period : burst).
+
+        The burst defaults to one period's worth of tokens; ``"off"`` or an
+        empty string means no limit.
+        """
+        if not spec or spec.strip().lower() in ("off", "none", "0"):
+            return None
+        match = _LIMIT.match(spec)
+        if match is None:
+            raise ValueError(f"Invalid rate limit: {spec!r}")
+        count, periods, unit, burst = match.groups()
+        rate = float(count) / (int(periods or 1) * _PERIODS[unit])
+        return cls(rate, int(burst) if burst else max(1, math.ceil(float(count))))
+
+
+class BucketStore:
+    """
+    Token buckets by key, stored as one float each.
+
+    Buckets follow the generic cell rate algorithm: instead of a token count
+    and a refill time, a key keeps the "theoretical arrival time" at which
+    its bucket would be full again. A take succeeds when that time, pushed
+    forward by the cost, stays within ``burst`` tokens of now. Keys whose
+    time has passed hold full buckets and can be dropped at will.
+    """
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def take(self, key: str, limit: RateLimit, cost: float = 1.0) -> float:
+        """0 if the tokens were taken, else seconds until they will be available"""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {}
+
+
+def _take(tat: Optional[float], now: float, limit: RateLimit, cost: float):
+    """(new arrival time or None when refused, seconds to wait)"""
+    interval = 1.0 / limit.rate
+    new_tat = max(tat or now, now) + cost * interval
+    wait = new_tat - now - limit.burst * interval
+    if wait > 0:
+        return None, wait
+    return new_tat, 0.0
+
+
+class MemoryBucketStore(BucketStore):
+    """
+    Per-worker buckets, at most ``max_keys`` of them.
+
+    The dict keeps keys in least-recently-used order (a take re-inserts its
+    key), so eviction pops from the front. An evicted key only forgets
+    tokens it already spent.
+    """
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self.buckets: Dict[str, float] = {}
+        self.counters = {"allowed": 0, "limited": 0, "evicted": 0}
+
+    async def take(self, key: str, limit: RateLimit, cost: float = 1.0) -> float:
+        now = time.monotonic()
+        tat = self.buckets.pop(key, None)
+        new_tat, wait = _take(tat, now, limit, cost)
+        if new_tat is None:
+            # Refused takes leave the bucket as it was
+            self.counters["limited"] += 1
+            new_tat = now if tat is None else tat
+        else:
+            self.counters["allowed"] += 1
+        self.buckets[key] = new_tat
+        if len(self.buckets) > self.max_keys:
+            del self.buckets[next(iter(self.buckets))]
+            self.counters["evicted"] += 1
+        return wait
+
+    def stats(self) -> dict:
+        return {**self.counters, "keys": len(self.buckets)}
+
+
+class SQLiteBucketStore(BucketStore):
+    """
+    Buckets in a SQLite file (WAL mode) shared by every local worker.
+
+    Each take is one short ``BEGIN IMMEDIATE`` transaction on a dedicated
+    thread, so concurrent workers serialize on the file lock and never
+    double-spend a token. Full buckets are swept every ``sweep_every``
+    writes. Times are wall-clock, as workers do not share a monotonic clock.
+    """
+
+    SCHEMA = "CREATE TABLE IF NOT EXISTS rate_limits (key TEXT PRIMARY KEY, tat REAL NOT NULL) WITHOUT ROWID"
+
+    def __init__(self, path: str, sweep_every: int = 1000):
+        self.path = path
+        self.sweep_every = sweep_every
+        self.counters = {"allowed": 0, "limited": 0}
+        self._writes = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._db: Optional[sqlite3.Connection] = None
+
+    async def _run(self, fn, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rate-limits")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def start(self):
+        await self._run(self._open)
+
+    async def stop(self):
+        if self._executor is not None:
+            await self._run(self._close)
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _open(self):
+        # Autocommit mode; transactions are opened explicitly
+        self._db = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute(self.SCHEMA)
+
+    def _close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    async def take(self, key: str, limit: RateLimit, cost: float = 1.0) -> float:
+        return await self._run(self._take, key, limit, cost)
+
+    def _take(self, key: str, limit: RateLimit, cost: float) -> float:
+        if self._db is None:
+            self._open()
+        now = time.time()
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._db.execute("SELECT tat FROM rate_limits WHERE key = ?", (key,)).fetchone()
+            new_tat, wait = _take(row[0] if row else None, now, limit, cost)
+            if new_tat is not None:
+                self._db.execute("INSERT OR REPLACE INTO rate_limits (key, tat) VALUES (?, ?)", (key, new_tat))
+                self._writes += 1
+                if self._writes % self.sweep_every == 0:
+                    self._db.execute("DELETE FROM rate_limits WHERE tat < ?", (now,))
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self.counters["allowed" if new_tat is not None else "limited"] += 1
+        return wait
+
+    def stats(self) -> dict:
+        return dict(self.counters)
+
+
+def create_bucket_store() -> BucketStore:
+    """Build the store selected by RATE_LIMIT_BACKEND (memory | sqlite)"""
+    kind = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+    if kind == "memory":
+        return MemoryBucketStore(int(os.environ.get("RATE_LIMIT_MAX_KEYS", 100000)))
+    if kind == "sqlite":
+        return SQLiteBucketStore(os.environ.get("RATE_LIMIT_PATH", "rate_limits.db"))
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {kind}")
+
+
+def retry_after_header(wait: float) -> str:
+    """``Retry-After`` takes whole seconds; round up so clients never retry early"""
+    return str(max(1, math.ceil(wait)))
+
+
+# Shared by the HTTP middleware and the chat socket loop
+rate_limits = create_bucket_store()
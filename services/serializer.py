@@ -0,0 +1,62 @@
+import json
+from typing import Any, Union
+
+from fastapi.responses import JSONResponse
+
+# Pick the fastest JSON backend that is installed; stdlib json always works
+try:
+    import orjson
+
+    BACKEND = "orjson"
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+    loads = orjson.loads
+except ImportError:
+    try:
+        import msgspec
+
+        BACKEND = "msgspec"
+        dumps = msgspec.json.encode
+
+        def loads(data: Union[bytes, str]) -> Any:
+            # Callers catch ValueError, as raised by orjson and json
+            try:
+                return msgspec.json.decode(data)
+            except msgspec.DecodeError as error:
+                raise ValueError(str(error)) from error
+    except ImportError:
+        BACKEND = "json"
+        _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+        def dumps(obj: Any) -> bytes:
+            return _encoder.encode(obj).encode()
+
+        def loads(data: Union[bytes, str]) -> Any:
+            return json.loads(data)
+
+
+def dumps_str(obj: Any) -> str:
+    """JSON text, for APIs such as ``WebSocket.send_text`` that need str"""
+    return dumps(obj).decode()
+
+
+def envelope(meta: dict, raw_data: bytes) -> bytes:
+    """
+    Encode ``meta`` plus a ``data`` field holding already-encoded JSON.
+
+    Lets upstream bodies pass through as bytes instead of being decoded and
+    re-encoded.
+    """
+    head = dumps(meta)
+    return head[:-1] + (b',"data":' if len(head) > 2 else b'"data":') + raw_data + b"}"
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with the selected backend; bytes are sent as-is"""
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
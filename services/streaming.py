@@ -0,0 +1,126 @@
+import re
+from typing import List, Optional, Sequence
+
+from services.serializer import dumps, loads
+
+# Bytes that can change nesting or string state
+_STRUCTURAL = re.compile(rb'[\[\]{}"\\]')
+
+_QUOTE, _BACKSLASH = ord('"'), ord("\\")
+_OPENERS = (ord("{"), ord("["))
+
+
+class ArrayItemScanner:
+    """
+    Incrementally splits the items of one array out of a JSON object.
+
+    Feed the upstream body chunk by chunk; ``feed`` returns the raw bytes of
+    every item of ``object[key]`` completed so far, so only the current
+    partial item is ever buffered. Items must be objects or arrays (as in
+    every dummyjson collection). ``finish`` returns the rest of the object,
+    e.g. ``total``, ``skip`` and ``limit``.
+    """
+
+    def __init__(self, key: str):
+        self.key = key.encode()
+        self.state = "head"
+        self.depth = 0
+        self.in_string = False
+        self.string_start = 0
+        self.last_string: Optional[bytes] = None
+        self.item_start: Optional[int] = None
+        self.outer = bytearray()
+        self._buf = b""
+        self._pos = 0
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        if self.state == "tail":
+            self.outer += chunk
+            return []
+
+        buf = self._buf + chunk
+        pos = self._pos
+        items: List[bytes] = []
+        search = _STRUCTURAL.search
+        while True:
+            match = search(buf, pos)
+            if match is None:
+                break
+            index = match.start()
+            char = buf[index]
+            pos = index + 1
+
+            if self.in_string:
+                if char == _BACKSLASH:
+                    # Skip the escaped byte, even if it is in the next chunk
+                    pos = index + 2
+                elif char == _QUOTE:
+                    self.in_string = False
+                    if self.state == "head" and self.depth == 1:
+                        self.last_string = buf[self.string_start + 1:index]
+                continue
+
+            if char == _QUOTE:
+                self.in_string = True
+                self.string_start = index
+            elif char in _OPENERS:
+                self.depth += 1
+                if self.state == "items" and self.depth == 3:
+                    self.item_start = index
+                elif self.state == "head" and self.depth == 2 and self.last_string == self.key and char == _OPENERS[1]:
+                    # Entering the array: everything before it is envelope
+                    self.state = "items"
+                    self.outer += buf[:pos]
+                    buf = buf[pos:]
+                    pos = 0
+            else:
+                if self.state == "items":
+                    if self.depth == 3:
+                        items.append(buf[self.item_start:pos])
+                        self.item_start = None
+                    elif self.depth == 2:
+                        self.state = "tail"
+                        self.outer += buf[index:]
+                        self._buf = b""
+                        return items
+                self.depth -= 1
+
+        if self.state == "items":
+            # Keep only the item in progress
+            if self.item_start is None:
+                buf, pos = b"", 0
+            else:
+                buf, pos = buf[self.item_start:], pos - self.item_start
+                self.item_start = 0
+        self._buf = buf
+        self._pos = pos
+        return items
+
+    def finish(self) -> dict:
+        """The object without the array, once the whole body was fed"""
+        if self.state != "tail":
+            raise ValueError(f"Array {self.key.decode()!r} was not found or not closed")
+        outer = loads(bytes(self.outer))
+        outer.pop(self.key.decode(), None)
+        return outer
+
+
+def parse_fields(fields: Optional[str]) -> Optional[Sequence[str]]:
+    """``"id,title"`` -> ``("id", "title")``; None or empty means every field"""
+    if not fields:
+        return None
+    names = tuple(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    return names or None
+
+
+def project(item: dict, fields: Optional[Sequence[str]]) -> dict:
+    if fields is None:
+        return item
+    return {name: item[name] for name in fields if name in item}
+
+
+def project_raw(item: bytes, fields: Optional[Sequence[str]]) -> bytes:
+    """Projection of one encoded item; passes the bytes through untouched when not projecting"""
+    if fields is None:
+        return item
+    return dumps(project(loads(item), fields))
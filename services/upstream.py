@@ -0,0 +1,341 @@
+import asyncio
+import os
+import time
+import weakref
+from typing import Dict, NamedTuple, Optional
+
+import aiohttp
+
+from services.metrics import UPSTREAM_ERRORS, UPSTREAM_REQUEST_DURATION, metrics
+from services.resilience import CircuitBreaker, CircuitOpenError, backoff_delay
+
+UPSTREAM_BASE_URL = os.environ.get("UPSTREAM_BASE_URL", "https://dummyjson.com")
+
+# Per-route deadlines for a whole fetch, retries and hedges included;
+# list endpoints move more bytes than single items
+ROUTE_DEADLINES: Dict[str, float] = {"list": 10.0, "item": 5.0}
+
+# Per-attempt timeouts, short enough that a retry fits in the deadline
+ROUTE_TIMEOUTS: Dict[str, aiohttp.ClientTimeout] = {
+    "list": aiohttp.ClientTimeout(total=4, connect=2, sock_read=3),
+    "item": aiohttp.ClientTimeout(total=2, connect=1, sock_read=1.5),
+}
+
+# Streamed bodies may take long overall; only stalls between reads time out
+STREAM_TIMEOUT = aiohttp.ClientTimeout(total=None, connect=2, sock_read=5)
+
+# Gateway errors are usually transient; other statuses are returned as-is
+RETRY_STATUSES = frozenset({502, 503, 504})
+
+
+class UpstreamResponse(NamedTuple):
+    """A fully read upstream response"""
+    status: int
+    content_type: str
+    body: bytes
+
+
+class UpstreamClient:
+    """
+    Application-scoped aiohttp session with a tuned connection pool.
+
+    One session is shared by every handler so TCP/TLS connections and DNS
+    answers are reused instead of being set up per request. ``start`` and
+    ``close`` are called from the app lifespan; the session is also created
+    lazily so serverless handlers reuse it across warm invocations.
+
+    ``fetch`` adds resilience on top: a circuit breaker per resource that
+    fails fast while the upstream is down, bounded retries with jittered
+    backoff for gateway errors and timeouts (all requests are idempotent
+    GETs), optional hedging (a second request once the first has taken
+    ``hedge_after`` seconds) and an overall per-route deadline.
+    """
+
+    def __init__(
+        self,
+        limit: int = int(os.environ.get("UPSTREAM_POOL_LIMIT", 100)),
+        limit_per_host: int = int(os.environ.get("UPSTREAM_POOL_LIMIT_PER_HOST", 50)),
+        keepalive_timeout: float = float(os.environ.get("UPSTREAM_KEEPALIVE_TIMEOUT", 30)),
+        dns_cache_ttl: int = int(os.environ.get("UPSTREAM_DNS_CACHE_TTL", 300)),
+        retries: int = int(os.environ.get("UPSTREAM_RETRIES", 2)),
+        backoff_base: float = float(os.environ.get("UPSTREAM_BACKOFF_BASE", 0.05)),
+        backoff_max: float = float(os.environ.get("UPSTREAM_BACKOFF_MAX", 1.0)),
+        hedge_after: float = float(os.environ.get("UPSTREAM_HEDGE_AFTER", 0)),
+        breaker_threshold: int = int(os.environ.get("UPSTREAM_BREAKER_THRESHOLD", 5)),
+        breaker_reset: float = float(os.environ.get("UPSTREAM_BREAKER_RESET", 30)),
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Pool usage, counted here rather than read from the connector's
+        # internals: requests being sent or read, and streamed responses
+        # whose callers have not released them yet
+        self._in_flight = 0
+        self._streams: "weakref.WeakSet[aiohttp.ClientResponse]" = weakref.WeakSet()
+        self.counters = {
+            "requests": 0,
+            "connections_created": 0,
+            "connections_reused": 0,
+            "pool_waits": 0,
+            "pool_wait_seconds": 0.0,
+            "retries": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+            "short_circuited": 0,
+            "deadline_exceeded": 0,
+        }
+
+    async def start(self):
+        # Open the pool up front so the first request doesn't pay for it
+        self._ensure_session()
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        return self._ensure_session()
+
+    def _ensure_session(self) -> aiohttp.ClientSession:
+        # A session is bound to its event loop; rebuild it if the loop changed
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_cache_ttl,
+                use_dns_cache=True,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=ROUTE_TIMEOUTS["item"],
+                trace_configs=[self._trace_config()],
+            )
+            self._loop = loop
+        return self._session
+
+    def timeout(self, route: str) -> aiohttp.ClientTimeout:
+        return ROUTE_TIMEOUTS.get(route, ROUTE_TIMEOUTS["item"])
+
+    def breaker(self, resource: str) -> CircuitBreaker:
+        breaker = self.breakers.get(resource)
+        if breaker is None:
+            breaker = self.breakers[resource] = CircuitBreaker(self.breaker_threshold, self.breaker_reset)
+        return breaker
+
+    async def fetch(self, path: str, route: str = "item", **kwargs) -> UpstreamResponse:
+        """
+        GET ``path`` with the breaker, retries, hedging and the route deadline.
+
+        Raises CircuitOpenError when the resource's breaker is open,
+        asyncio.TimeoutError past the deadline and aiohttp.ClientError when
+        every attempt failed. 5xx responses count as breaker failures but
+        are returned so callers can report the upstream status.
+        """
+        resource = _resource(path)
+        breaker = self.breaker(resource)
+        if not breaker.allow():
+            self.counters["short_circuited"] += 1
+            raise CircuitOpenError(resource)
+
+        self.counters["requests"] += 1
+        try:
+            response = await asyncio.wait_for(
+                self._fetch_with_retries(UPSTREAM_BASE_URL + path, route, resource, kwargs),
+                ROUTE_DEADLINES.get(route, ROUTE_DEADLINES["item"]),
+            )
+        except asyncio.TimeoutError:
+            self.counters["deadline_exceeded"] += 1
+            breaker.record_failure()
+            raise
+        except aiohttp.ClientError:
+            breaker.record_failure()
+            raise
+        if response.status >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+    async def open(self, path: str, **kwargs) -> aiohttp.ClientResponse:
+        """
+        Start a GET and return as soon as the headers are in, to stream the body.
+
+        The breaker and retries apply until the headers arrive; after that
+        the caller reads the body and must ``release()`` the response.
+        """
+        resource = _resource(path)
+        breaker = self.breaker(resource)
+        if not breaker.allow():
+            self.counters["short_circuited"] += 1
+            raise CircuitOpenError(resource)
+
+        self.counters["requests"] += 1
+        attempt = 0
+        while True:
+            self._in_flight += 1
+            try:
+                response = await self.session.get(UPSTREAM_BASE_URL + path, timeout=STREAM_TIMEOUT, **kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt >= self.retries:
+                    breaker.record_failure()
+                    raise
+            else:
+                if response.status not in RETRY_STATUSES or attempt >= self.retries:
+                    if response.status >= 500:
+                        breaker.record_failure()
+                    else:
+                        breaker.record_success()
+                    self._streams.add(response)
+                    return response
+            finally:
+                self._in_flight -= 1
+                response.release()
+            self.counters["retries"] += 1
+            UPSTREAM_RETRIES.inc(resource)
+            await asyncio.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_max))
+            attempt += 1
+
+    async def _fetch_with_retries(self, url: str, route: str, resource: str, kwargs: dict) -> UpstreamResponse:
+        timeout = self.timeout(route)
+        attempt = 0
+        while True:
+            try:
+                response = await self._hedged(url, timeout, kwargs)
+                if response.status not in RETRY_STATUSES or attempt >= self.retries:
+                    return response
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt >= self.retries:
+                    raise
+            self.counters["retries"] += 1
+            UPSTREAM_RETRIES.inc(resource)
+            await asyncio.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_max))
+            attempt += 1
+
+    async def _hedged(self, url: str, timeout: aiohttp.ClientTimeout, kwargs: dict) -> UpstreamResponse:
+        """One attempt; with hedging on, a late attempt races a second request"""
+        if not self.hedge_after:
+            return await self._attempt(url, timeout, kwargs)
+
+        first = asyncio.ensure_future(self._attempt(url, timeout, kwargs))
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=self.hedge_after)
+            if done:
+                return first.result()
+
+            self.counters["hedges"] += 1
+            hedge = asyncio.ensure_future(self._attempt(url, timeout, kwargs))
+            pending.add(hedge)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.counters["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _attempt(self, url: str, timeout: aiohttp.ClientTimeout, kwargs: dict) -> UpstreamResponse:
+        self._in_flight += 1
+        try:
+            async with self.session.get(url, timeout=timeout, **kwargs) as response:
+                return UpstreamResponse(response.status, response.content_type, await response.read())
+        finally:
+            self._in_flight -= 1
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        counters = self.counters
+        trace = aiohttp.TraceConfig()
+
+        async def on_queued_start(session, context, params):
+            context.queued_at = time.perf_counter()
+            counters["pool_waits"] += 1
+
+        async def on_queued_end(session, context, params):
+            counters["pool_wait_seconds"] += time.perf_counter() - context.queued_at
+
+        async def on_create_end(session, context, params):
+            counters["connections_created"] += 1
+
+        async def on_reuse(session, context, params):
+            counters["connections_reused"] += 1
+
+        # Latency and errors per dummyjson resource (first path segment)
+        async def on_request_start(session, context, params):
+            context.started_at = time.perf_counter()
+
+        async def on_request_end(session, context, params):
+            resource = _resource(params.url.path)
+            UPSTREAM_REQUEST_DURATION.observe(time.perf_counter() - context.started_at, resource)
+            if params.response.status >= 500:
+                UPSTREAM_ERRORS.inc(resource, "http_5xx")
+
+        async def on_request_exception(session, context, params):
+            resource = _resource(params.url.path)
+            UPSTREAM_REQUEST_DURATION.observe(time.perf_counter() - context.started_at, resource)
+            UPSTREAM_ERRORS.inc(resource, type(params.exception).__name__)
+
+        trace.on_connection_queued_start.append(on_queued_start)
+        trace.on_connection_queued_end.append(on_queued_end)
+        trace.on_connection_create_end.append(on_create_end)
+        trace.on_connection_reuseconn.append(on_reuse)
+        trace.on_request_start.append(on_request_start)
+        trace.on_request_end.append(on_request_end)
+        trace.on_request_exception.append(on_request_exception)
+        return trace
+
+    @property
+    def in_use(self) -> int:
+        """Requests holding (or waiting for) a pooled connection"""
+        return self._in_flight + sum(1 for response in tuple(self._streams) if not response.closed)
+
+    def stats(self) -> dict:
+        """Pool configuration, current usage and saturation counters"""
+        in_use = self.in_use
+        return {
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+            "in_use": in_use,
+            "saturated": in_use >= self.limit,
+            **self.counters,
+            "breakers": {resource: breaker.stats() for resource, breaker in self.breakers.items()},
+        }
+
+
+def _resource(path: str) -> str:
+    return path.strip("/").split("/", 1)[0] or "root"
+
+
+upstream = UpstreamClient()
+
+UPSTREAM_RETRIES = metrics.counter("upstream_retries_total", "Upstream attempts retried, by resource", ("resource",))
+# 0 closed, 1 half-open, 2 open; merged with max so any worker's open breaker shows
+breaker_state = metrics.gauge("upstream_circuit_state", "Circuit breaker state by resource", ("resource",), merge="max")
+BREAKER_STATE_VALUES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+
+def _collect_breaker_metrics():
+    for resource, breaker in upstream.breakers.items():
+        breaker_state.set(BREAKER_STATE_VALUES[breaker.state], resource)
+
+
+metrics.collectors.append(_collect_breaker_metrics)
@@ -0,0 +1,67 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Templates are looked up relative to the working directory
+os.chdir(ROOT)
+
+# Keep the app self-contained: in-memory history, no catalog mirror, and a
+# dead upstream unless a test starts the stub
+os.environ.setdefault("CHAT_HISTORY_BACKEND", "memory")
+os.environ.setdefault("CATALOG_MIRROR", "0")
+os.environ.setdefault("UPSTREAM_BASE_URL", "http://127.0.0.1:9")
+# Limits get their own tests; elsewhere they would only make tests order-dependent
+for name in ("RATE_LIMIT_API", "RATE_LIMIT_HISTORY", "RATE_LIMIT_WS"):
+    os.environ.setdefault(name, "off")
+
+
+class Stub:
+    """The running stub's control endpoints: fault settings and hit counts"""
+
+    def __init__(self, client, url: str):
+        self.client = client
+        self.url = url
+
+    async def _get(self, path: str, **params) -> dict:
+        async with self.client.session.get(self.url + path, params=params) as response:
+            return await response.json()
+
+    async def faults(self, **settings):
+        await self._get("/_faults", **{name: str(value) for name, value in settings.items()})
+
+    async def hits(self) -> int:
+        return (await self._get("/_hits"))["total"]
+
+
+@pytest.fixture
+def run_against_stub(monkeypatch):
+    """
+    ``run_against_stub(scenario, **client_options)`` runs ``scenario(client,
+    stub)`` with a fresh upstream client pointed at a fault-injecting stub
+    """
+    # Imported here: the app reads the environment set above when imported
+    from benchmarks.stub_upstream import start_stub
+    from controller import index as controller
+    from services import upstream as upstream_module
+    from services.upstream import UpstreamClient
+
+    def run(scenario, **client_options):
+        async def main():
+            runner = await start_stub()
+            url = "http://%s:%s" % runner.addresses[0][:2]
+            monkeypatch.setattr(upstream_module, "UPSTREAM_BASE_URL", url)
+            client = UpstreamClient(backoff_base=0.001, backoff_max=0.01, **client_options)
+            monkeypatch.setattr(controller, "upstream", client)
+            try:
+                return await scenario(client, Stub(client, url))
+            finally:
+                await client.close()
+                await runner.cleanup()
+
+        return asyncio.run(main())
+
+    return run
@@ -0,0 +1,67 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from factory import PUBLIC_PATHS, create_app
+from middleware.index import PathMatcher
+
+
+def test_cors_preflight_skips_auth():
+    client = TestClient(create_app("serverless"))
+    response = client.options("/api/products", headers={
+        "Origin": "https://example.com",
+        "Access-Control-Request-Method": "GET",
+        "Access-Control-Request-Headers": "authorization",
+    })
+    assert response.status_code == 200
+    assert response.headers["access-control-allow-origin"] == "https://example.com"
+    assert "GET" in response.headers["access-control-allow-methods"]
+
+
+def test_plain_options_still_needs_a_token():
+    client = TestClient(create_app("serverless"))
+    response = client.options("/api/products", headers={"Origin": "https://example.com"})
+    assert response.status_code == 401
+
+
+def test_missing_token_is_rejected():
+    client = TestClient(create_app("serverless"))
+    response = client.get("/api/products")
+    assert response.status_code == 401
+    assert response.json()["message"] == "Token required"
+
+
+PUBLIC = PathMatcher(PUBLIC_PATHS)
+
+
+@pytest.mark.parametrize("path", [
+    "/", "/chat", "/chat/", "/chat/general", "/ws/alice", "/ws/room/alice", "/static/app.css",
+    "/api/online-users", "/api/online-users/stream", "/api/chat/history", "/docs", "/openapi.json",
+])
+def test_public_paths(path):
+    assert PUBLIC.matches(path)
+
+
+@pytest.mark.parametrize("path", [
+    "/chatter", "/chat-admin", "/wss", "/api", "/api/products", "/api/chat", "/api/online-users-admin",
+    "/items/1", "/metricsx", "/statics",
+])
+def test_protected_paths(path):
+    assert not PUBLIC.matches(path)
+
+
+def test_root_rule_is_exact():
+    matcher = PathMatcher(["/"])
+    assert matcher.matches("/")
+    assert not matcher.matches("/anything")
+
+
+def test_exact_rules():
+    matcher = PathMatcher(["=/health", "/docs"])
+    assert matcher.matches("/health")
+    assert not matcher.matches("/health/deep")
+    assert matcher.matches("/docs/oauth2-redirect")
+
+
+def test_empty_matcher_matches_nothing():
+    assert not PathMatcher([]).matches("/")
+    assert not PathMatcher([]).matches("/chat")
@@ -0,0 +1,71 @@
+import asyncio
+import os
+
+from chat.backplane import UnixSocketBackplane, create_backplane, default_socket_path
+
+
+async def eventually(condition, timeout=5.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "condition not met in time"
+        await asyncio.sleep(0.02)
+
+
+def listen(backplane):
+    received = []
+    backplane.subscribe(lambda topic, data: received.append((topic, data)))
+    return received
+
+
+def test_one_broker_relays_to_every_worker(tmp_path):
+    async def relay():
+        path = str(tmp_path / "chat.sock")
+        first, second = UnixSocketBackplane(path), UnixSocketBackplane(path)
+        heard = [listen(first), listen(second)]
+        await first.start()
+        await second.start()
+        try:
+            brokers = [backplane._server is not None for backplane in (first, second)]
+            await second.publish("room:lobby", b"hello")
+            await eventually(lambda: all(heard))
+            return brokers, heard
+        finally:
+            await second.stop()
+            await first.stop()
+
+    brokers, heard = asyncio.run(relay())
+    assert brokers == [True, False]
+    assert heard == [[("room:lobby", b"hello")]] * 2
+
+
+def test_a_survivor_takes_over_when_the_broker_stops(tmp_path):
+    async def failover():
+        path = str(tmp_path / "chat.sock")
+        broker, survivor = UnixSocketBackplane(path), UnixSocketBackplane(path)
+        await broker.start()
+        await survivor.start()
+        await broker.stop()
+        await eventually(lambda: survivor._server is not None and survivor._writer is not None)
+
+        late = UnixSocketBackplane(path)
+        heard = listen(survivor)
+        await late.start()
+        try:
+            await late.publish("room:lobby", b"after failover")
+            await eventually(lambda: heard)
+            return heard
+        finally:
+            await late.stop()
+            await survivor.stop()
+
+    assert asyncio.run(failover()) == [("room:lobby", b"after failover")]
+
+
+def test_default_socket_path_is_per_app_and_short(monkeypatch):
+    monkeypatch.setenv("CHAT_BACKPLANE", "unix")
+    monkeypatch.delenv("CHAT_BACKPLANE_PATH", raising=False)
+    path = default_socket_path()
+    assert create_backplane().path == path
+    assert os.path.basename(path).startswith("fastapi-chat-")
+    assert len(path.encode()) < 100
@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+from controller import index as controller
+from services.cache import MemoryCacheStore, ResponseCache
+
+PRODUCTS = next(resource for resource in controller.RESOURCES if resource.name == "products")
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(controller, "response_cache", ResponseCache(MemoryCacheStore(1 << 20), ttl=60, stale_while_revalidate=0))
+
+
+async def batch(ids):
+    return json.loads((await controller.batch_response(PRODUCTS, ids)).body)
+
+
+def test_partial_failure_is_207_with_per_id_errors(run_against_stub):
+    async def scenario(client, stub):
+        return await batch("1,999,2")
+
+    body = run_against_stub(scenario, retries=0)
+    assert body["status_code"] == 207
+    assert not body["success"]
+    assert [item["id"] for item in body["data"]] == [1, 2]
+    assert list(body["errors"]) == ["999"]
+    assert body["errors"]["999"]["status_code"] == 404
+
+
+def test_every_id_failing_takes_the_first_error_status(run_against_stub):
+    async def scenario(client, stub):
+        return await batch("998,999")
+
+    body = run_against_stub(scenario, retries=0)
+    assert body["status_code"] == 404
+    assert body["data"] == []
+    assert set(body["errors"]) == {"998", "999"}
+
+
+def test_repeated_ids_are_fetched_once_and_cached(run_against_stub):
+    async def scenario(client, stub):
+        first = await batch("3,4,3,3")
+        after_first = await stub.hits()
+        second = await batch("4,3")
+        return first, after_first, second, await stub.hits()
+
+    first, after_first, second, after_second = run_against_stub(scenario, retries=0)
+    assert first["status_code"] == 200
+    assert [item["id"] for item in first["data"]] == [3, 4]
+    assert after_first == 2
+    assert [item["id"] for item in second["data"]] == [4, 3]
+    assert after_second == 2
+
+
+def test_an_upstream_outage_is_reported_per_id(run_against_stub):
+    async def scenario(client, stub):
+        await batch("5")
+        await stub.faults(down=1)
+        return await batch("5,6")
+
+    body = run_against_stub(scenario, retries=0, breaker_threshold=100)
+    assert body["status_code"] == 207
+    assert [item["id"] for item in body["data"]] == [5]
+    assert body["errors"]["6"]["status_code"] == 503
+
+
+@pytest.mark.parametrize("ids", ["", ",", "1,a", ",".join(str(number) for number in range(1, 102))])
+def test_bad_id_lists_are_rejected(ids, run_against_stub):
+    async def scenario(client, stub):
+        return await batch(ids), await stub.hits()
+
+    body, hits = run_against_stub(scenario)
+    assert body["status_code"] == 400
+    assert hits == 0
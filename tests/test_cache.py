@@ -0,0 +1,105 @@
+import asyncio
+import threading
+
+from starlette.requests import Request
+
+from services.cache import CacheEntry, DiskCacheStore, MemoryCacheStore, ResponseCache
+
+
+def get_request(headers=()):
+    return Request({"type": "http", "method": "GET", "path": "/api/products", "headers": list(headers)})
+
+
+def respond(cache, request, payload):
+    async def fetch():
+        return payload, True
+
+    return asyncio.run(cache.respond(request, "products?", fetch))
+
+
+def test_cached_responses_are_private():
+    cache = ResponseCache(MemoryCacheStore(1 << 20), ttl=60, stale_while_revalidate=30)
+    for status in ("MISS", "HIT"):
+        response = respond(cache, get_request(), {"data": [1]})
+        assert response.headers["x-cache"] == status
+        assert response.headers["cache-control"].startswith("private,")
+        assert "public" not in response.headers["cache-control"]
+
+
+def test_matching_etag_gets_304():
+    cache = ResponseCache(MemoryCacheStore(1 << 20), ttl=60, stale_while_revalidate=30)
+    etag = respond(cache, get_request(), {"data": [1]}).headers["etag"]
+    response = respond(cache, get_request([(b"if-none-match", etag.encode())]), {"data": [1]})
+    assert response.status_code == 304
+
+
+def test_disk_store_keeps_running_totals(tmp_path):
+    async def writes():
+        store = DiskCacheStore(str(tmp_path), max_bytes=1 << 20)
+        await store.set("a", CacheEntry(b"x" * 100, '"a"', 1.0))
+        await store.set("b", CacheEntry(b"y" * 50, '"b"', 1.0))
+        await store.set("a", CacheEntry(b"z" * 10, '"a2"', 2.0))
+        return store, await store.get("a"), await store.get("missing")
+
+    store, entry, missing = asyncio.run(writes())
+    assert (entry.body, entry.etag, entry.stored_at) == (b"z" * 10, '"a2"', 2.0)
+    assert missing is None
+    assert len(store) == 2
+    assert store.bytes == sum(path.stat().st_size for path in tmp_path.iterdir())
+
+
+def test_disk_store_sweeps_once_over_budget_and_recounts(tmp_path):
+    (tmp_path / "left-by-another-worker").write_bytes(b"o" * 300)
+
+    async def writes():
+        store = DiskCacheStore(str(tmp_path), max_bytes=1000)
+        for number in range(6):
+            await store.set(f"key{number}", CacheEntry(b"x" * 200, '"e"', float(number)))
+        return store
+
+    store = asyncio.run(writes())
+    assert store.evictions > 0
+    assert store.bytes <= 1000
+    assert len(store) == len(list(tmp_path.iterdir()))
+    assert store.bytes == sum(path.stat().st_size for path in tmp_path.iterdir())
+
+
+def test_disk_store_reads_off_the_event_loop(tmp_path):
+    async def read():
+        store = DiskCacheStore(str(tmp_path), max_bytes=1 << 20)
+        await store.set("a", CacheEntry(b"{}", '"a"', 1.0))
+        loop_thread = threading.get_ident()
+        threads = []
+        original = store._read
+
+        def read_in(path):
+            threads.append(threading.get_ident())
+            return original(path)
+
+        store._read = read_in
+        await store.get("a")
+        return loop_thread, threads
+
+    loop_thread, threads = asyncio.run(read())
+    assert threads and loop_thread not in threads
+
+
+def test_stale_refreshes_are_held_until_done():
+    async def stale_hit():
+        cache = ResponseCache(MemoryCacheStore(1 << 20), ttl=0, stale_while_revalidate=60)
+        refreshed = asyncio.Event()
+
+        async def fetch():
+            await refreshed.wait()
+            return {"data": [2]}, True
+
+        await cache.put("products?", {"data": [1]})
+        response = await cache.respond(get_request(), "products?", fetch)
+        held = len(cache._tasks)
+        refreshed.set()
+        await asyncio.gather(*cache._tasks)
+        return response, held, len(cache._tasks)
+
+    response, held, left = asyncio.run(stale_hit())
+    assert response.headers["x-cache"] == "STALE"
+    assert (held, left) == (1, 0)
@@ -0,0 +1,27 @@
+import asyncio
+
+from services import catalog as catalog_module
+from services.catalog import CATALOG_SPECS, CatalogMirror
+from services.serializer import dumps
+from services.upstream import UpstreamResponse
+
+
+def test_concurrent_first_searches_share_one_refresh(monkeypatch):
+    calls = []
+
+    async def fetch(path, route="item", **kwargs):
+        calls.append(path)
+        await asyncio.sleep(0.01)
+        body = dumps({"products": [{"id": 1, "title": "Phone"}], "total": 1})
+        return UpstreamResponse(200, "application/json", body)
+
+    monkeypatch.setattr(catalog_module.upstream, "fetch", fetch)
+    mirror = CatalogMirror("products", CATALOG_SPECS["products"])
+
+    async def search_at_once():
+        return await asyncio.gather(*(mirror.get_snapshot() for _ in range(10)))
+
+    snapshots = asyncio.run(search_at_once())
+    assert len(calls) == 1
+    assert mirror.counters["refreshes"] == 1
+    assert all(snapshot is snapshots[0] for snapshot in snapshots)
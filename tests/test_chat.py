@@ -0,0 +1,379 @@
+import asyncio
+import json
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from chat import index as chat_index
+from chat import routes as chat_routes
+from chat.broadcast import ClientConnection
+from chat.frames import ChatFrame
+from chat.history import MemoryHistoryStore
+from chat.index import ConnectionManager
+from chat.routes import manager, stream_online_users
+from factory import create_app
+from main import app
+from middleware.tokens import HMACTokenVerifier
+from services.ratelimit import MemoryBucketStore, RateLimit
+from services.serializer import dumps
+
+HEADERS = {"Authorization": "Bearer test"}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Long enough never to run out mid-test; tests end it with end_grace
+    monkeypatch.setattr(manager, "resume_grace", 60)
+    # The manager is module-level; an earlier client's shutdown drained it
+    monkeypatch.setattr(manager, "draining", False)
+    monkeypatch.setattr(manager.presence, "streams_ended", False)
+    with TestClient(app) as client:
+        yield client
+
+
+def room_messages(room):
+    return [message.message for message in manager.chat_history.get(room, ())]
+
+
+def receive_chat(websocket):
+    """Next non-presence frame"""
+    while True:
+        frame = json.loads(websocket.receive_text())
+        if frame["type"] != "presence":
+            return frame
+
+
+def wait_for(condition, timeout=5.0):
+    """Poll until the server side has caught up with what the test did"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.005)
+
+
+def end_grace(client):
+    """Announce pending departures now, as if the resume grace had run out"""
+    client.portal.call(manager._flush_departures)
+
+
+def test_reconnect_before_old_socket_dies_is_silent(client):
+    with client.websocket_connect("/ws/overlap/bob", headers=HEADERS) as old:
+        joined = receive_chat(old)
+        with client.websocket_connect(f"/ws/overlap/bob?last_seq={joined['id']}", headers=HEADERS) as new:
+            # Sent once the new socket is registered, so the old one closes after that
+            assert json.loads(new.receive_text())["type"] == "presence"
+            old.close()
+            wait_for(lambda: manager.sockets_here("overlap", "bob") == 1)
+            end_grace(client)
+            new.send_text(json.dumps({"message": "still here"}))
+            assert receive_chat(new)["message"] == "still here"
+    wait_for(lambda: ("overlap", "bob") in manager._departures)
+    end_grace(client)
+    assert room_messages("overlap") == ["bob joined the chat!", "still here", "bob left the chat!"]
+
+
+def test_quick_reconnect_replays_missed_messages(client):
+    with client.websocket_connect("/ws/blip/alice", headers=HEADERS) as alice:
+        receive_chat(alice)
+        with client.websocket_connect("/ws/blip/bob", headers=HEADERS) as bob:
+            last_seq = receive_chat(bob)["id"]
+            receive_chat(alice)
+        alice.send_text(json.dumps({"message": "while you were away"}))
+        receive_chat(alice)
+        with client.websocket_connect(f"/ws/blip/bob?last_seq={last_seq}", headers=HEADERS) as bob:
+            assert receive_chat(bob)["message"] == "while you were away"
+            bob.send_text(json.dumps({"message": "back"}))
+            assert receive_chat(alice)["message"] == "back"
+    assert room_messages("blip").count("bob joined the chat!") == 1
+
+
+def post(client, room, count):
+    """Broadcast ``count`` messages straight through the manager (no rate limit)"""
+    for number in range(count):
+        client.portal.call(manager.broadcast, ChatFrame("carol", f"message {number}"), room)
+
+
+def test_replay_reaches_past_the_ring(client):
+    with client.websocket_connect("/ws/behind/bob", headers=HEADERS) as bob:
+        last_seq = receive_chat(bob)["id"]
+    post(client, "behind", 151)
+    with client.websocket_connect(f"/ws/behind/bob?last_seq={last_seq}", headers=HEADERS) as bob:
+        replayed = [receive_chat(bob)["message"] for _ in range(151)]
+    assert replayed == [f"message {number}" for number in range(151)]
+
+
+def test_too_far_behind_gets_a_gap_frame(client, monkeypatch):
+    monkeypatch.setattr(chat_index, "REPLAY_LIMIT", 120)
+    with client.websocket_connect("/ws/lost/bob", headers=HEADERS) as bob:
+        last_seq = receive_chat(bob)["id"]
+    post(client, "lost", 121)
+    with client.websocket_connect(f"/ws/lost/bob?last_seq={last_seq}", headers=HEADERS) as bob:
+        assert receive_chat(bob) == {"type": "gap"}
+
+
+def test_online_user_streams_end_when_presence_ends_them(monkeypatch):
+    monkeypatch.setattr(manager.presence, "streams_ended", False)
+
+    async def read_stream():
+        events = (await stream_online_users()).body_iterator
+        first = await events.__anext__()
+        manager.presence.end_streams()
+        rest = [event async for event in events]
+        return first, rest
+
+    first, rest = asyncio.run(asyncio.wait_for(read_stream(), timeout=5))
+    assert first.startswith("data: ")
+    assert rest == []
+    assert not manager.presence.subscribers
+
+
+def test_asking_about_unknown_rooms_keeps_nothing(client):
+    for number in range(20):
+        assert client.get(f"/chat?room=nobody-{number}").status_code == 200
+        assert client.get(f"/api/chat/history?room=nobody-{number}").json()["data"] == []
+    assert not any(room.startswith("nobody-") for room in manager.chat_history)
+    assert not any(room.startswith("nobody-") for room in manager._warmed)
+
+
+def test_rooms_with_history_are_still_warmed(client):
+    post(client, "spoken", 3)
+    manager._warmed.discard("spoken")
+    history = client.get("/api/chat/history?room=spoken").json()["data"]
+    assert [message["message"] for message in history] == ["message 0", "message 1", "message 2"]
+    assert "spoken" in manager._warmed
+
+
+@pytest.fixture
+def secured(monkeypatch):
+    monkeypatch.setenv("AUTH_SECRET", "test-secret")
+    monkeypatch.setattr(manager, "draining", False)
+    with TestClient(create_app("server")) as client:
+        yield client
+
+
+def test_anonymous_sockets_are_guests_when_tokens_are_verified(secured):
+    with secured.websocket_connect("/ws/secured/alice") as websocket:
+        assert receive_chat(websocket)["message"] == "guest:alice joined the chat!"
+
+
+def test_verified_subject_overrides_the_path_id(secured):
+    token = HMACTokenVerifier(b"test-secret").issue({"sub": "alice"}, ttl=60)
+    with secured.websocket_connect(f"/ws/secured/mallory?token={token}") as websocket:
+        assert receive_chat(websocket)["message"] == "alice joined the chat!"
+
+
+class YieldingStore(MemoryHistoryStore):
+    """Memory store whose reads give up the loop, like a real database would"""
+
+    def __init__(self):
+        super().__init__()
+        self.pages = 0
+
+    async def page(self, *args, **kwargs):
+        self.pages += 1
+        await asyncio.sleep(0.01)
+        return await super().page(*args, **kwargs)
+
+
+def test_concurrent_reads_of_empty_rooms_keep_nothing():
+    store = YieldingStore()
+    rooms = [f"empty-{number}" for number in range(5)]
+
+    async def read_all():
+        local = ConnectionManager(history=store)
+        await asyncio.gather(*(local.get_history_page(room) for room in rooms for _ in range(10)))
+        return local
+
+    local = asyncio.run(read_all())
+    assert local.chat_history == {}
+    assert local._warmed == set()
+    assert local._warming == {}
+
+
+def test_concurrent_reads_share_one_backfill():
+    store = YieldingStore()
+
+    async def read_all():
+        for number in range(3):
+            await store.append("busy", ChatFrame("alice", f"message {number}"))
+        local = ConnectionManager(history=store)
+        pages = await asyncio.gather(*(local.get_chat_history("busy") for _ in range(10)))
+        return local, pages
+
+    local, pages = asyncio.run(read_all())
+    assert store.pages == 1
+    assert all([message.message for message in page] == ["message 0", "message 1", "message 2"] for page in pages)
+    assert local._warmed == {"busy"}
+
+
+def test_renaming_the_socket_does_not_reset_the_message_limit(client, monkeypatch):
+    monkeypatch.setattr(chat_routes, "WS_MESSAGE_LIMIT", RateLimit.parse("1/m:1"))
+    monkeypatch.setattr(chat_routes, "rate_limits", MemoryBucketStore())
+    for name in ("mallory", "mallory2"):
+        with client.websocket_connect(f"/ws/renamed/{name}", headers=HEADERS) as socket:
+            receive_chat(socket)
+            socket.send_text(json.dumps({"message": f"from {name}"}))
+            received = receive_chat(socket)
+    assert received["type"] == "system" and "too fast" in received["message"]
+    assert "from mallory2" not in room_messages("renamed")
+
+
+def test_a_server_error_still_leaves_the_room(client, monkeypatch):
+    class Broken:
+        @staticmethod
+        def decode(data):
+            raise RuntimeError("boom")
+
+    with client.websocket_connect("/ws/broken/bob", headers=HEADERS) as bob:
+        receive_chat(bob)
+        assert manager.sockets_here("broken", "bob") == 1
+        monkeypatch.setattr(chat_routes, "IncomingMessage", Broken)
+        bob.send_text(json.dumps({"message": "hello"}))
+        with pytest.raises(RuntimeError):
+            bob.receive_text()
+    assert manager.sockets_here("broken", "bob") == 0
+    assert ("broken", "bob") in manager._departures
+
+
+class BlockingSocket:
+    """Fake WebSocket whose sends of frames containing ``block_on`` wait for ``release``"""
+
+    def __init__(self, block_on="reconnect"):
+        self.scope = {"subprotocols": []}
+        self.block_on = block_on
+        self.release = asyncio.Event()
+        self.sent = []
+        self.close_code = None
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, text):
+        if self.block_on in text:
+            await self.release.wait()
+        self.sent.append(text)
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
+def test_drain_waits_for_the_frame_being_written():
+    async def drain_while_sending():
+        local = ConnectionManager(history=MemoryHistoryStore())
+        socket = BlockingSocket()
+        await local.connect(socket, "bob", "draining")
+        drain = asyncio.create_task(local.drain(jitter=0, timeout=5))
+        await asyncio.sleep(0.2)
+        waited = not drain.done()
+        socket.release.set()
+        await asyncio.wait_for(drain, timeout=5)
+        return waited, socket
+
+    waited, socket = asyncio.run(drain_while_sending())
+    assert waited
+    assert json.loads(socket.sent[-1])["type"] == "reconnect"
+    assert socket.close_code == 1012
+
+
+def test_turned_away_sockets_get_1013_without_reading_history():
+    async def overflow():
+        store = YieldingStore()
+        local = ConnectionManager(history=store, max_connections=1)
+        first = await local.connect(BlockingSocket(), "alice", "full")
+        extra = BlockingSocket()
+        refused = await local.connect(extra, "bob", "full", last_seq=0)
+        local.draining = True
+        late = BlockingSocket()
+        refused_late = await local.connect(late, "carol", "other", last_seq=0)
+        return first, refused, refused_late, extra, late, store
+
+    first, refused, refused_late, extra, late, store = asyncio.run(overflow())
+    assert first is not None
+    assert refused is None and refused_late is None
+    assert extra.close_code == 1013 and late.close_code == 1013
+    assert store.pages == 0
+
+
+def receive_batch(websocket):
+    """One v2 frame: a JSON array of compact frames"""
+    frames = json.loads(websocket.receive_text())
+    assert isinstance(frames, list) and all(isinstance(frame, list) for frame in frames)
+    return frames
+
+
+def test_v2_is_chosen_only_when_offered(client):
+    # The test client writes the offered subprotocols into the headers it is given, hence the copies below
+    with client.websocket_connect("/ws/protocols/old", headers=HEADERS) as old:
+        assert old.accepted_subprotocol is None
+        assert isinstance(json.loads(old.receive_text()), dict)
+    with client.websocket_connect("/ws/protocols/new", headers=dict(HEADERS), subprotocols=["other", "chat.v2"]) as new:
+        assert new.accepted_subprotocol == "chat.v2"
+        assert isinstance(json.loads(new.receive_text()), list)
+
+
+
+def compact_frames(websocket):
+    """Every compact frame received, across batches"""
+    while True:
+        yield from receive_batch(websocket)
+
+
+def next_compact(frames, tag):
+    return next(frame for frame in frames if frame[0] == tag)
+
+
+def test_v2_presence_is_a_full_list_then_deltas(client):
+    with client.websocket_connect("/ws/compact/alice", headers=dict(HEADERS), subprotocols=["chat.v2"]) as alice:
+        frames = compact_frames(alice)
+        tag, room, _, users, joined, left = next_compact(frames, "p")
+        assert (tag, room, joined, left) == ("p", "compact", [], [])
+        assert isinstance(users, list)
+        client.portal.call(manager.presence._publish)
+        with client.websocket_connect("/ws/compact/bob", headers=HEADERS):
+            client.portal.call(manager.presence._publish)
+            delta = next(frame for frame in frames if frame[0] == "p" and "bob" in frame[4])
+        assert delta[1] == "compact" and delta[3] is None
+
+
+def test_v2_messages_arrive_batched(client):
+    with client.websocket_connect("/ws/batched/alice", headers=dict(HEADERS), subprotocols=["chat.v2"]) as alice:
+        next_compact(compact_frames(alice), "s")
+        client.portal.call(post_together, "batched", 3)
+        messages = []
+        while len(messages) < 3:
+            batch = receive_batch(alice)
+            messages += [frame for frame in batch if frame[0] == "u"]
+    assert [frame[4] for frame in messages] == ["message 0", "message 1", "message 2"]
+    assert len(batch) == 3
+
+
+async def post_together(room, count):
+    """Broadcast ``count`` messages without yielding to the writers in between"""
+    for number in range(count):
+        manager._deliver("room:" + room, dumps(ChatFrame("carol", f"message {number}", id=10 ** 6 + number).to_compact()))
+
+
+def test_v2_gap_frame(client, monkeypatch):
+    monkeypatch.setattr(chat_index, "REPLAY_LIMIT", 5)
+    with client.websocket_connect("/ws/v2gap/bob", headers=HEADERS) as bob:
+        last_seq = receive_chat(bob)["id"]
+    post(client, "v2gap", 6)
+    with client.websocket_connect(f"/ws/v2gap/bob?last_seq={last_seq}", headers=dict(HEADERS), subprotocols=["chat.v2"]) as bob:
+        assert next_compact(compact_frames(bob), "g") == ["g"]
+
+
+def test_batching_writer_sends_one_array_per_window():
+    async def burst():
+        socket = BlockingSocket(block_on="never")
+        connection = ClientConnection(socket, "bob", compact=True, batch_window=0.05)
+        connection.start()
+        for number in range(3):
+            connection.enqueue(json.dumps(["u", number, 0, "carol", f"message {number}"]))
+        await connection.flush()
+        connection.close()
+        return socket.sent
+
+    sent = asyncio.run(burst())
+    assert len(sent) == 1
+    assert [frame[4] for frame in json.loads(sent[0])] == ["message 0", "message 1", "message 2"]
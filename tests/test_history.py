@@ -0,0 +1,36 @@
+from chat.frames import ChatFrame
+from chat.history import RingBuffer
+
+
+def ring_of(capacity, ids):
+    ring = RingBuffer(capacity)
+    for message_id in ids:
+        ring.append(ChatFrame("alice", f"message {message_id}", id=message_id))
+    return ring
+
+
+def ids(messages):
+    return [message.id for message in messages]
+
+
+def test_out_of_order_arrivals_are_kept_in_id_order():
+    ring = ring_of(5, [1, 2, 4, 3, 6, 5])
+    assert ids(ring) == [2, 3, 4, 5, 6]
+    assert ids(ring.after(3)) == [4, 5, 6]
+    assert ids(ring.before(5, 2)) == [3, 4]
+
+
+def test_late_arrival_older_than_a_full_ring_is_dropped():
+    ring = ring_of(3, [5, 6, 7, 4])
+    assert ids(ring) == [5, 6, 7]
+    ring.append(ChatFrame("alice", "newest", id=8))
+    assert ids(ring) == [6, 7, 8]
+
+
+def test_after_and_before_on_a_wrapped_ring():
+    ring = ring_of(4, range(1, 11))
+    assert ids(ring) == [7, 8, 9, 10]
+    assert ids(ring.after(0)) == [7, 8, 9, 10]
+    assert ids(ring.after(8)) == [9, 10]
+    assert ids(ring.after(10)) == []
+    assert ids(ring.before(None, 2)) == [9, 10]
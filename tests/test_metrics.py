@@ -0,0 +1,45 @@
+import asyncio
+import os
+
+from fastapi.testclient import TestClient
+
+from factory import create_app
+from services.metrics import MetricsRegistry, metrics
+
+
+def test_scrapes_need_the_metrics_token(monkeypatch, tmp_path):
+    monkeypatch.setattr(metrics, "directory", str(tmp_path))
+    monkeypatch.setenv("METRICS_TOKEN", "scrape-me")
+    client = TestClient(create_app("server"))
+    assert client.get("/metrics").status_code == 403
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 403
+    response = client.get("/metrics", headers={"Authorization": "Bearer scrape-me"})
+    assert response.status_code == 200
+    assert "# TYPE http_request_duration_seconds histogram" in response.text
+
+
+def test_without_a_token_only_this_host_may_scrape(monkeypatch, tmp_path):
+    monkeypatch.setattr(metrics, "directory", str(tmp_path))
+    monkeypatch.delenv("METRICS_TOKEN", raising=False)
+    client = TestClient(create_app("server"))
+    assert client.get("/metrics").status_code == 403
+
+
+def test_exposition_is_reused_for_the_minimum_interval(tmp_path):
+    async def scrape_twice(min_interval):
+        registry = MetricsRegistry(directory=str(tmp_path), min_interval=min_interval)
+        hits = registry.counter("hits_total", "Hits")
+        hits.inc()
+        first = await asyncio.gather(*(registry.exposition() for _ in range(5)))
+        hits.inc()
+        return first, await registry.exposition()
+
+    first, second = asyncio.run(scrape_twice(60))
+    assert all("hits_total 1" in text for text in first)
+    assert second == first[0]
+    _, fresh = asyncio.run(scrape_twice(0))
+    assert "hits_total 2" in fresh
+
+
+def test_default_directory_is_per_process():
+    assert MetricsRegistry().directory.endswith(f"-{os.getpid()}")
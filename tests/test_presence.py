@@ -0,0 +1,58 @@
+import asyncio
+
+from chat.backplane import InProcessBackplane
+from chat.broadcast import ClientConnection, SlowConsumerPolicy
+from chat.frames import presence_compact
+from chat.index import ConnectionManager
+from chat.presence import PresenceTracker
+from services.serializer import dumps_str, loads
+
+
+def test_deltas_carry_the_change_not_the_member_list():
+    frames = []
+
+    async def churn():
+        tracker = PresenceTracker(InProcessBackplane())
+        tracker.listeners.append(lambda room, frame: frames.append(frame))
+        for number in range(50):
+            tracker.join("lobby", f"user{number}")
+        await tracker._publish()
+        tracker.join("lobby", "late")
+        tracker.leave("lobby", "user0")
+        await tracker._publish()
+        return tracker
+
+    tracker = asyncio.run(churn())
+    assert frames[-1] == {"type": "presence", "room": "lobby", "joined": ["late"], "left": ["user0"], "online": 50}
+    assert presence_compact(frames[-1]) == ["p", "lobby", 50, None, ["late"], ["user0"]]
+    # Joining sockets still get everyone
+    assert len(tracker.room_frame("lobby")["users"]) == 50
+
+
+
+def push_deltas(compact):
+    """Four presence flushes into a coalescing connection with room for two frames"""
+    async def flushes():
+        manager = ConnectionManager(backplane=InProcessBackplane())
+        connection = ClientConnection(
+            None, "slow", "lobby", max_queue=2, policy=SlowConsumerPolicy.COALESCE, compact=compact
+        )
+        manager.rooms["lobby"] = {connection}
+        connection.enqueue(dumps_str({"type": "user", "message": "hi"}))
+        manager._push_presence("lobby", PresenceTracker.delta_frame("lobby", ["alice", "bob"], [], 2))
+        manager._push_presence("lobby", PresenceTracker.delta_frame("lobby", ["carol"], ["alice"], 2))
+        manager._push_presence("lobby", PresenceTracker.delta_frame("lobby", ["alice"], ["bob"], 2))
+        return [loads(frame) for _, frame in connection.queue]
+
+    return asyncio.run(flushes())
+
+
+def test_backed_up_clients_fold_presence_deltas_together():
+    message, delta = push_deltas(compact=False)
+    assert message["message"] == "hi"
+    assert delta == {"type": "presence", "room": "lobby", "joined": ["carol", "alice"], "left": ["bob"], "online": 2}
+
+
+def test_backed_up_compact_clients_fold_presence_deltas_together():
+    _, delta = push_deltas(compact=True)
+    assert delta == ["p", "lobby", 2, None, ["carol", "alice"], ["bob"]]
@@ -0,0 +1,62 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+
+import httpx
+
+from factory import create_app
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in a fresh interpreter: this process has imported everything already
+IMPORTS_PROBE = """
+import json, sys
+from factory import create_app
+app = create_app("serverless")
+before = sorted(name for name in sys.modules if name.split(".")[0] in ("jinja2", "chat", "aiohttp", "controller"))
+from fastapi.testclient import TestClient
+TestClient(app).get("/api/products/1", headers={"Authorization": "Bearer test"})
+after = sorted(name for name in sys.modules if name.split(".")[0] in ("jinja2", "chat", "aiohttp", "controller"))
+print(json.dumps({"before": before, "after": after}))
+"""
+
+
+def test_serverless_mounts_no_chat_routes():
+    paths = {getattr(route, "path", "") for route in create_app("serverless").routes}
+    assert not any(path.startswith(("/ws", "/chat", "/api/chat", "/api/online-users", "/metrics")) for path in paths)
+
+
+def test_serverless_imports_neither_jinja_nor_chat():
+    env = dict(os.environ, UPSTREAM_BASE_URL="http://127.0.0.1:9", AUTH_SECRET="", AUTH_KEY_FILE="")
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORTS_PROBE], cwd=ROOT, env=env, capture_output=True, text=True, timeout=60
+    )
+    assert result.returncode == 0, result.stderr
+    modules = json.loads(result.stdout.strip().splitlines()[-1])
+    assert modules["before"] == []
+    # The first /api request loads the data router, and with it aiohttp; still no chat stack
+    assert "controller.index" in modules["after"] and "aiohttp" in modules["after"]
+    assert not any(name.split(".")[0] in ("jinja2", "chat") for name in modules["after"])
+
+
+def test_lazy_router_loads_once_under_concurrent_first_requests(monkeypatch):
+    app = create_app("serverless")
+    included = []
+    include_router = app.include_router
+    monkeypatch.setattr(app, "include_router", lambda router: (included.append(router), include_router(router)))
+
+    async def first_requests():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*(
+                client.get("/api/products/batch", params={"ids": ""}, headers={"Authorization": "Bearer test"})
+                for _ in range(20)
+            ))
+
+    responses = asyncio.run(first_requests())
+    assert [response.status_code for response in responses] == [200] * 20
+    assert len(included) == 1
+    paths = [route.path for route in app.routes if getattr(route, "path", "") == "/api/products/batch"]
+    assert len(paths) == 1
@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import factory
+from factory import create_app
+from middleware.ratelimit import client_key
+from services.ratelimit import MemoryBucketStore, RateLimit, SQLiteBucketStore, _take
+
+
+def scope(token=None, **state):
+    headers = [(b"authorization", b"Bearer " + token.encode())] if token else []
+    return {"type": "http", "headers": headers, "client": ("203.0.113.7", 5000), "state": state}
+
+
+def test_client_key_prefers_the_verified_subject():
+    assert client_key(scope("abc", claims={"sub": "alice"}, verified=True)) == "sub:alice"
+
+
+def test_client_key_uses_a_verified_token_without_subject():
+    key = client_key(scope("abc", claims={"scope": "read"}, verified=True))
+    assert key.startswith("tok:") and "abc" not in key
+
+
+def test_client_key_ignores_unverified_tokens():
+    assert client_key(scope("abc", claims={}, verified=False)) == "ip:203.0.113.7"
+    assert client_key(scope("abc")) == "ip:203.0.113.7"
+
+
+def test_rotating_tokens_does_not_reset_the_limit(monkeypatch):
+    monkeypatch.delenv("AUTH_SECRET", raising=False)
+    monkeypatch.delenv("AUTH_KEY_FILE", raising=False)
+    monkeypatch.setenv("RATE_LIMIT_API", "1/m:2")
+    monkeypatch.setattr(factory, "rate_limits", MemoryBucketStore())
+    client = TestClient(create_app("serverless"))
+    statuses = [
+        client.get("/api/rotating", headers={"Authorization": f"Bearer random-{number}"}).status_code
+        for number in range(4)
+    ]
+    assert statuses[2:] == [429, 429]
+
+
+@pytest.mark.parametrize("spec, expected", [
+    ("20/s", RateLimit(20.0, 20)),
+    ("600/m:100", RateLimit(10.0, 100)),
+    ("5/10s:5", RateLimit(0.5, 5)),
+    (" 1 / h ", RateLimit(1 / 3600, 1)),
+    ("0.5/s", RateLimit(0.5, 1)),
+])
+def test_parse(spec, expected):
+    limit = RateLimit.parse(spec)
+    assert limit.rate == pytest.approx(expected.rate)
+    assert limit.burst == expected.burst
+
+
+@pytest.mark.parametrize("spec", ["", "off", "OFF", "none", "0"])
+def test_parse_off(spec):
+    assert RateLimit.parse(spec) is None
+
+
+@pytest.mark.parametrize("spec", ["20", "20/d", "/s", "20/s:", "fast", "-1/s"])
+def test_parse_rejects_garbage(spec):
+    with pytest.raises(ValueError):
+        RateLimit.parse(spec)
+
+
+def test_take_allows_the_burst_then_refuses():
+    limit = RateLimit(rate=1.0, burst=3)
+    tat = None
+    for _ in range(3):
+        tat, wait = _take(tat, 0.0, limit, 1)
+        assert wait == 0.0
+    refused, wait = _take(tat, 0.0, limit, 1)
+    assert refused is None
+    assert wait == pytest.approx(1.0)
+
+
+def test_take_refills_at_the_rate():
+    limit = RateLimit(rate=2.0, burst=2)
+    tat, _ = _take(None, 0.0, limit, 2)
+    assert _take(tat, 0.25, limit, 1) == (None, pytest.approx(0.25))
+    tat, wait = _take(tat, 0.5, limit, 1)
+    assert wait == 0.0
+    # A long-idle bucket is full again, never fuller
+    tat, _ = _take(tat, 100.0, limit, 2)
+    assert _take(tat, 100.0, limit, 1)[0] is None
+
+
+def test_take_of_more_than_the_burst_never_succeeds():
+    new_tat, wait = _take(None, 0.0, RateLimit(rate=1.0, burst=2), 3)
+    assert new_tat is None and wait == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize("make_store", [
+    lambda tmp_path: MemoryBucketStore(),
+    lambda tmp_path: SQLiteBucketStore(str(tmp_path / "buckets.db")),
+])
+def test_stores_refuse_without_spending(tmp_path, make_store):
+    async def takes():
+        store = make_store(tmp_path)
+        await store.start()
+        try:
+            limit = RateLimit(rate=0.001, burst=2)
+            return [await store.take("key", limit) > 0 for _ in range(4)] + [await store.take("other", limit) > 0]
+        finally:
+            await store.stop()
+
+    assert asyncio.run(takes()) == [False, False, True, True, False]
+
+
+def test_memory_store_evicts_least_recently_used():
+    async def takes():
+        store = MemoryBucketStore(max_keys=2)
+        limit = RateLimit(rate=0.001, burst=1)
+        for key in ("a", "b", "a", "c"):
+            await store.take(key, limit)
+        return store
+
+    store = asyncio.run(takes())
+    assert list(store.buckets) == ["a", "c"]
+    assert store.counters["evicted"] == 1
@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+from starlette.requests import Request
+
+from controller import index as controller
+from services import upstream as upstream_module
+from services.cache import MemoryCacheStore, ResponseCache
+from services.resilience import CircuitBreaker, CircuitOpenError
+
+PRODUCTS = next(resource for resource in controller.RESOURCES if resource.name == "products")
+
+
+def test_gateway_errors_are_retried_then_returned(run_against_stub):
+    async def scenario(client, stub):
+        await stub.faults(down=1)
+        response = await client.fetch("/products/1")
+        return response.status, await stub.hits(), client.counters["retries"]
+
+    status, hits, retries = run_against_stub(scenario, retries=2, breaker_threshold=100)
+    assert status == 503
+    assert hits == 3
+    assert retries == 2
+
+
+def test_breaker_opens_probes_and_closes(run_against_stub):
+    async def scenario(client, stub):
+        breaker = client.breaker("products")
+        await stub.faults(down=1)
+        assert [(await client.fetch("/products/1")).status for _ in range(2)] == [503, 503]
+        assert breaker.state == CircuitBreaker.OPEN
+        with pytest.raises(CircuitOpenError):
+            await client.fetch("/products/1")
+        assert await stub.hits() == 2
+
+        # A failed half-open probe opens the breaker again
+        await asyncio.sleep(0.25)
+        assert (await client.fetch("/products/1")).status == 503
+        assert breaker.state == CircuitBreaker.OPEN
+        with pytest.raises(CircuitOpenError):
+            await client.fetch("/products/1")
+
+        # A successful probe closes it
+        await stub.faults(down=0)
+        await asyncio.sleep(0.25)
+        assert (await client.fetch("/products/1")).status == 200
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert (await client.fetch("/products/2")).status == 200
+        return breaker.opens, client.counters["short_circuited"]
+
+    opens, short_circuited = run_against_stub(
+        scenario, retries=0, breaker_threshold=2, breaker_reset=0.2
+    )
+    assert opens == 2
+    assert short_circuited == 2
+
+
+def test_deadline_becomes_504(monkeypatch, run_against_stub):
+    monkeypatch.setitem(upstream_module.ROUTE_DEADLINES, "item", 0.2)
+
+    async def scenario(client, stub):
+        await stub.faults(slow_rate=1, slow_delay=1)
+        payload, cacheable = await controller._fetch_item(PRODUCTS, 1)
+        return payload, cacheable, client.counters["deadline_exceeded"]
+
+    payload, cacheable, exceeded = run_against_stub(scenario)
+    assert payload["status_code"] == 504
+    assert not cacheable
+    assert exceeded == 1
+
+
+def test_stale_copy_is_served_when_the_upstream_fails(run_against_stub):
+    cache = ResponseCache(MemoryCacheStore(1 << 20), ttl=0.05, stale_while_revalidate=0, stale_if_error=60)
+    request = Request({"type": "http", "method": "GET", "path": "/api/products/1", "headers": []})
+
+    async def scenario(client, stub):
+        fresh = await cache.respond(request, "products/1", lambda: controller._fetch_item(PRODUCTS, 1))
+        await asyncio.sleep(0.1)
+        await stub.faults(down=1)
+        stale = await cache.respond(request, "products/1", lambda: controller._fetch_item(PRODUCTS, 1))
+        return fresh, stale
+
+    fresh, stale = run_against_stub(scenario, retries=0)
+    assert fresh.headers["x-cache"] == "MISS"
+    assert stale.headers["x-cache"] == "STALE-IF-ERROR"
+    assert stale.body == fresh.body
+    assert cache.counters["stale_if_error"] == 1
+
+
+def test_stats_count_requests_once_and_track_pool_use(run_against_stub):
+    async def scenario(client, stub):
+        await stub.faults(down=1)
+        await client.fetch("/products/1")
+        await stub.faults(down=0, slow_rate=1, slow_delay=0.3)
+        slow = asyncio.ensure_future(client.fetch("/products/2"))
+        await asyncio.sleep(0.1)
+        during = client.stats()
+        await slow
+        await stub.faults(slow_rate=0)
+        stream = await client.open("/products")
+        stream.release()
+        return during, client.stats()
+
+    during, after = run_against_stub(scenario, retries=1, breaker_threshold=100)
+    assert during["in_use"] == 1
+    assert after["requests"] == 3
+    assert after["retries"] == 1
+    assert after["in_use"] == 0
@@ -0,0 +1,70 @@
+import httpx
+import pytest
+from fastapi import APIRouter
+
+from controller import index as controller
+from factory import create_app
+from services.cache import MemoryCacheStore, ResponseCache
+
+HEADERS = {"Authorization": "Bearer test"}
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(controller, "response_cache", ResponseCache(MemoryCacheStore(1 << 20), ttl=60, stale_while_revalidate=0))
+
+
+def against_app(run_against_stub, requests):
+    """Send ``requests`` (path, params) through the app in order; responses and upstream hits after each"""
+    app = create_app("serverless")
+
+    async def scenario(client, stub):
+        transport = httpx.ASGITransport(app=app)
+        results = []
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", headers=HEADERS) as http:
+            for path, params in requests:
+                response = await http.get(path, params=params)
+                results.append((response, await stub.hits()))
+        return results
+
+    return run_against_stub(scenario, retries=0)
+
+
+def test_declared_resource_lists_with_limit_skip_and_fields(run_against_stub):
+    (page, _), (projected, _) = against_app(run_against_stub, [
+        ("/api/comments", {"limit": 5, "skip": 10}),
+        ("/api/comments", {"limit": 3, "fields": "id,body"}),
+    ])
+    body = page.json()
+    assert body["status_code"] == 200
+    assert [item["id"] for item in body["data"]] == [11, 12, 13, 14, 15]
+    assert projected.json()["data"] == [{"id": number, "body": f"Comment {number}"} for number in (1, 2, 3)]
+
+
+def test_declared_resource_is_cached(run_against_stub):
+    (first, hits_first), (second, hits_second), (item, _), (cached_item, hits_last) = against_app(run_against_stub, [
+        ("/api/comments", {"limit": 2}),
+        ("/api/comments", {"limit": 2}),
+        ("/api/comments/7", {}),
+        ("/api/comments/7", {}),
+    ])
+    assert (first.headers["x-cache"], second.headers["x-cache"]) == ("MISS", "HIT")
+    assert second.content == first.content
+    assert hits_second == hits_first == 1
+    assert item.json()["data"]["id"] == 7
+    assert cached_item.headers["x-cache"] == "HIT"
+    assert hits_last == 2
+
+
+def test_declared_resource_has_a_batch_route(run_against_stub):
+    ((response, hits),) = against_app(run_against_stub, [("/api/comments/batch", {"ids": "2,1,2"})])
+    body = response.json()
+    assert body["status_code"] == 200
+    assert [item["id"] for item in body["data"]] == [2, 1]
+    assert hits == 2
+
+
+def test_a_new_declaration_gets_all_three_routes():
+    router = APIRouter()
+    controller.add_resource(router, controller.UpstreamResource("quotes"))
+    assert {route.path for route in router.routes} == {"/quotes", "/quotes/batch", "/quotes/{item_id:int}"}
@@ -0,0 +1,35 @@
+import importlib.util
+import sys
+
+import pytest
+
+BLOCKED = {"orjson": [], "msgspec": ["orjson"], "json": ["orjson", "msgspec"]}
+
+
+def load_serializer(backend, monkeypatch):
+    """A fresh copy of services.serializer with the faster backends hidden"""
+    if backend != "json":
+        pytest.importorskip(backend)
+    for name in BLOCKED[backend]:
+        monkeypatch.setitem(sys.modules, name, None)
+    spec = importlib.util.spec_from_file_location("serializer_" + backend, "services/serializer.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    assert module.BACKEND == backend
+    return module
+
+
+@pytest.mark.parametrize("backend", ["orjson", "msgspec", "json"])
+def test_round_trip(backend, monkeypatch):
+    serializer = load_serializer(backend, monkeypatch)
+    value = {"message": "héllo", "id": 3, "tags": [None, True, 1.5]}
+    assert serializer.loads(serializer.dumps(value)) == value
+    assert serializer.loads(serializer.dumps_str(value)) == value
+
+
+@pytest.mark.parametrize("backend", ["orjson", "msgspec", "json"])
+@pytest.mark.parametrize("data", [b"{not json", b"", "[1,", b"\xff"])
+def test_bad_input_raises_value_error(backend, data, monkeypatch):
+    serializer = load_serializer(backend, monkeypatch)
+    with pytest.raises(ValueError):
+        serializer.loads(data)
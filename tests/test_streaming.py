@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from services.streaming import ArrayItemScanner
+
+ITEMS = [
+    {"id": 1, "title": "Quote \" inside", "tags": ["a", "b"]},
+    {"id": 2, "title": "Backslash \\ and \\\" together", "nested": {"list": [[1], {"x": "]}"}]}},
+    {"id": 3, "title": "Brackets ]}[{ in a string", "note": "ends with a backslash \\"},
+    {"id": 4, "title": "Unicode é ☃"},
+]
+BODY = json.dumps({"products": ITEMS, "total": 4, "skip": 0, "limit": 4}, ensure_ascii=False).encode()
+
+
+def scan(chunks, key="products"):
+    scanner = ArrayItemScanner(key)
+    items = []
+    for chunk in chunks:
+        items.extend(scanner.feed(chunk))
+    return [json.loads(item) for item in items], scanner.finish()
+
+
+def test_whole_body():
+    items, outer = scan([BODY])
+    assert items == ITEMS
+    assert outer == {"total": 4, "skip": 0, "limit": 4}
+
+
+def test_every_split_point():
+    # Covers escapes, quotes and brackets cut between two chunks
+    for split in range(1, len(BODY)):
+        assert scan([BODY[:split], BODY[split:]])[0] == ITEMS, split
+
+
+def test_escape_at_the_end_of_a_chunk():
+    backslash = BODY.index(b"\\")
+    items, _ = scan([BODY[:backslash + 1], BODY[backslash + 1:backslash + 2], BODY[backslash + 2:]])
+    assert items == ITEMS
+
+
+def test_byte_by_byte():
+    items, outer = scan([BODY[index:index + 1] for index in range(len(BODY))])
+    assert items == ITEMS
+    assert outer["total"] == 4
+
+
+@pytest.mark.parametrize("body", [b'{"products":[],"total":0}', b'{ "products" : [ ] , "total" : 0 }'])
+def test_empty_array(body):
+    assert scan([body]) == ([], {"total": 0})
+    assert scan([body[index:index + 1] for index in range(len(body))]) == ([], {"total": 0})
+
+
+def test_key_nested_elsewhere_is_not_the_array():
+    body = json.dumps({"meta": {"products": [{"id": 9}]}, "products": [{"id": 1}], "total": 1}).encode()
+    items, outer = scan([body])
+    assert items == [{"id": 1}]
+    assert outer == {"meta": {"products": [{"id": 9}]}, "total": 1}
+
+
+def test_missing_array_fails_on_finish():
+    with pytest.raises(ValueError):
+        scan([b'{"message":"not found"}'])